@@ -0,0 +1,207 @@
+import asyncio
+import contextlib
+import importlib.util
+from typing import Awaitable, Callable, Iterable
+
+from api.uploader import UPLOAD_STAGES, UploadError, UploadJob
+from instrumentation.timing import span
+
+# httpx is only needed for asynchronous uploads, the threaded Uploader works without it
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+# Requests allowed in flight at once per endpoint
+DEFAULT_ENDPOINT_LIMITS = {'metadata': 32, 'pdf': 16, 'cloud': 32}
+
+# httpcore's pool does work quadratic in its connections on every request, so articles in
+# flight are spread over several clients with at most this many connections each
+CONNECTIONS_PER_CLIENT = 8
+
+
+class AsyncUploader:
+    """Uploads a backlog of articles concurrently over keep-alive httpx.AsyncClients
+
+    Up to `max_in_flight` articles are uploaded at once. Each article's stages always run in
+    `UPLOAD_STAGES` order (metadata, then pdf, then the cloud confirmation), and never for two
+    jobs of the same DOI at the same time, while every endpoint has its own limit on requests
+    in flight. HTTP/2 is used if the h2 package is installed and the server offers it.
+    Failed calls are retried with exponential backoff.
+
+    Use it over the threaded Uploader only to keep more articles in flight than threads allow
+    against a slow API, see `bench_async_uploader`.
+
+    Args:
+        * paper_endpoint (str) : URL the pdf is posted to
+        * meta_endpoint (str) : URL the metadata JSON is posted to
+        * cloud_endpoint (str) : URL prefix for the cloud upload confirmation, the job name is appended
+        * max_in_flight (int, optional) : Articles uploaded concurrently. Defaults to 32.
+        * endpoint_limits (dict, optional) : Requests in flight per stage, see `DEFAULT_ENDPOINT_LIMITS`.
+            Stages left out keep their default.
+        * http2 (bool, optional) : Negotiate HTTP/2 when h2 is installed. Defaults to True.
+        * max_retries (int, optional) : Attempts per call after the first one. Defaults to 3.
+        * backoff_s (float, optional) : Initial retry delay, doubled after each attempt. Defaults to 1.
+        * timeout (int, optional) : Per request timeout in seconds. Defaults to 20.
+        * on_complete (Callable, optional) : Called with the job after its cloud upload was confirmed
+        * on_error (Callable, optional) : Called with the job and the exception when a job fails
+        * on_progress (Callable, optional) : Called with the job and the stage name each time one of
+            its stages completes
+        * transport (httpx.AsyncBaseTransport, optional) : Transport for the clients, e.g. for tests.
+            Defaults to httpx's network transport.
+
+    Raises:
+        ImportError: If httpx is not installed
+    """
+
+    def __init__(self,
+                 paper_endpoint: str,
+                 meta_endpoint: str,
+                 cloud_endpoint: str,
+                 max_in_flight: int = 32,
+                 endpoint_limits: 'dict[str, int]' = None,
+                 http2: bool = True,
+                 max_retries: int = 3,
+                 backoff_s: float = 1,
+                 timeout: int = 20,
+                 on_complete: Callable[[UploadJob], None] = None,
+                 on_error: Callable[[UploadJob, Exception], None] = None,
+                 on_progress: Callable[[UploadJob, str], None] = None,
+                 transport: 'httpx.AsyncBaseTransport' = None) -> None:
+
+        if httpx is None:
+            raise ImportError('Asynchronous uploads need httpx, install it with `pip install httpx[http2]`')
+
+        self._paper_endpoint = paper_endpoint
+        self._meta_endpoint = meta_endpoint
+        self._cloud_endpoint = cloud_endpoint
+        self._max_in_flight = max_in_flight
+        self._endpoint_limits = {**DEFAULT_ENDPOINT_LIMITS, **(endpoint_limits or {})}
+        self._max_retries = max_retries
+        self._backoff_s = backoff_s
+        self._timeout = timeout
+        self._on_complete = on_complete
+        self._on_error = on_error
+        self._on_progress = on_progress
+        self._transport = transport
+
+        self._http2 = http2 and importlib.util.find_spec('h2') is not None
+
+        self.completed = 0
+        self.failed = 0
+
+    def run(self, jobs: Iterable[UploadJob]) -> None:
+        """Uploads every job and returns once all have finished or failed"""
+        asyncio.run(self.upload_all(jobs))
+
+    async def upload_all(self, jobs: Iterable[UploadJob]) -> None:
+        """Uploads every job with at most `max_in_flight` at once, see `run`"""
+        limits = httpx.Limits(max_connections=CONNECTIONS_PER_CLIENT, max_keepalive_connections=CONNECTIONS_PER_CLIENT)
+        async with contextlib.AsyncExitStack() as stack:
+            self._clients = [
+                await stack.enter_async_context(
+                    httpx.AsyncClient(http2=self._http2, limits=limits, timeout=self._timeout, transport=self._transport)
+                )
+                for _ in range(-(-self._max_in_flight // CONNECTIONS_PER_CLIENT))
+            ]
+            # Every article in flight holds a slot, and the slots share out the clients evenly
+            self._slots = asyncio.Queue()
+            for slot in range(self._max_in_flight):
+                self._slots.put_nowait(slot)
+            self._stage_limits = {stage: asyncio.Semaphore(n) for stage, n in self._endpoint_limits.items()}
+            self._doi_locks = {}
+
+            # Only `max_in_flight` jobs are pulled from `jobs` at a time, so a generator is never read ahead
+            pending = set()
+            for job in jobs:
+                if len(pending) >= self._max_in_flight:
+                    _, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                pending.add(asyncio.create_task(self._upload_reporting(job)))
+            if pending:
+                await asyncio.wait(pending)
+
+    async def _upload_reporting(self, job: UploadJob) -> None:
+        lock = self._doi_locks.setdefault(job.doi, asyncio.Lock())
+        slot = await self._slots.get()
+        try:
+            async with lock:
+                await self.upload(job, self._clients[slot // CONNECTIONS_PER_CLIENT])
+        except Exception as e:
+            self.failed += 1
+            if self._on_error is not None:
+                self._on_error(job, e)
+            else:
+                print(f'Upload of {job.doi} failed: {e}')
+        else:
+            self.completed += 1
+            if self._on_complete is not None:
+                self._on_complete(job)
+        finally:
+            self._slots.put_nowait(slot)
+
+    async def upload(self, job: UploadJob, client: 'httpx.AsyncClient') -> None:
+        """Uploads the stages of `job` that are not in `job.completed`, one after the other
+
+        Args:
+            * job (UploadJob) : Article to upload
+            * client (httpx.AsyncClient) : Client the calls are made with
+
+        Raises:
+            UploadError: If any call still fails after all retries
+        """
+        for stage in UPLOAD_STAGES:
+            if stage in job.completed:
+                continue
+            with span(f'upload.{stage}'):
+                await self._send(stage, job, client)
+            job.completed.add(stage)
+            if self._on_progress is not None:
+                self._on_progress(job, stage)
+
+    async def _send(self, stage: str, job: UploadJob, client: 'httpx.AsyncClient') -> 'httpx.Response':
+        if stage == 'metadata':
+            def send():
+                return client.post(self._meta_endpoint, files={'file': (f'{job.name}.json', job.metadata)})
+        elif stage == 'pdf':
+            async def send():
+                # httpx streams the open file
+                with job.open() as pdf:
+                    return await client.post(self._paper_endpoint, files={'file': (f'{job.name}.pdf', pdf, 'application/pdf')})
+        else:
+            def send():
+                return client.get(self._cloud_endpoint + job.name)
+
+        async with self._stage_limits[stage]:
+            return await async_with_retries(send, f'{stage} upload of {job.name}', self._max_retries, self._backoff_s)
+
+
+async def async_with_retries(send: Callable[[], Awaitable['httpx.Response']], what: str, max_retries: int = 3, backoff_s: float = 1) -> 'httpx.Response':
+    """Awaits `send()` until it returns a successful response, see `uploader.with_retries`
+
+    Raises:
+        UploadError: If the request is rejected or still fails after all retries
+    """
+    delay = backoff_s
+    last_error = None
+
+    for attempt in range(max_retries + 1):
+        if attempt > 0:
+            await asyncio.sleep(delay)
+            delay *= 2
+        try:
+            response = await send()
+        except httpx.TransportError as e:
+            last_error = e
+            continue
+
+        # Client errors won't improve with another attempt
+        if response.is_success or 400 <= response.status_code < 500:
+            break
+        last_error = UploadError(f'Status code was {response.status_code}')
+    else:
+        raise UploadError(f'{what} failed after {max_retries + 1} attempts') from last_error
+
+    if not response.is_success:
+        raise UploadError(f'{what} was rejected with status code {response.status_code}')
+
+    return response
@@ -0,0 +1,197 @@
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Iterable
+
+import requests
+
+from api.uploader import UploadError, with_retries
+from instrumentation.timing import span
+
+# SQLite caps the number of bound parameters per statement, so batch lookups are chunked
+_MAX_PARAMS = 900
+
+
+class DoiIndex:
+    """Persistent local set of DOIs that are already stored on the aaronskit API
+
+    The index sits in front of the per-article `checkdoi` endpoint. It is filled in bulk
+    from the API, updated after every successful upload and answers membership for a whole
+    search batch with a single query, so only DOIs it has never seen go over the network.
+    DOIs are case-insensitive, the index holds them normalised by `normalise_doi` and answers
+    with the DOIs as the caller spelled them.
+
+    Args:
+        * path (Path, optional) : Location of the SQLite database. Defaults to `doi_index.sqlite3`.
+        * session (requests.Session, optional) : Session used for API lookups. One is created if not given.
+        * timeout (int, optional) : Per request timeout in seconds. Defaults to 20.
+    """
+
+    _path : Path = None
+
+    _conn : sqlite3.Connection = None
+
+    _session : requests.Session = None
+
+    _lock : threading.Lock = None
+
+    def __init__(self, path: Path = Path('doi_index.sqlite3'), session: requests.Session = None, timeout: int = 20) -> None:
+        self._path = Path(path)
+        # Upload workers record confirmed DOIs from their own threads
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self._path), check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS stored_doi (doi TEXT PRIMARY KEY) WITHOUT ROWID')
+        self._conn.commit()
+        self._normalise_stored()
+        self._session = session or requests.Session()
+        self._timeout = timeout
+
+    def _normalise_stored(self) -> None:
+        # Indexes written before DOIs were normalised are converted once
+        if self._conn.execute('PRAGMA user_version').fetchone()[0] >= 1:
+            return
+        with self._conn:
+            self._conn.create_function('normalise_doi', 1, normalise_doi, deterministic=True)
+            self._conn.execute('UPDATE OR IGNORE stored_doi SET doi = normalise_doi(doi) WHERE doi != normalise_doi(doi)')
+            # Spellings whose normalised DOI was already there
+            self._conn.execute('DELETE FROM stored_doi WHERE doi != normalise_doi(doi)')
+            self._conn.execute('PRAGMA user_version = 1')
+
+    def __contains__(self, doi: str) -> bool:
+        with self._lock:
+            row = self._conn.execute('SELECT 1 FROM stored_doi WHERE doi = ?', (normalise_doi(doi),)).fetchone()
+        return row is not None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM stored_doi').fetchone()[0]
+
+    def add(self, doi: str) -> None:
+        """Records a single DOI as stored, e.g. after a confirmed upload"""
+        self.add_many([doi])
+
+    def add_many(self, dois: Iterable[str]) -> None:
+        """Records many DOIs as stored in one transaction"""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                'INSERT OR IGNORE INTO stored_doi (doi) VALUES (?)',
+                ((normalise_doi(d),) for d in dois)
+            )
+
+    def known(self, dois: 'list[str]') -> 'set[str]':
+        """Returns the subset of `dois` that the local index already holds"""
+        normalised = list({normalise_doi(d) for d in dois})
+        found = set()
+        with self._lock:
+            for i in range(0, len(normalised), _MAX_PARAMS):
+                chunk = normalised[i:i + _MAX_PARAMS]
+                marks = ','.join('?' * len(chunk))
+                found.update(
+                    r[0] for r in self._conn.execute(f'SELECT doi FROM stored_doi WHERE doi IN ({marks})', chunk)
+                )
+        return {d for d in dois if normalise_doi(d) in found}
+
+    def refresh_from_api(self, endpoint: str) -> int:
+        """Fills the index in bulk from an API listing of stored articles
+
+        Args:
+            * endpoint (str) : URL returning a JSON list of article records (with a `doi`/`DOI` key) or bare DOI strings
+
+        Returns:
+            int: Number of DOIs in the index after the refresh
+
+        Raises:
+            UploadError: If the listing cannot be fetched
+        """
+        response = with_retries(lambda: self._session.get(endpoint, timeout=self._timeout), 'DOI listing')
+        records = response.json()
+
+        self.add_many(_extract_doi(r) for r in records if _extract_doi(r))
+
+        return len(self)
+
+    def check(self, doi: str, endpoint: str) -> bool:
+        """Checks a single DOI against the local index, falling back to the API's `checkdoi` endpoint
+
+        Args:
+            * doi (str) : DOI to look up
+            * endpoint (str) : `checkdoi` endpoint prefix, the DOI is appended to it
+
+        Returns:
+            bool: True if the DOI is already stored
+        """
+        return doi in self.check_batch([doi], endpoint)
+
+    def check_batch(self, dois: 'list[str]', endpoint: str) -> 'set[str]':
+        """Resolves which DOIs of a search batch are already stored, see `lookup_batch`
+
+        Returns:
+            set[str]: DOIs that are already stored
+        """
+        return self.lookup_batch(dois, endpoint)[0]
+
+    def lookup_batch(self, dois: 'list[str]', endpoint: str) -> 'tuple[set[str], set[str]]':
+        """Resolves which DOIs of a search batch are already stored
+
+        The local index is consulted once for the whole batch. Only DOIs it has never seen are
+        sent to the API, over the index's pooled session, with retries. Only a successful response
+        that is not empty counts as stored, and if its records carry a `doi`/`DOI` key one of
+        them has to be this DOI. Only those are written back, DOIs whose lookup still fails are
+        neither stored nor cached.
+
+        Args:
+            * dois (list[str]) : DOIs of the search batch
+            * endpoint (str) : `checkdoi` endpoint prefix, the DOI is appended to it
+
+        Returns:
+            tuple: DOIs that are already stored, and DOIs whose lookup failed
+        """
+        stored = self.known(dois)
+        failed = set()
+
+        newly_stored = []
+        for doi in dois:
+            if doi in stored:
+                continue
+            try:
+                with span('api.check_doi'):
+                    response = with_retries(lambda: self._session.get(endpoint + doi, timeout=self._timeout), f'lookup of {doi}')
+                records = response.json()
+            except (UploadError, ValueError) as e:
+                print("Lookup of %s failed: %s" % (doi, e))
+                failed.add(doi)
+                continue
+            if _lists_doi(records, doi):
+                newly_stored.append(doi)
+
+        self.add_many(newly_stored)
+        stored.update(newly_stored)
+
+        return stored, failed
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+def normalise_doi(doi: str) -> str:
+    """The form DOIs are kept in, they are case-insensitive"""
+    return doi.strip().lower()
+
+
+def _lists_doi(records, doi: str) -> bool:
+    if not isinstance(records, list):
+        records = [records] if records else []
+    dois = [_extract_doi(r) for r in records]
+    if not any(dois):
+        # Records without a DOI key, the API said no more than that something is stored
+        return bool(records)
+    return normalise_doi(doi) in {normalise_doi(d) for d in dois if d}
+
+
+def _extract_doi(record) -> str:
+    if isinstance(record, str):
+        return record
+    if isinstance(record, dict):
+        return record.get('doi') or record.get('DOI')
+    return None
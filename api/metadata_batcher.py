@@ -0,0 +1,223 @@
+import json
+import threading
+from pathlib import Path
+from time import monotonic, strftime
+from typing import BinaryIO, Callable
+
+import requests
+
+from api.uploader import with_retries
+from instrumentation.timing import span
+from scraper.text_normalisation import parse_author_name
+
+# orjson serialises several times faster and its output is compact already
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def encode_metadata(record: dict) -> bytes:
+    """Encodes a metadata record as compact single-line JSON, with orjson if it is installed"""
+    if orjson is not None:
+        return orjson.dumps(record)
+    return json.dumps(record, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def api_metadata(content_data: dict, category_id: str = '100') -> dict:
+    """Builds the API's metadata record from an article's content data
+
+    Args:
+        * content_data (dict) : The landing page's `contentData`, or metadata read from the pdf, with
+            `doi`, `displayTitle`, `authors`, `journal` and `year`
+        * category_id (str, optional) : Category the article is filed under. Defaults to '100'.
+    """
+    initial, surname = parse_author_name(content_data['authors'][0] if content_data['authors'] else '')
+    return {
+        "JournalName": content_data['journal'],
+        "AuthorInitial": initial,
+        "AuthorSurname": surname,
+        "Title": content_data['displayTitle'].lower(),
+        "YearPublished": content_data['year'],
+        "CategoryID": category_id,
+        "DOI": content_data['doi'],
+    }
+
+
+class MetadataBatcher:
+    """Buffers article metadata and posts it to the API as JSONL batches
+
+    Each record is one line of compact JSON. A batch is flushed as a single multipart
+    `.jsonl` file once it holds `max_records` records or `max_bytes` bytes, or once its
+    oldest record has waited `max_age_s` seconds. Every batch the API accepted is also
+    appended to a local log, so the log holds each record that reached the API, once per
+    accepted post. Records of failed batches are only logged once they are sent again.
+
+    Args:
+        * meta_endpoint (str) : URL the batches are posted to
+        * log_path (Path, optional) : Append-only JSONL log of every accepted record. Defaults to no log.
+        * max_records (int, optional) : Records per batch. Defaults to 500.
+        * max_bytes (int, optional) : Bytes per batch. Defaults to 1 MiB.
+        * max_age_s (float, optional) : Longest a record waits before its batch is flushed. Defaults to 5.
+        * session (requests.Session, optional) : Session to post with. Defaults to a new one.
+        * max_retries (int, optional) : Attempts per post after the first one. Defaults to 3.
+        * backoff_s (float, optional) : Initial retry delay, doubled after each attempt. Defaults to 1.
+        * timeout (int, optional) : Per request timeout in seconds. Defaults to 20.
+        * on_flush (Callable, optional) : Called with the DOIs of each batch once it was accepted
+        * on_error (Callable, optional) : Called with the DOIs and the exception when a batch fails
+    """
+
+    _buffer : 'list[bytes]' = None
+
+    _dois : 'list[str]' = None
+
+    _log : BinaryIO = None
+
+    _lock : threading.Lock = None
+
+    def __init__(self,
+                 meta_endpoint: str,
+                 log_path: Path = None,
+                 max_records: int = 500,
+                 max_bytes: int = 1024 * 1024,
+                 max_age_s: float = 5,
+                 session: requests.Session = None,
+                 max_retries: int = 3,
+                 backoff_s: float = 1,
+                 timeout: int = 20,
+                 on_flush: Callable[['list[str]'], None] = None,
+                 on_error: Callable[['list[str]', Exception], None] = None) -> None:
+
+        self._meta_endpoint = meta_endpoint
+        self._max_records = max_records
+        self._max_bytes = max_bytes
+        self._max_age_s = max_age_s
+        self._session = session if session is not None else requests.Session()
+        self._max_retries = max_retries
+        self._backoff_s = backoff_s
+        self._timeout = timeout
+        self._on_flush = on_flush
+        self._on_error = on_error
+
+        self._buffer = []
+        self._dois = []
+        self._size = 0
+        self._oldest = None
+        self._closed = False
+
+        self.batches = 0
+        self.records = 0
+        self.bytes_sent = 0
+
+        self._log = Path(log_path).open(mode='ab') if log_path is not None else None
+
+        self._lock = threading.Lock()
+        # Posts are serialised so batches reach the API in the order they were cut
+        self._post_lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._timer = threading.Thread(target=self._flush_when_due, name='metadata-batcher', daemon=True)
+        self._timer.start()
+
+    def add(self, doi: str, metadata: 'bytes | dict') -> None:
+        """Adds one article's metadata, flushing the batch if it is full
+
+        Args:
+            * doi (str) : DOI of the article, passed to the callbacks
+            * metadata (bytes or dict) : The record, as a dict or encoded JSON
+        """
+        if isinstance(metadata, bytes):
+            metadata = metadata.strip()
+            # Records encoded over several lines, e.g. with an indent, would break the JSONL
+            if b'\n' in metadata:
+                metadata = encode_metadata(json.loads(metadata))
+        else:
+            metadata = encode_metadata(metadata)
+        line = metadata + b'\n'
+
+        with self._lock:
+            self._buffer.append(line)
+            self._dois.append(doi)
+            self._size += len(line)
+            if self._oldest is None:
+                self._oldest = monotonic()
+                self._wakeup.notify()
+
+            batch = self._cut() if len(self._buffer) >= self._max_records or self._size >= self._max_bytes else None
+
+        if batch is not None:
+            self._post(*batch)
+
+    def flush(self) -> None:
+        """Posts whatever is buffered now"""
+        with self._lock:
+            batch = self._cut()
+        if batch is not None:
+            self._post(*batch)
+
+    def close(self) -> None:
+        """Flushes the last batch and stops the timer"""
+        with self._lock:
+            self._closed = True
+            self._wakeup.notify()
+        self._timer.join()
+        self.flush()
+        if self._log is not None:
+            self._log.close()
+
+    def __enter__(self) -> 'MetadataBatcher':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _cut(self) -> 'tuple[list[str], bytes]':
+        # Called with the lock held
+        if not self._buffer:
+            return None
+        batch = (self._dois, b''.join(self._buffer))
+        self._buffer, self._dois, self._size, self._oldest = [], [], 0, None
+        return batch
+
+    def _flush_when_due(self) -> None:
+        while True:
+            with self._lock:
+                while not self._closed and (self._oldest is None or monotonic() - self._oldest < self._max_age_s):
+                    self._wakeup.wait(None if self._oldest is None else self._max_age_s - (monotonic() - self._oldest))
+                if self._closed:
+                    return
+                batch = self._cut()
+            if batch is not None:
+                self._post(*batch)
+
+    def _post(self, dois: 'list[str]', body: bytes) -> None:
+        filename = f'metadata-{strftime("%Y%m%dT%H%M%S")}-{len(dois)}.jsonl'
+        with self._post_lock:
+            try:
+                with span('upload.metadata_batch'):
+                    with_retries(
+                        lambda: self._session.post(
+                            self._meta_endpoint,
+                            files={'file': (filename, body, 'application/x-ndjson')},
+                            timeout=self._timeout
+                        ),
+                        f'metadata batch of {len(dois)} records',
+                        self._max_retries,
+                        self._backoff_s
+                    )
+            except Exception as e:
+                if self._on_error is not None:
+                    self._on_error(dois, e)
+                else:
+                    print(f'Metadata batch of {len(dois)} records failed: {e}')
+                return
+
+            self.batches += 1
+            self.records += len(dois)
+            self.bytes_sent += len(body)
+            # Still under the post lock, so batches are logged in the order they were accepted
+            if self._log is not None:
+                self._log.write(body)
+                self._log.flush()
+
+        if self._on_flush is not None:
+            self._on_flush(dois)
@@ -0,0 +1,148 @@
+"""Local stand-in for the aaronskit API
+
+Implements the four endpoints `main.py` talks to with in-memory state, so the upload
+pipeline can be exercised and measured without touching the live service:
+
+    python -m api.stub_server --port 8000
+"""
+import argparse
+import json
+import re
+import threading
+from time import sleep
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+_filename_regex = re.compile(rb'filename="(?P<name>[^"]+)"')
+
+
+class StubApiState:
+    """Records what the stub API has received, and how long each reply is held back"""
+
+    def __init__(self, latency_s: float = 0) -> None:
+        self.latency_s = latency_s
+        self.lock = threading.Lock()
+        self.papers = {}
+        self.metadata = {}
+        self.confirmed = set()
+        self.requests = 0
+        self.bytes_received = 0
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+
+    # Every reply has a Content-Length, so connections are kept alive like the real API's
+    protocol_version = 'HTTP/1.1'
+
+    state : StubApiState = None
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def _reply(self, status: int, body) -> None:
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self) -> None:
+        sleep(self.state.latency_s)
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+
+        with self.state.lock:
+            self.state.requests += 1
+
+            if url.path == '/api/articles/doi':
+                doi = query.get('checkdoi', [''])[0]
+                if doi:
+                    records = [self.state.metadata[doi]] if doi in self.state.confirmed else []
+                else:
+                    records = [self.state.metadata[d] for d in self.state.confirmed]
+                return self._reply(200, records)
+
+            if url.path == '/api/upload-pdf':
+                name = query.get('paperDOI', [''])[0]
+                doi = name.replace('_', '/', 1)
+                if name not in self.state.papers or doi not in self.state.metadata:
+                    return self._reply(404, {'error': f'{name} has not been uploaded'})
+                self.state.confirmed.add(doi)
+                return self._reply(200, {'stored': doi})
+
+        self._reply(404, {'error': 'unknown endpoint'})
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        sleep(self.state.latency_s)
+
+        match = _filename_regex.search(body)
+        filename = match['name'].decode('utf-8') if match else ''
+
+        with self.state.lock:
+            self.state.requests += 1
+            self.state.bytes_received += length
+
+            if self.path == '/api/upload-paper-droplet':
+                self.state.papers[filename.rsplit('.', 1)[0]] = length
+                return self._reply(200, {'file': filename})
+
+            if self.path == '/api/upload-metadata':
+                records = _records_from_multipart(body)
+                for r in records:
+                    self.state.metadata[r['DOI']] = r
+                return self._reply(200, {'records': len(records)})
+
+        self._reply(404, {'error': 'unknown endpoint'})
+
+
+def _records_from_multipart(body: bytes) -> 'list[dict]':
+    # Everything between the part headers and the closing boundary is the uploaded document
+    start = body.index(b'\r\n\r\n') + 4
+    end = body.rindex(b'\r\n--')
+    document = body[start:end].decode('utf-8').strip()
+
+    if document.startswith('{') and '\n{' not in document:
+        return [json.loads(document)]
+    return [json.loads(line) for line in document.splitlines() if line.strip()]
+
+
+class _StubServer(ThreadingHTTPServer):
+    # Benchmarks open many connections at once, the default backlog of 5 drops some of them
+    request_queue_size = 256
+    daemon_threads = True
+
+
+def start_stub_server(port: int = 0, latency_s: float = 0) -> 'tuple[ThreadingHTTPServer, StubApiState, str]':
+    """Starts the stub API on a background thread
+
+    Args:
+        * port (int, optional) : Port to listen on, 0 picks a free one. Defaults to 0.
+        * latency_s (float, optional) : Time every request takes on the server side. Defaults to 0.
+
+    Returns:
+        tuple: The server (call `shutdown()` when done), its state and its base URL
+    """
+    state = StubApiState(latency_s)
+    handler = type('StubHandler', (_StubHandler,), {'state': state})
+    server = _StubServer(('127.0.0.1', port), handler)
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server, state, f'http://127.0.0.1:{server.server_port}'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0, help='Seconds every request takes')
+    args = parser.parse_args()
+
+    server, _, url = start_stub_server(args.port, args.latency)
+    print(f'Stub API listening on {url}')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,268 @@
+"""Pluggable transports for the aaronskit API
+
+Every API call goes through a requests.Session, so the transport is chosen by the adapter
+mounted on that session:
+
+    * live : straight to the service
+    * record : to the service, with every exchange appended to a cassette
+    * replay : answered from a cassette, nothing leaves the machine
+    * stub : sent to an in-process api.stub_server instead of the service
+
+Any of them can be wrapped with added latency and injected errors, so uploader concurrency
+and retries can be measured on a laptop.
+"""
+import base64
+import json
+import random
+import threading
+from collections import deque
+from functools import lru_cache
+from http import HTTPStatus
+from pathlib import Path
+from time import sleep
+from urllib.parse import urlsplit, urlunsplit
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+TRANSPORT_MODES = ('live', 'record', 'replay', 'stub')
+
+
+class CassetteMissError(requests.ConnectionError):
+    """A replayed request has no recorded response"""
+    pass
+
+
+def _build_response(request: requests.PreparedRequest, status: int, body: bytes, content_type: str = 'application/json') -> requests.Response:
+    response = requests.Response()
+    response.status_code = status
+    try:
+        response.reason = HTTPStatus(status).phrase
+    except ValueError:
+        response.reason = ''
+    response._content = body
+    response.headers = CaseInsensitiveDict({'Content-Type': content_type, 'Content-Length': str(len(body))})
+    response.encoding = 'utf-8'
+    response.url = request.url
+    response.request = request
+    return response
+
+
+def _body_size(request: requests.PreparedRequest) -> int:
+    # Streamed bodies, like the uploader's pdf posts, only have a length header
+    if 'Content-Length' in request.headers:
+        return int(request.headers['Content-Length'])
+    if isinstance(request.body, (bytes, str)):
+        return len(request.body)
+    return None
+
+
+class CassetteAdapter(BaseAdapter):
+    """Records API exchanges to a JSONL cassette, or replays them from one
+
+    Exchanges are keyed by method and URL. On replay each key's recorded responses are
+    served in order and the last one is repeated once they run out, so a short recording
+    can drive a longer load test. Request bodies are never written to the cassette, only
+    their size.
+
+    Args:
+        * path (Path) : Cassette file
+        * record (bool, optional) : Send to `inner` and append every exchange, rather than replay. Defaults to False.
+        * inner (BaseAdapter, optional) : Adapter recorded requests are sent through. Defaults to an HTTPAdapter.
+
+    Raises:
+        CassetteMissError: From `send` when replaying a request that was never recorded
+    """
+
+    _lock : threading.Lock = None
+
+    def __init__(self, path: Path, record: bool = False, inner: BaseAdapter = None) -> None:
+        super().__init__()
+        self._path = Path(path)
+        self._record = record
+        self._inner = inner if inner is not None else HTTPAdapter()
+        self._lock = threading.Lock()
+        self._recorded = {}
+
+        if not record:
+            with self._path.open(encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._recorded.setdefault((entry['method'], entry['url']), deque()).append(entry)
+
+    def send(self, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        if self._record:
+            return self._send_and_record(request, **kwargs)
+
+        with self._lock:
+            entries = self._recorded.get((request.method, request.url))
+            if not entries:
+                raise CassetteMissError(f'No recorded response for {request.method} {request.url}', request=request)
+            entry = entries.popleft() if len(entries) > 1 else entries[0]
+
+        body = base64.b64decode(entry['body_b64']) if 'body_b64' in entry else entry['body'].encode('utf-8')
+        return _build_response(request, entry['status'], body, entry.get('content_type', 'application/json'))
+
+    def _send_and_record(self, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        response = self._inner.send(request, **kwargs)
+        body = response.content
+
+        entry = {
+            'method': request.method,
+            'url': request.url,
+            'request_bytes': _body_size(request),
+            'status': response.status_code,
+            'content_type': response.headers.get('Content-Type', 'application/json'),
+        }
+        try:
+            entry['body'] = body.decode('utf-8')
+        except UnicodeDecodeError:
+            entry['body_b64'] = base64.b64encode(body).decode('ascii')
+
+        with self._lock, self._path.open(mode='a', encoding='utf-8') as f:
+            f.write(json.dumps(entry) + '\n')
+        return response
+
+    def close(self) -> None:
+        self._inner.close()
+
+
+@lru_cache(maxsize=None)
+def local_stub() -> tuple:
+    """The process-wide api.stub_server, started on a free port on first use
+
+    Returns:
+        tuple: The server, its StubApiState and its base URL
+    """
+    from api.stub_server import start_stub_server
+    return start_stub_server()
+
+
+def stub_url(url: str) -> str:
+    """`url` with its scheme and host replaced by the local stub's"""
+    parts = urlsplit(url)
+    return urlunsplit(('http', urlsplit(local_stub()[2]).netloc, parts.path, parts.query, parts.fragment))
+
+
+class StubAdapter(HTTPAdapter):
+    """Sends every request to a local api.stub_server instead of the host in its URL
+
+    All stub sessions of a process share one stub, so what one stage uploads another can check.
+    """
+
+    def __init__(self, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.server, self.state, _ = local_stub()
+
+    def send(self, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        # The caller's request keeps its URL, so a cassette recording through the stub stores the real one
+        request = request.copy()
+        request.url = stub_url(request.url)
+        return super().send(request, **kwargs)
+
+
+class FaultInjectingAdapter(BaseAdapter):
+    """Adds latency and injected failures in front of another adapter
+
+    Each request first waits `latency_s` plus up to `jitter_s`. It then fails with a
+    connection error with probability `drop_rate`, gets an `error_status` response with
+    probability `error_rate`, and is otherwise passed on to `inner`.
+
+    Args:
+        * inner (BaseAdapter) : Adapter the surviving requests are sent through
+        * latency_s (float, optional) : Added delay per request. Defaults to 0.
+        * jitter_s (float, optional) : Upper bound of a uniformly random extra delay. Defaults to 0.
+        * error_rate (float, optional) : Share of requests answered with `error_status`. Defaults to 0.
+        * error_status (int, optional) : Status of injected error responses. Defaults to 503.
+        * drop_rate (float, optional) : Share of requests failed with a connection error. Defaults to 0.
+        * seed (int, optional) : Seed for the injected faults, for repeatable runs. Defaults to None.
+    """
+
+    _lock : threading.Lock = None
+
+    def __init__(self,
+                 inner: BaseAdapter,
+                 latency_s: float = 0,
+                 jitter_s: float = 0,
+                 error_rate: float = 0,
+                 error_status: int = 503,
+                 drop_rate: float = 0,
+                 seed: int = None) -> None:
+        super().__init__()
+        self._inner = inner
+        self._latency_s = latency_s
+        self._jitter_s = jitter_s
+        self._error_rate = error_rate
+        self._error_status = error_status
+        self._drop_rate = drop_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.injected_errors = 0
+        self.injected_drops = 0
+
+    def send(self, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        with self._lock:
+            self.requests += 1
+            delay = self._latency_s + self._jitter_s * self._rng.random()
+            roll = self._rng.random()
+            drop = roll < self._drop_rate
+            error = not drop and roll < self._drop_rate + self._error_rate
+            self.injected_drops += drop
+            self.injected_errors += error
+
+        if delay > 0:
+            sleep(delay)
+        if drop:
+            raise requests.ConnectionError(f'Injected connection failure for {request.method} {request.url}', request=request)
+        if error:
+            return _build_response(request, self._error_status, json.dumps({'error': 'injected'}).encode('utf-8'))
+        return self._inner.send(request, **kwargs)
+
+    def close(self) -> None:
+        self._inner.close()
+
+
+def make_session(mode: str = 'live',
+                 cassette: Path = None,
+                 latency_s: float = 0,
+                 jitter_s: float = 0,
+                 error_rate: float = 0,
+                 drop_rate: float = 0,
+                 seed: int = None,
+                 pool_maxsize: int = 10) -> requests.Session:
+    """Creates a session whose requests go through the transport `mode`
+
+    Args:
+        * mode (str, optional) : One of `TRANSPORT_MODES`. Defaults to 'live'.
+        * cassette (Path, optional) : Cassette file, required for 'record' and 'replay'
+        * latency_s, jitter_s, error_rate, drop_rate, seed : Fault injection, see FaultInjectingAdapter.
+            Nothing is injected by default.
+        * pool_maxsize (int, optional) : Connections kept per host, at least the number of
+            concurrent requests. Defaults to 10.
+
+    Raises:
+        ValueError: If `mode` is unknown, or it needs a cassette and none was given
+        FileNotFoundError: If the cassette to replay does not exist
+    """
+    if mode not in TRANSPORT_MODES:
+        raise ValueError(f'Unknown transport {mode!r}, choose from {", ".join(TRANSPORT_MODES)}')
+    if mode in ('record', 'replay') and cassette is None:
+        raise ValueError(f'The {mode} transport needs a cassette file')
+
+    if mode == 'stub':
+        adapter = StubAdapter(pool_maxsize=pool_maxsize)
+    elif mode == 'live':
+        adapter = HTTPAdapter(pool_maxsize=pool_maxsize)
+    else:
+        adapter = CassetteAdapter(cassette, record=mode == 'record', inner=HTTPAdapter(pool_maxsize=pool_maxsize))
+
+    if latency_s or jitter_s or error_rate or drop_rate:
+        adapter = FaultInjectingAdapter(adapter, latency_s, jitter_s, error_rate, drop_rate=drop_rate, seed=seed)
+
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
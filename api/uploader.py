@@ -0,0 +1,309 @@
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from io import BytesIO
+from pathlib import Path
+from time import sleep
+from typing import BinaryIO, Callable
+from uuid import uuid4
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from instrumentation.timing import span, timed
+
+
+@dataclass
+class UploadJob:
+    """A single article waiting to be uploaded
+
+    Attributes:
+        * name (str) : File stem used for the uploaded files, the DOI with its first `/` replaced by `_`
+        * doi (str) : DOI of the article
+        * pdf_path (Path) : Location of the downloaded pdf on disk
+        * metadata (bytes) : Encoded metadata JSON document
+        * completed (set[str], optional) : Stages already done in an earlier run, out of
+            `metadata`, `pdf` and `cloud`. These are skipped.
+        * open_pdf (Callable, optional) : Opens the pdf instead of `pdf_path` on every attempt,
+            e.g. to stream it out of a `PackArchive`. The file object needs a `len` attribute.
+    """
+    name: str
+    doi: str
+    pdf_path: Path
+    metadata: bytes
+    completed: 'set[str]' = field(default_factory=set)
+    open_pdf: 'Callable[[], BinaryIO]' = None
+
+    def open(self) -> BinaryIO:
+        """Opens the pdf for binary reading"""
+        return self.open_pdf() if self.open_pdf is not None else open(self.pdf_path, 'rb')
+
+
+# Upload stages in the order they are reported
+UPLOAD_STAGES = ('metadata', 'pdf', 'cloud')
+
+
+class UploadError(Exception):
+    pass
+
+
+class _MultipartFileStream:
+    """File-like multipart/form-data body that streams a single open file
+
+    requests sends objects with `read` and `len` in chunks with a fixed Content-Length,
+    so the pdf is never loaded into memory as a whole. The file is closed with the body.
+    """
+
+    def __init__(self, field: str, filename: str, file: BinaryIO, content_type: str = 'application/pdf') -> None:
+        boundary = uuid4().hex
+        self.content_type = f'multipart/form-data; boundary={boundary}'
+
+        head = (
+            f'--{boundary}\r\n'
+            f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+            f'Content-Type: {content_type}\r\n\r\n'
+        ).encode('utf-8')
+        tail = f'\r\n--{boundary}--\r\n'.encode('utf-8')
+
+        self._file = file
+        self._parts = [BytesIO(head), self._file, BytesIO(tail)]
+        size = file.len if hasattr(file, 'len') else os.fstat(file.fileno()).st_size
+        self.len = len(head) + size + len(tail)
+
+    def read(self, size: int = -1) -> bytes:
+        chunks = []
+        while self._parts and (size < 0 or size > 0):
+            chunk = self._parts[0].read(size)
+            if not chunk:
+                self._parts.pop(0)
+                continue
+            chunks.append(chunk)
+            if size > 0:
+                size -= len(chunk)
+        return b''.join(chunks)
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class Uploader:
+    """Background upload pipeline for the aaronskit API
+
+    Jobs are put on a bounded queue and drained by a small pool of worker threads sharing
+    one pooled `requests.Session`. For each job the metadata and pdf posts run side by side,
+    then the cloud upload is confirmed. Failed calls are retried with exponential backoff.
+
+    Args:
+        * paper_endpoint (str) : URL the pdf is posted to
+        * meta_endpoint (str) : URL the metadata JSON is posted to
+        * cloud_endpoint (str) : URL prefix for the cloud upload confirmation, the job name is appended
+        * workers (int, optional) : Number of articles uploaded concurrently. Defaults to 4.
+        * max_pending (int, optional) : Queue size before `submit` blocks. Defaults to 32.
+        * max_retries (int, optional) : Attempts per call after the first one. Defaults to 3.
+        * backoff_s (float, optional) : Initial retry delay, doubled after each attempt. Defaults to 1.
+        * timeout (int, optional) : Per request timeout in seconds. Defaults to 20.
+        * on_complete (Callable, optional) : Called with the job after its cloud upload was confirmed
+        * on_error (Callable, optional) : Called with the job and the exception when a job fails
+        * on_progress (Callable, optional) : Called with the job and the stage name each time one of
+            its stages completes. Stages are always reported in `UPLOAD_STAGES` order.
+        * session (requests.Session, optional) : Session to upload with, e.g. from `transport.make_session`.
+            Its connection pool should hold two connections per worker. Defaults to a new one.
+    """
+
+    _session : requests.Session = None
+
+    _queue : queue.Queue = None
+
+    _workers : 'list[threading.Thread]' = None
+
+    _post_pool : ThreadPoolExecutor = None
+
+    def __init__(self,
+                 paper_endpoint: str,
+                 meta_endpoint: str,
+                 cloud_endpoint: str,
+                 workers: int = 4,
+                 max_pending: int = 32,
+                 max_retries: int = 3,
+                 backoff_s: float = 1,
+                 timeout: int = 20,
+                 on_complete: Callable[[UploadJob], None] = None,
+                 on_error: Callable[[UploadJob, Exception], None] = None,
+                 on_progress: Callable[[UploadJob, str], None] = None,
+                 session: requests.Session = None) -> None:
+
+        self._paper_endpoint = paper_endpoint
+        self._meta_endpoint = meta_endpoint
+        self._cloud_endpoint = cloud_endpoint
+        self._max_retries = max_retries
+        self._backoff_s = backoff_s
+        self._timeout = timeout
+        self._on_complete = on_complete
+        self._on_error = on_error
+        self._on_progress = on_progress
+
+        # Every worker can have a metadata and a pdf post in flight at once
+        self._owns_session = session is None
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=2, pool_maxsize=2 * workers)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        self._session = session
+
+        self._post_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='upload-post')
+
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._workers = [
+            threading.Thread(target=self._work, name=f'uploader-{i}', daemon=True)
+            for i in range(workers)
+        ]
+        for w in self._workers:
+            w.start()
+
+    def submit(self, job: UploadJob) -> None:
+        """Queues a job, blocking only if `max_pending` jobs are already waiting"""
+        self._queue.put(job)
+
+    def close(self) -> None:
+        """Waits for all queued jobs to finish and shuts the workers down"""
+        for _ in self._workers:
+            self._queue.put(None)
+        for w in self._workers:
+            w.join()
+        self._post_pool.shutdown()
+        if self._owns_session:
+            self._session.close()
+
+    def __enter__(self) -> 'Uploader':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _work(self) -> None:
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            try:
+                self.upload(job)
+            except Exception as e:
+                if self._on_error is not None:
+                    self._on_error(job, e)
+                else:
+                    print(f'Upload of {job.doi} failed: {e}')
+            else:
+                if self._on_complete is not None:
+                    self._on_complete(job)
+
+    def upload(self, job: UploadJob) -> None:
+        """Uploads a single job synchronously: metadata and pdf in parallel, then the cloud confirmation
+
+        Stages listed in `job.completed` are skipped, the rest are added to it as they finish.
+
+        Raises:
+            UploadError: If any call still fails after all retries
+        """
+        meta = None
+        if 'metadata' not in job.completed:
+            meta = self._post_pool.submit(self._post_metadata, job)
+
+        try:
+            if 'pdf' not in job.completed:
+                self._post_pdf(job)
+        finally:
+            # Metadata is reported first even if the pdf post finished earlier
+            if meta is not None:
+                meta.result()
+                self._completed(job, 'metadata')
+
+        self._completed(job, 'pdf')
+
+        if 'cloud' not in job.completed:
+            with span('upload.cloud'):
+                self._with_retries(
+                    lambda: self._session.get(self._cloud_endpoint + job.name, timeout=self._timeout),
+                    f'cloud upload of {job.name}'
+                )
+            self._completed(job, 'cloud')
+
+    def _completed(self, job: UploadJob, stage: str) -> None:
+        if stage in job.completed:
+            return
+        job.completed.add(stage)
+        if self._on_progress is not None:
+            self._on_progress(job, stage)
+
+    @timed('upload.pdf')
+    def _post_pdf(self, job: UploadJob) -> requests.Response:
+
+        def send():
+            body = _MultipartFileStream('file', f'{job.name}.pdf', job.open())
+            try:
+                return self._session.post(
+                    self._paper_endpoint,
+                    data=body,
+                    headers={'Content-Type': body.content_type},
+                    timeout=self._timeout
+                )
+            finally:
+                body.close()
+
+        return self._with_retries(send, f'pdf upload of {job.name}')
+
+    @timed('upload.metadata')
+    def _post_metadata(self, job: UploadJob) -> requests.Response:
+        return self._with_retries(
+            lambda: self._session.post(
+                self._meta_endpoint,
+                files={'file': (f'{job.name}.json', job.metadata)},
+                timeout=self._timeout
+            ),
+            f'metadata upload of {job.name}'
+        )
+
+    def _with_retries(self, send: Callable[[], requests.Response], what: str) -> requests.Response:
+        return with_retries(send, what, self._max_retries, self._backoff_s)
+
+
+def with_retries(send: Callable[[], requests.Response], what: str, max_retries: int = 3, backoff_s: float = 1) -> requests.Response:
+    """Calls `send` until it returns a successful response, with exponential backoff between attempts
+
+    Connection errors and server errors are retried, client errors are not.
+
+    Args:
+        * send (Callable) : Makes the request
+        * what (str) : Description of the request for error messages
+        * max_retries (int, optional) : Attempts after the first one. Defaults to 3.
+        * backoff_s (float, optional) : Initial retry delay, doubled after each attempt. Defaults to 1.
+
+    Raises:
+        UploadError: If the request is rejected or still fails after all retries
+    """
+    delay = backoff_s
+    last_error = None
+
+    for attempt in range(max_retries + 1):
+        if attempt > 0:
+            sleep(delay)
+            delay *= 2
+        try:
+            response = send()
+        except requests.RequestException as e:
+            last_error = e
+            continue
+
+        # Client errors won't improve with another attempt
+        if response.ok or 400 <= response.status_code < 500:
+            break
+        last_error = UploadError(f'Status code was {response.status_code}')
+    else:
+        raise UploadError(f'{what} failed after {max_retries + 1} attempts') from last_error
+
+    if not response.ok:
+        raise UploadError(f'{what} was rejected with status code {response.status_code}')
+
+    return response
@@ -0,0 +1,89 @@
+"""Draining an upload backlog with the threaded Uploader against the httpx AsyncUploader
+
+Both upload the same fixture pdfs to the stub API, run in its own process and holding
+every request for `--latency` seconds. The stub only confirms articles whose metadata and
+pdf it already has, so every article confirming shows the per-DOI ordering held:
+
+    python -m benchmarks.bench_async_uploader --n 500 --latency 0.05
+
+The stub and the uploader share the machine, so on a single core at low latency the CPU
+rather than the API's latency sets the ceiling for both.
+"""
+import argparse
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from time import perf_counter
+
+import requests
+
+from api.async_uploader import AsyncUploader, httpx
+from api.metadata_batcher import encode_metadata
+from api.uploader import Uploader, UploadJob
+from benchmarks.common import REPO_ROOT, load_fixture_pdfs
+
+
+def backlog(n: int, root: Path, prefix: str) -> 'list[UploadJob]':
+    pdfs = list(load_fixture_pdfs().items())
+    jobs = []
+    for i in range(n):
+        doi, data = pdfs[i % len(pdfs)]
+        doi = f'{doi}.{prefix}{i}'
+        name = doi.replace('/', '_', 1)
+        path = root.joinpath(name + '.pdf')
+        path.write_bytes(data)
+        jobs.append(UploadJob(name, doi, path, encode_metadata({'DOI': doi})))
+    return jobs
+
+
+def run(name: str, upload, jobs: 'list[UploadJob]', latency_s: float) -> None:
+    # A separate process, so the stub doesn't compete with the uploader for the GIL
+    stub = subprocess.Popen([sys.executable, '-u', '-m', 'api.stub_server', '--port', '0', '--latency', str(latency_s)],
+                            cwd=REPO_ROOT, stdout=subprocess.PIPE, text=True)
+    try:
+        base_url = stub.stdout.readline().split()[-1]
+        endpoints = (base_url + '/api/upload-paper-droplet', base_url + '/api/upload-metadata', base_url + '/api/upload-pdf?paperDOI=')
+
+        start = perf_counter()
+        upload(endpoints, jobs)
+        seconds = perf_counter() - start
+
+        confirmed = len(requests.get(base_url + '/api/articles/doi?checkdoi=').json())
+        print(f'{name:<28} {len(jobs) / seconds:>8.1f} articles/s {seconds:>8.2f}s   {confirmed}/{len(jobs)} confirmed')
+    finally:
+        stub.terminate()
+        stub.wait()
+
+
+def main(n: int, latency_s: float) -> None:
+    def threaded(workers):
+        def upload(endpoints, jobs):
+            with Uploader(*endpoints, workers=workers, backoff_s=0.05) as uploader:
+                for job in jobs:
+                    uploader.submit(job)
+        return upload
+
+    def asynchronous(in_flight):
+        def upload(endpoints, jobs):
+            AsyncUploader(*endpoints, max_in_flight=in_flight, backoff_s=0.05,
+                          endpoint_limits={stage: in_flight for stage in ('metadata', 'pdf', 'cloud')}).run(jobs)
+        return upload
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f'{n} articles, {latency_s * 1e3:.0f}ms per request')
+        for workers in (4, 16):
+            run(f'Uploader, {workers} workers', threaded(workers), backlog(n, Path(tmp), f't{workers}-'), latency_s)
+        if httpx is None:
+            print('httpx is not installed, skipping AsyncUploader')
+            return
+        for in_flight in (16, 32, 64, 128):
+            run(f'AsyncUploader, {in_flight} in flight', asynchronous(in_flight), backlog(n, Path(tmp), f'a{in_flight}-'), latency_s)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--n', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=0.05)
+    args = parser.parse_args()
+    main(args.n, args.latency)
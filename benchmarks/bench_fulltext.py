@@ -0,0 +1,79 @@
+"""Build time, size and query latency of the full-text index
+
+Indexes a synthetic corpus with Zipf-distributed terms, added in batches the way
+`index build` adds newly stored pdfs, then times BM25 queries of one to four terms:
+
+    python -m benchmarks.bench_fulltext --docs 20000 --words 3000
+"""
+import argparse
+import random
+import statistics
+import tempfile
+from collections import Counter
+from pathlib import Path
+from time import perf_counter
+
+import numpy as np
+
+from indexing.fulltext import FullTextIndex
+
+
+def synthetic_corpus(docs: int, words: int, vocabulary: int, seed: int = 0) -> 'list[tuple[str, dict[str, int]]]':
+    rng = np.random.default_rng(seed)
+    terms = np.array([f't{i}' for i in range(vocabulary)])
+    corpus = []
+    for i in range(docs):
+        length = max(int(rng.normal(words, words / 4)), 50)
+        ranks = np.minimum(rng.zipf(1.1, size=length), vocabulary) - 1
+        corpus.append((f'10.2307/{i}', dict(Counter(terms[ranks].tolist()))))
+    return corpus
+
+
+def main(docs: int, words: int, vocabulary: int, batch: int, queries: int) -> None:
+    corpus = synthetic_corpus(docs, words, vocabulary)
+    rng = random.Random(0)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        index = FullTextIndex(Path(tmp))
+        start = perf_counter()
+        for i in range(0, docs, batch):
+            index.add(corpus[i:i + batch])
+        build_s = perf_counter() - start
+
+        size = sum(p.stat().st_size for p in Path(tmp).rglob('*') if p.is_file())
+        raw = sum(len(counts) for _, counts in corpus) * 8
+        print(f'{docs} documents of ~{words} words, {vocabulary} distinct terms')
+        print(f'built in {build_s:.2f}s ({docs / build_s:.0f} docs/s), {index.segment_count} segments')
+        print(f'{size / 1e6:.1f} MB on disk, {raw / 1e6:.1f} MB as uncompressed (doc ID, tf) int32 pairs')
+
+        # Reopening maps the segments rather than reading them
+        start = perf_counter()
+        index = FullTextIndex(Path(tmp))
+        print(f'opened in {(perf_counter() - start) * 1e3:.1f}ms')
+
+        for n_terms in (1, 2, 4):
+            samples = []
+            for _ in range(queries):
+                # Mix of frequent and rare terms
+                query = ' '.join(f't{min(int(rng.paretovariate(0.5)), vocabulary) - 1}' for _ in range(n_terms))
+                start = perf_counter()
+                index.search(query, 10)
+                samples.append(perf_counter() - start)
+            samples.sort()
+            p95 = samples[int(len(samples) * 0.95) - 1]
+            print(f'{n_terms} term queries    p50 {statistics.median(samples) * 1e3:7.2f}ms   p95 {p95 * 1e3:7.2f}ms')
+
+        start = perf_counter()
+        index.merge()
+        print(f'full merge in {perf_counter() - start:.2f}s')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--docs', type=int, default=20000)
+    parser.add_argument('--words', type=int, default=3000, help='Mean tokens per document')
+    parser.add_argument('--vocabulary', type=int, default=200000)
+    parser.add_argument('--batch', type=int, default=1000, help='Documents per added segment')
+    parser.add_argument('--queries', type=int, default=200, help='Queries per query length')
+    args = parser.parse_args()
+    main(args.docs, args.words, args.vocabulary, args.batch, args.queries)
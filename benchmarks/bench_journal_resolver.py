@@ -0,0 +1,59 @@
+"""Journal name resolution: exact, fuzzy, cached and whole result sets
+
+Resolves catalogue names as listed, their titles alone, misspelt copies and the journals of
+the saved search page and landing page fixtures:
+
+    python -m benchmarks.bench_journal_resolver --repeat 20
+"""
+import argparse
+import random
+from time import perf_counter
+
+from benchmarks.common import load_landing_metadata, load_search_page, report, time_call
+from pipeline.journal_catalogue import JournalCatalogue
+from pipeline.journal_resolver import JournalResolver
+from scraper.page_parser import parse_search_page
+
+
+def misspell(name: str, rng: random.Random) -> str:
+    chars = list(name)
+    i = rng.randrange(len(chars) - 1)
+    chars[i], chars[i + 1] = chars[i + 1], chars[i]
+    return ''.join(chars)
+
+
+def main(repeat: int) -> None:
+    rng = random.Random(0)
+
+    start = perf_counter()
+    catalogue = JournalCatalogue(cache_path=None)
+    resolver = JournalResolver(catalogue)
+    print(f'{len(catalogue)} journals indexed in {(perf_counter() - start) * 1e3:.1f}ms, including parsing the lists')
+
+    names = [j.name for j in catalogue]
+    titles = [name.split(', ')[0] for name in names]
+    misspelt = [misspell(name, rng) for name in names]
+    page = parse_search_page(load_search_page())['Journal'].dropna().tolist()
+    landing = [record['journal'] for record in load_landing_metadata()]
+
+    for label, queries in (('listed names', names), ('titles alone', titles), ('misspelt names', misspelt)):
+        resolved = sum(resolver.resolve(q) is not None and resolver.resolve(q).name == n for q, n in zip(queries, names))
+        # Bypasses the cache, so this is the cost of a first lookup
+        timing = time_call(lambda: [resolver._resolve(q) for q in queries], repeat=repeat)
+        report(f'{label} ({resolved}/{len(names)} right)', timing, per=len(queries), unit='name')
+
+    report('cached lookups', time_call(lambda: [resolver.resolve(q) for q in names], repeat=repeat), per=len(names), unit='name')
+
+    for label, result_set in (('search page', page), ('landing pages', landing)):
+        batch = result_set * 40
+        # Starting from an empty cache, the distinct names are each looked up once
+        timing = time_call(lambda: (resolver._cache.clear(), resolver.resolve_many(batch)), repeat=repeat)
+        found = sum(r is not None for r in resolver.resolve_many(result_set))
+        report(f'{label} batch ({found}/{len(result_set)} known)', timing, per=len(batch), unit='name')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    main(args.repeat)
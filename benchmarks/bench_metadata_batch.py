@@ -0,0 +1,66 @@
+"""Requests and bytes needed to upload article metadata, one file per article against JSONL batches
+
+Posts synthetic records to the local stub API, first as one indented JSON file per article
+as main.py used to, then through MetadataBatcher:
+
+    python -m benchmarks.bench_metadata_batch --n 2000 --batch 500
+"""
+import argparse
+import json
+from time import perf_counter
+
+import requests
+
+from api.metadata_batcher import MetadataBatcher, encode_metadata
+from api.stub_server import start_stub_server
+
+
+def synthetic_records(n: int) -> 'list[dict]':
+    return [{
+        'JournalName': 'Journal of the Royal Statistical Society. Series A (Statistics in Society)',
+        'AuthorInitial': 'N',
+        'AuthorSurname': f'Best{i}',
+        'Title': f'bayesian approaches to randomized trials, part {i}',
+        'YearPublished': str(1950 + i % 70),
+        'CategoryID': '100',
+        'DOI': f'10.2307/{10**7 + i}',
+    } for i in range(n)]
+
+
+def run(name: str, upload) -> None:
+    server, state, base_url = start_stub_server()
+    try:
+        start = perf_counter()
+        upload(base_url + '/api/upload-metadata')
+        seconds = perf_counter() - start
+        print(f'{name:<24} {state.requests:>6} requests {state.bytes_received / 1e3:>10.1f} kB '
+              f'{seconds:>8.2f}s   {len(state.metadata)} records stored')
+    finally:
+        server.shutdown()
+
+
+def main(n: int, batch: int) -> None:
+    records = synthetic_records(n)
+
+    def per_article(endpoint):
+        with requests.Session() as s:
+            for r in records:
+                name = r['DOI'].replace('/', '_', 1)
+                s.post(endpoint, files={'file': (f'{name}.json', json.dumps(r, indent=2).encode('utf-8'))}).raise_for_status()
+
+    def batched(endpoint):
+        with MetadataBatcher(endpoint, max_records=batch) as batcher:
+            for r in records:
+                batcher.add(r['DOI'], encode_metadata(r))
+
+    print(f'{n} metadata records')
+    run('one file per article', per_article)
+    run(f'JSONL batches of {batch}', batched)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--n', type=int, default=2000)
+    parser.add_argument('--batch', type=int, default=500)
+    args = parser.parse_args()
+    main(args.n, args.batch)
@@ -0,0 +1,76 @@
+"""Papers per journal and year from the Parquet catalogue against re-reading the metadata log
+
+Writes the same synthetic metadata records to a JSONL log, as the metadata batcher does, and
+to the catalogue, then times the per-journal report over both:
+
+    python -m benchmarks.bench_metadata_catalogue --records 200000 --journals 200
+"""
+import argparse
+import json
+import random
+import tempfile
+from collections import Counter
+from pathlib import Path
+from time import perf_counter
+
+from benchmarks.common import report, time_call
+from storage.metadata_catalogue import MetadataCatalogue, read_metadata_log
+
+
+def synthetic_records(rng: random.Random, count: int, journals: int) -> 'list[dict]':
+    names = [f'Journal of Synthetic Studies {j}' for j in range(journals)]
+    return [{
+        'DOI': f'10.2307/{i}',
+        'Title': f'On the synthetic article number {i}',
+        'JournalName': rng.choice(names),
+        'AuthorInitial': 'A',
+        'AuthorSurname': f'Author{rng.randrange(10000)}',
+        'YearPublished': str(rng.randrange(1950, 2022)),
+        'CategoryID': '1',
+    } for i in range(count)]
+
+
+def log_report(path: Path) -> Counter:
+    return Counter((r['JournalName'], r['YearPublished']) for r in read_metadata_log(path))
+
+
+def directory_size(path: Path) -> int:
+    return sum(p.stat().st_size for p in path.rglob('*') if p.is_file())
+
+
+def main(records: int, journals: int, repeat: int) -> None:
+    rows = synthetic_records(random.Random(0), records, journals)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        log = Path(tmp, 'metadata_log.jsonl')
+        with log.open('w', encoding='utf-8') as f:
+            for row in rows:
+                f.write(json.dumps(row) + '\n')
+
+        catalogue = MetadataCatalogue(Path(tmp, 'Catalogue'), flush_rows=10000)
+        start = perf_counter()
+        with catalogue:
+            catalogue.add_many(rows)
+        written_s = perf_counter() - start
+        files = len(list(catalogue.root.rglob('*.parquet')))
+        print(f'{records} records written in {written_s:.2f}s as {files} files')
+
+        start = perf_counter()
+        compacted = catalogue.compact()
+        print(f'{compacted} journals compacted in {perf_counter() - start:.2f}s')
+        print(f'on disk: log {log.stat().st_size / 1e6:.1f} MB, catalogue {directory_size(catalogue.root) / 1e6:.1f} MB')
+
+        report('report from the log', time_call(lambda: log_report(log), repeat=repeat))
+        report('report from the catalogue', time_call(catalogue.papers_per_journal_year, repeat=repeat))
+        report('one journal from the catalogue',
+               time_call(lambda: catalogue.papers_per_journal_year(rows[0]['JournalName']), repeat=repeat))
+        report('missing years', time_call(catalogue.missing_years, repeat=repeat))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--records', type=int, default=200000)
+    parser.add_argument('--journals', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    main(args.records, args.journals, args.repeat)
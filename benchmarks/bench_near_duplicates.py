@@ -0,0 +1,67 @@
+"""Signature and lookup cost of the near-duplicate index as the corpus grows
+
+Signs synthetic articles, fills the index, then looks up edited copies of stored articles
+(which should be found) and unrelated ones (which should not):
+
+    python -m benchmarks.bench_near_duplicates --sizes 1000 10000 --words 2000
+"""
+import argparse
+import random
+import statistics
+import tempfile
+from pathlib import Path
+from time import perf_counter
+
+import numpy as np
+
+from indexing.near_duplicates import NearDuplicateIndex, text_signature
+
+
+def synthetic_text(rng: random.Random, words: int) -> 'list[str]':
+    return [f'w{min(int(rng.paretovariate(0.8)), 50000)}' for _ in range(words)]
+
+
+def edited(rng: random.Random, words: 'list[str]', share: float) -> str:
+    words = words[:]
+    for i in rng.sample(range(len(words)), int(len(words) * share)):
+        words[i] = f'edit{i}'
+    return ' '.join(words)
+
+
+def main(sizes: 'list[int]', words: int, queries: int) -> None:
+    rng = random.Random(0)
+    texts = [synthetic_text(rng, words) for _ in range(max(sizes))]
+
+    start = perf_counter()
+    signatures = [text_signature(' '.join(t)) for t in texts]
+    print(f'signing: {(perf_counter() - start) / len(texts) * 1e3:.2f}ms per article of {words} words')
+
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            index = NearDuplicateIndex(Path(tmp, 'near_duplicates.sqlite3'))
+            start = perf_counter()
+            index.add_many((f'10.2307/{i}', signatures[i], None) for i in range(size))
+            add_s = perf_counter() - start
+
+            found, samples = 0, []
+            for q in range(queries):
+                i = rng.randrange(size)
+                # Every other query is a stored article with 1% of its words changed, about 0.9 similar
+                signature = text_signature(edited(rng, texts[i], 0.01)) if q % 2 == 0 else text_signature(' '.join(synthetic_text(rng, words)))
+                start = perf_counter()
+                matches = index.query(signature)
+                samples.append(perf_counter() - start)
+                found += q % 2 == 0 and any(m.doi == f'10.2307/{i}' for m in matches)
+
+            print(f'{size:>7} articles   added in {add_s:6.2f}s   lookup p50 {statistics.median(samples) * 1e3:6.2f}ms '
+                  f'p95 {np.percentile(samples, 95) * 1e3:6.2f}ms   {found}/{(queries + 1) // 2} edited copies found')
+            index.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--words', type=int, default=2000)
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+    main(args.sizes, args.words, args.queries)
@@ -0,0 +1,93 @@
+"""Bytes on disk and read latency of the pack archive against loose files in the content store
+
+Stores the fixture pdfs, each under `--copies` DOIs with distinct content, plus as many
+pdfs of incompressible bytes standing in for pdfs of deflated streams, then archives them
+and reads random ones back from both:
+
+    python -m benchmarks.bench_pack_archive --copies 300
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+from pathlib import Path
+from time import perf_counter
+
+import numpy as np
+
+from benchmarks.common import load_fixture_pdfs
+from storage.content_store import ContentStore
+from storage.pack_archive import PackArchive, archive_store, zstandard
+
+
+def allocated(paths) -> 'tuple[int, int]':
+    """Files and bytes allocated on disk for them, which counts the partial last block"""
+    sizes = [os.stat(p).st_blocks * 512 for p in paths]
+    return len(sizes), sum(sizes)
+
+
+def latencies(read, dois: 'list[str]') -> 'list[float]':
+    samples = []
+    for doi in dois:
+        start = perf_counter()
+        read(doi)
+        samples.append(perf_counter() - start)
+    return samples
+
+
+def print_latencies(name: str, samples: 'list[float]') -> None:
+    print(f'{name:<32} p50 {statistics.median(samples) * 1e6:8.1f}us   p95 {np.percentile(samples, 95) * 1e6:8.1f}us')
+
+
+def main(copies: int, reads: int) -> None:
+    rng = random.Random(0)
+    pdfs = load_fixture_pdfs()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = ContentStore(Path(tmp, 'Store'))
+        for i in range(copies):
+            for doi, data in pdfs.items():
+                store.put_bytes(f'{doi}.{i}', data + b'%%%d\n' % i)
+            store.put_bytes(f'10.0000/deflated.{i}', b'%PDF-1.5\n' + rng.randbytes(rng.randrange(50000, 500000)))
+        dois = [doi for doi, _, _ in store.items()]
+
+        archive = PackArchive(Path(tmp, 'Archive'))
+        start = perf_counter()
+        archive_store(store, archive)
+        print(f'{len(dois)} pdfs archived in {perf_counter() - start:.2f}s with {"zstd" if zstandard else "zlib"}')
+
+        loose = allocated(p for p in Path(tmp, 'Store', 'objects').rglob('*.pdf'))
+        packed = allocated(archive.root.joinpath('packs').glob('*.pack'))
+        print(f'loose files: {loose[0]:>6} files {loose[1] / 1e6:8.1f} MB allocated')
+        print(f'pack files:  {packed[0]:>6} files {packed[1] / 1e6:8.1f} MB allocated '
+              f'(+{os.path.getsize(archive.root.joinpath("index.sqlite3")) / 1e6:.1f} MB index)')
+
+        sample = [rng.choice(dois) for _ in range(reads)]
+        # The page cache holds everything here, so these compare lookups and decompression, not disks
+        def read_loose(doi):
+            with store.open(doi) as f:
+                return f.read()
+
+        for name, read in (('loose file read', read_loose), ('archive read', archive.read)):
+            latencies(read, sample[:50])
+            print_latencies(name, latencies(read, sample))
+
+        def first_chunk(doi):
+            with archive.open(doi) as reader:
+                return reader.read(64 * 1024)
+
+        print_latencies('archive first 64 kB', latencies(first_chunk, sample))
+
+        for label, prefix in (('fixture pdfs only', '10.2307/'), ('deflated pdfs only', '10.0000/')):
+            subset = [doi for doi in sample if doi.startswith(prefix)]
+            print_latencies(f'archive read, {label}', latencies(archive.read, subset))
+        archive.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--copies', type=int, default=300)
+    parser.add_argument('--reads', type=int, default=2000)
+    args = parser.parse_args()
+    main(args.copies, args.reads)
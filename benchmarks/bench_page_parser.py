@@ -0,0 +1,62 @@
+"""page_parser.parse_search_page against the list-building implementation it replaced
+
+The saved results page is enlarged by repeating its results, then both implementations
+parse the same page source:
+
+    python -m benchmarks.bench_page_parser --copies 40
+"""
+import argparse
+
+import pandas as pd
+
+from benchmarks.common import enlarge_search_page, load_search_page, report, time_call
+from scraper.page_parser import parse_search_page
+from scraper.search_page_parser import BACKENDS, available_backends
+
+
+def legacy_parse_search_page(html: str) -> pd.DataFrame:
+    # The previous implementation: a BeautifulSoup html.parser tree, seven parallel lists
+    # and each metadata string split four times
+    fields = BACKENDS['bs4'].fields(html)
+
+    article_journal_name_list = []
+    article_volume_list = []
+    article_journal_date_list = []
+    article_pages_in_journal_list = []
+    for s in fields.metadata:
+        article_journal_date_list.append(s.split("(")[1].split(")")[0])
+        article_journal_name_list.append(s.split(",")[0])
+        article_volume_list.append(s.split(",")[1].split("(")[0])
+        article_pages_in_journal_list.append(str(s.split("),")[1:])[2:-2])
+
+    article_url_list = ['https://www.jstor.org/' + href.split("?")[0] for href, _ in fields.pdf_links]
+
+    return pd.DataFrame(list(zip(fields.titles, fields.authors, article_journal_name_list, article_volume_list,
+                                 article_journal_date_list, article_pages_in_journal_list, article_url_list)),
+                        columns=['Title', "Author", 'Journal', 'Journal Volume', 'Journal Date Published', 'Article Pages', 'URL'])
+
+
+def main(copies: int = 40, repeat: int = 5) -> None:
+    html = enlarge_search_page(load_search_page(), copies)
+
+    for backend in available_backends():
+        records = BACKENDS[backend].records(html)
+        assert len(records) == 25 * copies, f'{backend} found {len(records)} results'
+
+    frame = parse_search_page(html)
+    assert len(frame) == 25 * copies
+    assert frame['Journal Volume'].notna().sum() == 24 * copies
+
+    print(f'{len(html) / 1024 / 1024:.1f} MB page, {len(frame)} results')
+
+    report('legacy parse_search_page', time_call(lambda: legacy_parse_search_page(html), repeat), per=len(frame), unit='row')
+    for backend in available_backends():
+        report(f'parse_search_page ({backend})', time_call(lambda: parse_search_page(html, backend), repeat), per=len(frame), unit='row')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--copies', type=int, default=40)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    main(args.copies, args.repeat)
@@ -0,0 +1,33 @@
+"""Search page parsing backends against the saved results page in testhtml.html
+
+Every installed backend must produce exactly what the BeautifulSoup html.parser
+reference produces, the run fails otherwise:
+
+    python -m benchmarks.bench_search_parser
+"""
+import argparse
+
+from benchmarks.common import load_search_page, report, time_call
+from scraper.search_page_parser import BACKENDS, available_backends
+
+
+def main(repeat: int = 20) -> None:
+    html = load_search_page()
+    reference = BACKENDS['bs4'].fields(html)
+    reference_records = BACKENDS['bs4'].records(html)
+
+    print(f'{len(html) / 1024:.0f} KB page, {len(reference.pdf_links)} results')
+
+    for name in available_backends():
+        backend = BACKENDS[name]
+
+        assert backend.fields(html) == reference, f'{name} backend fields differ from the bs4 reference'
+        assert backend.records(html) == reference_records, f'{name} backend records differ from the bs4 reference'
+
+        report(name, time_call(lambda: backend.fields(html), repeat), unit='page')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=20)
+    main(parser.parse_args().repeat)
@@ -0,0 +1,208 @@
+"""Offline suite over the recorded fixtures, compared against a saved baseline
+
+Times search page parsing, SearchResponse construction, author parsing, metadata building,
+pdf store writes and uploads to the local stub API. Nothing leaves the machine. Save the
+results of one commit and compare another against them; any case slower than the baseline
+by more than the threshold is flagged and the run exits with status 1:
+
+    python -m benchmarks.bench_suite --save baseline.json
+    python -m benchmarks.bench_suite --baseline baseline.json --threshold 0.3
+
+Store writes and uploads go through the filesystem and sockets and vary most between runs,
+the default threshold of 50% leaves room for that on a busy machine.
+
+The fixtures are testhtml.html, benchmarks/fixtures/landing_metadata.json (the `contentData`
+of the 25 articles on that page) and benchmarks/fixtures/pdfs (cover pages of three of them).
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from typing import Callable
+
+from api.metadata_batcher import MetadataBatcher, api_metadata, encode_metadata
+from api.stub_server import start_stub_server
+from api.uploader import Uploader, UploadJob
+from benchmarks.common import REPO_ROOT, enlarge_search_page, load_fixture_pdfs, load_landing_metadata, load_search_page, time_call
+from scraper.page_parser import parse_search_page
+from scraper.scraper import JstorScraper
+from scraper.search_page_parser import extract_search_page
+from scraper.search_results import SearchResponse
+from scraper.text_normalisation import parse_author_name
+from storage.content_store import ContentStore
+
+
+class Case:
+    """One timed case: `run` does `per` items of work"""
+
+    def __init__(self, name: str, run: Callable[[], object], per: int, unit: str) -> None:
+        self.name = name
+        self.run = run
+        self.per = per
+        self.unit = unit
+
+
+def build_cases(copies: int, base_url: str, workdir: Path) -> 'list[Case]':
+    html = load_search_page()
+    large_html = enlarge_search_page(html, copies)
+    links = extract_search_page(large_html).pdf_links
+    landing = load_landing_metadata() * copies
+    authors = [a for record in landing for a in record['authors']]
+    pdfs = load_fixture_pdfs()
+
+    # Only the parser is used, the scraper never gets a browser
+    scraper = JstorScraper.__new__(JstorScraper)
+
+    def parse_authors():
+        parse_author_name.cache_clear()
+        for a in authors:
+            parse_author_name(a)
+
+    def build_metadata():
+        parse_author_name.cache_clear()
+        for record in landing:
+            encode_metadata(api_metadata(record))
+
+    runs = iter(range(1 << 30))
+
+    def store_writes():
+        # A fresh store every run, each pdf stored under `copies` DOIs with distinct content
+        store = ContentStore(workdir.joinpath(f'store-{next(runs)}'))
+        try:
+            for i in range(copies):
+                for doi, data in pdfs.items():
+                    store.put_bytes(f'{doi}.{i}', data + b'%%%d\n' % i)
+        finally:
+            store.close()
+
+    pdf_paths = {}
+    for doi, data in pdfs.items():
+        pdf_paths[doi] = workdir.joinpath(doi.replace('/', '_') + '.pdf')
+        pdf_paths[doi].write_bytes(data)
+    upload_jobs = [(f'{doi}.{i}', path) for i in range(copies) for doi, path in pdf_paths.items()]
+
+    def uploads():
+        with Uploader(base_url + '/api/upload-paper-droplet', base_url + '/api/upload-metadata',
+                      base_url + '/api/upload-pdf?paperDOI=', workers=4, max_retries=0) as uploader:
+            for doi, path in upload_jobs:
+                name = doi.replace('/', '_', 1)
+                uploader.submit(UploadJob(name, doi, path, encode_metadata({'DOI': doi})))
+
+    def metadata_batches():
+        with MetadataBatcher(base_url + '/api/upload-metadata', max_records=100, max_retries=0) as batcher:
+            for record in landing:
+                batcher.add(record['doi'], api_metadata(record))
+
+    return [
+        Case('search page lite', lambda: scraper._parse_search_page_lite(html), 1, 'page'),
+        Case('search page lite (large)', lambda: scraper._parse_search_page_lite(large_html), len(links), 'row'),
+        Case('parse_search_page', lambda: parse_search_page(html), 1, 'page'),
+        Case('parse_search_page (large)', lambda: parse_search_page(large_html), len(links), 'row'),
+        Case('SearchResponse construction', lambda: [SearchResponse(doi, href) for href, doi in links], len(links), 'result'),
+        Case('author parsing', parse_authors, len(authors), 'name'),
+        Case('metadata building', build_metadata, len(landing), 'record'),
+        Case('content store writes', store_writes, copies * len(pdfs), 'pdf'),
+        Case('uploads to stub', uploads, len(upload_jobs), 'article'),
+        Case('metadata batches to stub', metadata_batches, len(landing), 'record'),
+    ]
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_cases(cases: 'list[Case]', repeat: int, only: 'list[str]' = None) -> 'dict[str, dict]':
+    results = {}
+    for case in cases:
+        if only and not any(o in case.name for o in only):
+            continue
+        timing = time_call(case.run, repeat)
+        results[case.name] = {
+            'median_us': timing['median'] * 1e6 / case.per,
+            'min_us': timing['min'] * 1e6 / case.per,
+            'unit': case.unit,
+        }
+    return results
+
+
+def compare(results: 'dict[str, dict]', baseline: 'dict[str, dict]', threshold: float) -> 'list[str]':
+    """Prints every case against the baseline, returns the names of the regressed ones
+
+    Fastest runs are compared, they vary far less between runs than the medians on a busy machine.
+    """
+    regressed = []
+    for name, r in results.items():
+        line = f'{name:<30} {r["min_us"]:>12.2f}us/{r["unit"]:<8}'
+        base = baseline.get(name)
+        if base is None:
+            print(f'{line}  (not in baseline)')
+            continue
+        ratio = r['min_us'] / base['min_us']
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = '  REGRESSION'
+            regressed.append(name)
+        elif ratio < 1 / (1 + threshold):
+            flag = '  faster'
+        print(f'{line}  baseline {base["min_us"]:>12.2f}us  x{ratio:5.2f}{flag}')
+    return regressed
+
+
+def main(copies: int = 10, repeat: int = 5, save: Path = None, baseline: Path = None,
+         threshold: float = 0.5, only: 'list[str]' = None) -> int:
+    server, state, base_url = start_stub_server()
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            cases = build_cases(copies, base_url, Path(tmp))
+            results = run_cases(cases, repeat, only)
+    finally:
+        server.shutdown()
+
+    commit = git_commit()
+    print(f'commit {commit}, {copies} copies of the fixtures, {repeat} runs per case')
+
+    regressed = []
+    if baseline is not None:
+        saved = json.loads(Path(baseline).read_text(encoding='utf-8'))
+        print(f'baseline: commit {saved.get("commit")}, threshold {threshold:.0%}')
+        regressed = compare(results, saved['results'], threshold)
+    else:
+        for name, r in results.items():
+            print(f'{name:<30} min {r["min_us"]:>12.2f}us/{r["unit"]:<8} median {r["median_us"]:>12.2f}us')
+
+    if save is not None:
+        Path(save).write_text(json.dumps({
+            'commit': commit,
+            'python': platform.python_version(),
+            'copies': copies,
+            'repeat': repeat,
+            'results': results,
+        }, indent=2), encoding='utf-8')
+        print(f'results saved to {save}')
+
+    if regressed:
+        print(f'{len(regressed)} regressed: {", ".join(regressed)}')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--copies', type=int, default=10, help='How many times the fixtures are repeated per case')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--save', type=Path, default=None, help='Write the results to this JSON file')
+    parser.add_argument('--baseline', type=Path, default=None, help='Compare against results saved with --save')
+    parser.add_argument('--threshold', type=float, default=0.5, help='Slowdown flagged as a regression, 0.5 is 50%%')
+    parser.add_argument('--only', nargs='*', default=None, help='Only run cases whose name contains one of these')
+    args = parser.parse_args()
+    # Only a regression ends the run, so `main.py bench` carries on with the next benchmark
+    status = main(args.copies, args.repeat, args.save, args.baseline, args.threshold, args.only)
+    if status:
+        sys.exit(status)
@@ -0,0 +1,97 @@
+"""Per-call cost of author-name parsing, proxy URL rewriting and docid derivation
+
+Compares the inline patterns previously used in main.py, UctConnectionController and
+SearchResponse with text_normalisation over synthetic inputs:
+
+    python -m benchmarks.bench_text_normalisation --n 100000
+"""
+import argparse
+import random
+import re
+
+from benchmarks.common import report, time_call
+from scraper.text_normalisation import docid_from_url, parse_author_name, rewrite_proxy_url
+
+FIRST_NAMES = ['Nicky', 'Deborah', 'Jean-Paul', 'Ana', 'Xiang', 'Lan', 'John', 'Ole-Kristian', 'María', 'J.']
+MIDDLE_NAMES = ['', 'A. ', 'M. ', 'de la ', 'van ', 'K. ']
+SURNAMES = ['Best', 'Ashby', "O'Brien", 'Zhang', 'Wu', 'Cruz', 'Keynes', 'Hope', 'Dunstan', 'McIntosh']
+
+
+def synthetic_names(n: int, rng: random.Random) -> 'list[str]':
+    names = []
+    for i in range(n):
+        first, middle, surname = rng.choice(FIRST_NAMES), rng.choice(MIDDLE_NAMES), rng.choice(SURNAMES)
+        # Suffix makes most names distinct, so the cache can't hide the parsing cost
+        surname = f'{surname}{"abcdefghij"[i % 10]}{"klmnopqrst"[(i // 10) % 10]}'
+        names.append(f'{surname}, {first} {middle}'.strip() if i % 4 == 0 else f'{first} {middle}{surname}')
+    return names
+
+
+def synthetic_urls(n: int, rng: random.Random) -> 'list[str]':
+    return [f'https://www.jstor.org/stable/{rng.randrange(10**7, 10**8)}' for _ in range(n)]
+
+
+def legacy_parse_author_name(author: str) -> 'tuple[str, str]':
+    # main.py's loop body before text_normalisation, with its None check on the middle name added
+    names = re.match(r'^\W*((?P<surname>\w+), ?)?((?P<firstname>\w+).? )((?P<namei>\w+).? )*(?P<surname2>\w+)\W*$', author)
+    if names == None:
+        return 'Unknown', 'Unknown'
+    surname = names['surname'] if names['surname'] != None else names['surname2']
+    initial = names['namei'][0] if names['namei'] != None else names['firstname'][0]
+    return initial, surname
+
+
+def legacy_rewrite_url(instring: str) -> str:
+    url_regex = re.compile(r'(?P<proto>https?)://(?P<host>[-A-Za-z.]+)(?P<port>:[0-9]+)?(?P<pathqry>/.+)?')
+    url_match = url_regex.fullmatch(instring)
+    if url_match == None or url_match['host'] == None:
+        raise ValueError('instring does not appear to be a useable URL')
+    return f'https://{url_match["host"].replace(".", "-")}.ezproxy.uct.ac.za{str(url_match["port"] or "")}{str(url_match["pathqry"] or "")}'
+
+
+def legacy_docid(url: str) -> str:
+    return re.sub(r'/stable/(?:pdf/)?(?P<id>[a-z0-9]+)\.[a-z0-9]{1,4}(?:\?.+)?', r'\g<id>', url)
+
+
+def main(n: int = 100000, repeat: int = 3) -> None:
+    rng = random.Random(0)
+    names = synthetic_names(n, rng)
+    urls = synthetic_urls(n, rng)
+    pdf_links = [f'/stable/pdf/{u.rsplit("/", 1)[1]}.pdf?refreqid=search' for u in urls]
+
+    for url in urls[:100]:
+        assert rewrite_proxy_url(url) == legacy_rewrite_url(url)
+    for link in pdf_links[:100]:
+        assert docid_from_url(link) == legacy_docid(link)
+
+    def cold(fn, inputs):
+        # Clear memoisation so every call does the full work
+        def run():
+            if hasattr(fn, 'cache_clear'):
+                fn.cache_clear()
+            for x in inputs:
+                fn(x)
+        return run
+
+    def warm(fn, inputs):
+        def run():
+            for x in inputs:
+                fn(x)
+        return run
+
+    print(f'{n} synthetic names and URLs')
+    report('legacy author regex', time_call(cold(legacy_parse_author_name, names), repeat), per=n)
+    report('parse_author_name (cold)', time_call(cold(parse_author_name, names), repeat), per=n)
+    report('legacy rewrite_url', time_call(cold(legacy_rewrite_url, urls), repeat), per=n)
+    report('rewrite_proxy_url (cold)', time_call(cold(rewrite_proxy_url, urls), repeat), per=n)
+    report('rewrite_proxy_url (cached)', time_call(warm(rewrite_proxy_url, urls[:1000] * (n // 1000)), repeat), per=n)
+    report('legacy docid re.sub', time_call(cold(legacy_docid, pdf_links), repeat), per=n)
+    report('docid_from_url', time_call(cold(docid_from_url, pdf_links), repeat), per=n)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--n', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    main(args.n, args.repeat)
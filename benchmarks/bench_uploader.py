@@ -0,0 +1,79 @@
+"""Uploader throughput by worker count against a slow, flaky API
+
+Uploads the fixture pdfs through the stub transport with added latency and injected 503s,
+then replays a cassette recorded from the stub with the same latency:
+
+    python -m benchmarks.bench_uploader --n 200 --latency 0.05 --error-rate 0.05
+"""
+import argparse
+import tempfile
+from pathlib import Path
+from time import perf_counter
+
+import requests
+
+from api.metadata_batcher import encode_metadata
+from api.transport import CassetteAdapter, FaultInjectingAdapter, StubAdapter, make_session
+from api.uploader import Uploader, UploadJob
+from benchmarks.common import load_fixture_pdfs
+
+
+def mounted(adapter) -> requests.Session:
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def run(name: str, session: requests.Session, jobs: 'list[UploadJob]', workers: int) -> None:
+    failed = []
+    start = perf_counter()
+    with Uploader('https://api-aaronskit.org/api/upload-paper-droplet',
+                  'https://api-aaronskit.org/api/upload-metadata',
+                  'https://api-aaronskit.org/api/upload-pdf?paperDOI=',
+                  workers=workers,
+                  backoff_s=0.05,
+                  session=session,
+                  on_error=lambda job, e: failed.append((job, e))) as uploader:
+        for job in jobs:
+            uploader.submit(UploadJob(job.name, job.doi, job.pdf_path, job.metadata))
+    seconds = perf_counter() - start
+
+    adapter = session.get_adapter('https://')
+    faults = ''
+    if isinstance(adapter, FaultInjectingAdapter):
+        faults = f'{adapter.requests:>6} requests {adapter.injected_errors:>4} injected 503s'
+    print(f'{name:<28} {len(jobs) / seconds:>8.1f} articles/s  {len(failed):>4} failed  {faults}')
+
+
+def main(n: int, latency_s: float, error_rate: float) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        pdfs = list(load_fixture_pdfs().items())
+        jobs = []
+        for i in range(n):
+            doi, data = pdfs[i % len(pdfs)]
+            doi = f'{doi}.{i}'
+            name = doi.replace('/', '_', 1)
+            path = tmp.joinpath(name + '.pdf')
+            path.write_bytes(data)
+            jobs.append(UploadJob(name, doi, path, encode_metadata({'DOI': doi})))
+
+        print(f'{n} articles, {latency_s * 1e3:.0f}ms latency, {error_rate:.0%} injected errors')
+        for workers in (1, 4, 16):
+            session = make_session('stub', latency_s=latency_s, error_rate=error_rate, seed=workers, pool_maxsize=2 * workers + 1)
+            run(f'stub, {workers} workers', session, jobs, workers)
+
+        cassette = tmp.joinpath('cassette.jsonl')
+        run('recording from stub, 16', mounted(CassetteAdapter(cassette, record=True, inner=StubAdapter(pool_maxsize=33))), jobs, 16)
+        replay = FaultInjectingAdapter(CassetteAdapter(cassette), latency_s=latency_s, error_rate=error_rate, seed=0)
+        run('replay, 16 workers', mounted(replay), jobs, 16)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--n', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--error-rate', type=float, default=0.05)
+    args = parser.parse_args()
+    main(args.n, args.latency, args.error_rate)
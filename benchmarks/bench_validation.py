@@ -0,0 +1,64 @@
+"""Throughput of the pdf validation stage, single process against the process pool
+
+Validates a synthetic store of valid, truncated and HTML pdfs, or an existing store:
+
+    python -m benchmarks.bench_validation --files 2000 --size-kb 256
+    python -m benchmarks.bench_validation --store Storage
+"""
+import argparse
+import os
+import random
+import tempfile
+from pathlib import Path
+from time import perf_counter
+
+from benchmarks.common import synthetic_pdf
+from pipeline.validation import ValidationReport, validate_pdf, validate_store
+from storage.content_store import ContentStore
+
+
+def build_store(root: Path, files: int, size_kb: int, rng: random.Random) -> ContentStore:
+    store = ContentStore(root)
+    for i in range(files):
+        pdf = synthetic_pdf([f'Synthetic article {i}'], padding=size_kb * 1024)
+        if i % 20 == 0:
+            pdf = pdf[:rng.randrange(len(pdf) // 2, len(pdf) - 64)]
+        elif i % 20 == 1:
+            pdf = b'<!DOCTYPE html><html><body>Access denied</body></html>'
+        store.put_bytes(f'10.0000/synthetic.{i}', pdf)
+    return store
+
+
+def sequential(store: ContentStore) -> ValidationReport:
+    report = ValidationReport()
+    start = perf_counter()
+    # Each object once, as validate_store does
+    for sha256 in sorted({h for _, h, _ in store.items()}):
+        result = validate_pdf(store.object_path(sha256))
+        report.files += 1
+        report.bytes += result.size
+        report.invalid += not result.ok
+    report.seconds = perf_counter() - start
+    return report
+
+
+def main(store: ContentStore, workers: int) -> None:
+    # The first run also warms the page cache for the second
+    print(f'single process : {sequential(store)}')
+    report, _ = validate_store(store, workers=workers)
+    print(f'{workers} workers      : {report}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--files', type=int, default=1000)
+    parser.add_argument('--size-kb', type=int, default=256)
+    parser.add_argument('--store', type=Path, help='Validate an existing store instead of a synthetic one')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    if args.store is not None:
+        main(ContentStore(args.store), args.workers)
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            main(build_store(Path(tmp), args.files, args.size_kb, random.Random(0)), args.workers)
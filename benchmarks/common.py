@@ -0,0 +1,91 @@
+import json
+import re
+import statistics
+from pathlib import Path
+from time import perf_counter
+from typing import Callable
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+# Saved JSTOR search results page
+SEARCH_PAGE_FIXTURE = REPO_ROOT.joinpath('testhtml.html')
+
+# Landing page `contentData` of the articles on the saved search page, and pdfs with their cover pages
+FIXTURES_DIR = Path(__file__).resolve().parent.joinpath('fixtures')
+
+
+def load_search_page() -> str:
+    return SEARCH_PAGE_FIXTURE.read_text(encoding='utf-8')
+
+
+def load_landing_metadata() -> 'list[dict]':
+    return json.loads(FIXTURES_DIR.joinpath('landing_metadata.json').read_text(encoding='utf-8'))
+
+
+def load_fixture_pdfs() -> 'dict[str, bytes]':
+    """Sample pdfs by DOI, from 3 kB to 100 kB"""
+    return {f'10.2307/{p.stem}': p.read_bytes() for p in sorted(FIXTURES_DIR.joinpath('pdfs').glob('*.pdf'))}
+
+
+def time_call(fn: Callable[[], object], repeat: int = 20, warmup: int = 1) -> 'dict[str, float]':
+    """Times `fn` over `repeat` calls after `warmup` untimed calls
+
+    Returns:
+        dict: min, median and mean seconds per call
+    """
+    for _ in range(warmup):
+        fn()
+
+    samples = []
+    for _ in range(repeat):
+        start = perf_counter()
+        fn()
+        samples.append(perf_counter() - start)
+
+    return {
+        'min': min(samples),
+        'median': statistics.median(samples),
+        'mean': statistics.fmean(samples),
+    }
+
+
+def report(name: str, timing: 'dict[str, float]', per: int = 1, unit: str = 'call') -> None:
+    """Prints one aligned result line, scaled to time per `unit` when `per` items were timed together"""
+    scale = 1e6 / per
+    print(f'{name:<32} median {timing["median"] * scale:>10.2f}us/{unit}   min {timing["min"] * scale:>10.2f}us/{unit}')
+
+
+def enlarge_search_page(html: str, copies: int) -> str:
+    """Repeats the result list items of a search page `copies` times, to get a large saved page"""
+    item = re.compile(r'<li[^>]*class="result-list__item"[^>]*>')
+    items = list(item.finditer(html))
+    start = items[0].start()
+    end = html.rindex('</li>', start, html.index('</ol>', items[-1].end())) + len('</li>')
+    return html[:start] + html[start:end] * copies + html[end:]
+
+
+def synthetic_pdf(lines: 'list[str]', padding: int = 0) -> bytes:
+    """Builds a small valid single-page pdf showing `lines`, with an uncompressed stream of `padding` bytes"""
+    text = b' '.join(b'(' + re.sub(rb'([()\\])', rb'\\\1', l.encode('latin-1')) + b') Tj T*' for l in lines)
+    content = b'BT /F1 12 Tf 72 720 Td 14 TL ' + text + b' ET'
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+        b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R '
+        b'/Resources << /Font << /F1 5 0 R >> >> >>',
+        b'<< /Length %d >>\nstream\n%s\nendstream' % (len(content), content),
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>',
+        b'<< /Length %d >>\nstream\n%s\nendstream' % (padding, b'%' * padding),
+    ]
+
+    out = bytearray(b'%PDF-1.4\n')
+    offsets = []
+    for i, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b'%d 0 obj\n%s\nendobj\n' % (i, body)
+
+    xref = len(out)
+    out += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    out += b''.join(b'%010d 00000 n \n' % o for o in offsets)
+    out += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+    return bytes(out)
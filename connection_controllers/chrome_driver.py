@@ -0,0 +1,69 @@
+import json
+import os
+from pathlib import Path
+from time import time
+
+from selenium import webdriver
+
+# Resolved chromedriver location, so webdriver_manager is only consulted when it is stale
+DRIVER_CACHE = Path.home().joinpath('.cache', 'information-retrieval', 'chromedriver.json')
+
+# How long a resolved driver is trusted before checking for a new one
+DRIVER_CACHE_MAX_AGE_S = 7 * 24 * 60 * 60
+
+
+def chrome_driver_path(cache_path: Path = DRIVER_CACHE, max_age_s: float = DRIVER_CACHE_MAX_AGE_S) -> str:
+    """Location of a chromedriver binary, installed by webdriver_manager on a cache miss
+
+    `ChromeDriverManager().install()` queries the network for the current driver version on
+    every call. The path it returns is cached in `cache_path` and reused while the binary
+    exists and the entry is younger than `max_age_s`.
+
+    Returns:
+        str: Path to the chromedriver executable
+    """
+    cache_path = Path(cache_path)
+    try:
+        cached = json.loads(cache_path.read_text())
+        if time() - cached['resolved_at'] < max_age_s and os.access(cached['path'], os.X_OK):
+            return cached['path']
+    except (OSError, ValueError, KeyError):
+        pass
+
+    # Only imported when the driver has to be resolved again
+    from webdriver_manager.chrome import ChromeDriverManager
+
+    path = ChromeDriverManager().install()
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        cache_path.write_text(json.dumps({'path': path, 'resolved_at': time()}))
+    except OSError:
+        pass
+    return path
+
+
+def create_chrome_driver(user_agent: str, extension: Path = None, headless: bool = False) -> webdriver.Chrome:
+    """Starts Chrome with the options the scraper needs to look like a regular browser
+
+    Args:
+        * user_agent (str) : User agent string to send
+        * extension (Path, optional) : Packed extension (.crx) to install. Defaults to none.
+        * headless (bool, optional) : Run without the browser UI. Defaults to False.
+    """
+    chrome_options = webdriver.ChromeOptions()
+
+    if headless:
+        chrome_options.add_argument('--headless')
+
+    chrome_options.add_argument(f'user-agent={user_agent}')
+    chrome_options.add_argument('--disable-blink-features=AutomationControlled')
+    if extension is not None:
+        chrome_options.add_extension(str(extension))
+    chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
+    chrome_options.add_experimental_option("useAutomationExtension", False)
+
+    driver = webdriver.Chrome(chrome_driver_path(), options = chrome_options)
+
+    driver.execute_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
+
+    return driver
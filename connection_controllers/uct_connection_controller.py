@@ -1,6 +1,4 @@
 
-import re
-
 from selenium.webdriver.support.ui import WebDriverWait
 
 from connection_controllers.connection_controller import ConnectionController
@@ -8,21 +6,15 @@ from selenium.webdriver.support import expected_conditions
 from selenium.webdriver.common.by import By
 from selenium import webdriver
 
+from instrumentation.timing import timed
+from scraper.text_normalisation import rewrite_proxy_url
+
 class UctConnectionController(ConnectionController):
 
+    @timed('controller.rewrite_url')
     def rewrite_url(self, instring: str) -> str:
-    # Hopefully this regex will handle most real-world cases that we need
-        url_regex = re.compile(r'(?P<proto>https?)://(?P<host>[-A-Za-z.]+)(?P<port>:[0-9]+)?(?P<pathqry>/.+)?')
-
-        url_match = url_regex.fullmatch(instring)
-
-        if url_match == None or url_match['host'] == None: 
-            raise ValueError('instring does not appear to be a useable URL')
-
-        # Generating rewritten string using string interpolation
-        retval = f'https://{url_match["host"].replace(".", "-")}.ezproxy.uct.ac.za{str(url_match["port"] or "")}{str(url_match["pathqry"] or "")}'
-
-        return retval
+        # Pattern is precompiled and results are cached, see text_normalisation
+        return rewrite_proxy_url(instring)
 
     def __init__(self, driver: webdriver, host: str, user: str, pw: str):
 
@@ -0,0 +1,470 @@
+import heapq
+import json
+import os
+import re
+import shutil
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from math import log
+from pathlib import Path
+from time import perf_counter
+from typing import Iterable, NamedTuple, Optional
+
+import numpy as np
+
+from indexing.pdf_text import read_pdf
+
+# Runs of letters and digits, at least two long once case-folded
+TOKEN_REGEX = re.compile(r'[^\W_]{2,}')
+
+# Too common in article text to help ranking, and they make up a large share of the postings
+STOPWORDS = frozenset('''
+    an and are as at be by for from has have in is it its of on or that the this to was were which with
+'''.split())
+
+# Longer tokens are mostly extraction debris
+MAX_TOKEN_LENGTH = 40
+
+# A merge is started once this many segments exist, and folds the smallest of them into one
+MERGE_FACTOR = 8
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+_MANIFEST = 'index.json'
+_VERSION = 1
+
+
+def tokenize(text: str) -> 'list[str]':
+    """Case-folded word tokens of `text`, without stopwords"""
+    return [t for t in TOKEN_REGEX.findall(text.casefold()) if t not in STOPWORDS and len(t) <= MAX_TOKEN_LENGTH]
+
+
+# ---- Varint coding ---------------------------------------------------------------------
+
+def encode_varints(values: np.ndarray) -> np.ndarray:
+    """LEB128 encodes non-negative integers below 2**35, 7 bits per byte with a continuation bit"""
+    values = np.asarray(values, dtype=np.uint64)
+    widths = np.ones(len(values), dtype=np.int64)
+    for bits in (7, 14, 21, 28):
+        widths += values >= (1 << bits)
+
+    ends = np.cumsum(widths)
+    starts = ends - widths
+    out = np.empty(int(ends[-1]) if len(values) else 0, dtype=np.uint8)
+    for j in range(int(widths.max()) if len(values) else 0):
+        has = widths > j
+        byte = (values[has] >> np.uint64(7 * j)) & np.uint64(0x7f)
+        more = (widths[has] > j + 1).astype(np.uint64) << np.uint64(7)
+        out[starts[has] + j] = byte | more
+    return out
+
+
+def decode_varints(data: np.ndarray) -> np.ndarray:
+    """Decodes a run of varints written by `encode_varints`"""
+    data = np.asarray(data, dtype=np.uint8)
+    ends = np.flatnonzero(data < 0x80)
+    starts = np.empty_like(ends)
+    starts[:1] = 0
+    starts[1:] = ends[:-1] + 1
+    widths = ends - starts + 1
+
+    values = np.zeros(len(ends), dtype=np.int64)
+    for j in range(int(widths.max()) if len(ends) else 0):
+        has = widths > j
+        values[has] |= (data[starts[has] + j].astype(np.int64) & 0x7f) << (7 * j)
+    return values
+
+
+# ---- Segments --------------------------------------------------------------------------
+
+class SearchHit(NamedTuple):
+    doi: str
+    score: float
+
+
+class _Segment:
+    """An immutable, memory-mapped part of the index
+
+    Files:
+        * terms.bin : Every term in utf-8 byte order, concatenated
+        * lexicon.bin : int64 rows of (end of the term in terms.bin, end of its postings, document frequency)
+        * postings.bin : Per term, varint pairs of (doc ID gap, term frequency)
+        * lengths.bin : uint32 token count of each document
+        * dois.txt : DOI of each document, one per line
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.name = path.name
+        self.dois = path.joinpath('dois.txt').read_text(encoding='utf-8').split('\n')
+        self.terms = _map(path.joinpath('terms.bin'), np.uint8)
+        self.lexicon = _map(path.joinpath('lexicon.bin'), np.int64).reshape(-1, 3)
+        self.postings = _map(path.joinpath('postings.bin'), np.uint8)
+        self.lengths = _map(path.joinpath('lengths.bin'), np.uint32)
+
+    def __len__(self) -> int:
+        return len(self.dois)
+
+    def _term(self, i: int) -> bytes:
+        start = self.lexicon[i - 1, 0] if i > 0 else 0
+        return self.terms[start:self.lexicon[i, 0]].tobytes()
+
+    def find(self, term: bytes) -> int:
+        """Row of `term` in the lexicon, or -1"""
+        lo, hi = 0, len(self.lexicon)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._term(mid) < term:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo if lo < len(self.lexicon) and self._term(lo) == term else -1
+
+    def read_postings(self, i: int) -> 'tuple[np.ndarray, np.ndarray]':
+        """Document IDs and term frequencies of lexicon row `i`"""
+        start = self.lexicon[i - 1, 1] if i > 0 else 0
+        values = decode_varints(self.postings[start:self.lexicon[i, 1]])
+        return np.cumsum(values[0::2]), values[1::2]
+
+    def read_all(self) -> 'tuple[list[bytes], np.ndarray, np.ndarray, np.ndarray]':
+        """Every term in byte order with its document frequency, and all doc IDs and term frequencies, term by term"""
+        terms_data = self.terms.tobytes()
+        term_ends = self.lexicon[:, 0].tolist()
+        terms = [terms_data[start:end] for start, end in zip([0] + term_ends, term_ends)]
+        dfs = np.asarray(self.lexicon[:, 2])
+
+        values = decode_varints(self.postings)
+        gaps, tfs = values[0::2], values[1::2]
+        # Gaps restart at every term, so subtract the running total reached before each term starts
+        totals = np.cumsum(gaps)
+        starts = np.cumsum(dfs) - dfs
+        offsets = np.repeat(totals[starts[dfs > 0]] - gaps[starts[dfs > 0]], dfs[dfs > 0])
+        return terms, dfs, totals - offsets, tfs
+
+
+def _map(path: Path, dtype) -> np.ndarray:
+    # np.memmap can't map empty files
+    if path.stat().st_size == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r')
+
+
+def _group_by_term(terms: 'list[bytes]', term_of: np.ndarray, doc_ids: np.ndarray, tfs: np.ndarray) -> tuple:
+    """Orders postings by term, given each entry's index into `terms` and entries in ascending doc ID order
+
+    Returns:
+        tuple: The terms that have postings in byte order, their document frequencies, and the reordered doc IDs and term frequencies
+    """
+    order = sorted(range(len(terms)), key=terms.__getitem__)
+    rank = np.empty(len(terms), dtype=np.int64)
+    rank[order] = np.arange(len(terms))
+
+    entry_rank = rank[term_of]
+    # A stable sort keeps each term's doc IDs ascending
+    perm = np.argsort(entry_rank, kind='stable')
+    dfs = np.bincount(entry_rank, minlength=len(terms))
+    used = dfs > 0
+    return [terms[i] for i, u in zip(order, used) if u], dfs[used], doc_ids[perm], tfs[perm]
+
+
+def _write_segment(path: Path, dois: 'list[str]', lengths: 'list[int]', terms: 'list[bytes]',
+                   dfs: np.ndarray, doc_ids: np.ndarray, tfs: np.ndarray) -> None:
+    """Writes a segment from terms in byte order, their document frequencies, and their postings one term after the other"""
+    tmp = path.with_name(path.name + '.tmp')
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+
+    dfs = np.asarray(dfs, dtype=np.int64)
+    doc_ids = np.asarray(doc_ids, dtype=np.int64)
+    starts = np.cumsum(dfs) - dfs
+    gaps = np.diff(doc_ids, prepend=0)
+    gaps[starts] = doc_ids[starts]
+
+    pairs = np.empty(2 * len(doc_ids), dtype=np.int64)
+    pairs[0::2] = gaps
+    pairs[1::2] = tfs
+    encoded = encode_varints(pairs)
+    # Every term ends with its last value, whose last byte is the one without a continuation bit
+    byte_ends = np.flatnonzero(encoded < 0x80) + 1
+    postings_ends = byte_ends[2 * np.cumsum(dfs) - 1] if len(dfs) else np.zeros(0, dtype=np.int64)
+
+    lexicon = np.zeros((len(terms), 3), dtype=np.int64)
+    lexicon[:, 0] = np.cumsum([len(t) for t in terms])
+    lexicon[:, 1] = postings_ends
+    lexicon[:, 2] = dfs
+
+    tmp.joinpath('terms.bin').write_bytes(b''.join(terms))
+    tmp.joinpath('lexicon.bin').write_bytes(lexicon.tobytes())
+    tmp.joinpath('postings.bin').write_bytes(encoded.tobytes())
+    tmp.joinpath('lengths.bin').write_bytes(np.asarray(lengths, dtype=np.uint32).tobytes())
+    tmp.joinpath('dois.txt').write_text('\n'.join(dois), encoding='utf-8')
+
+    os.replace(tmp, path)
+
+
+# ---- Index -----------------------------------------------------------------------------
+
+class FullTextIndex:
+    """Segmented on-disk inverted index with BM25 ranking
+
+    Every `add` writes a new immutable segment; once `MERGE_FACTOR` segments exist, the
+    smallest are merged into one, dropping documents that were replaced since. Segments
+    are memory-mapped, so opening the index reads little more than the DOI lists, and a
+    query only touches the postings of its own terms. The manifest is replaced atomically
+    after every change, so a crash leaves the previous state readable.
+
+    One process writes at a time; any number can search.
+
+    Args:
+        * path (Path) : Index directory, created if missing
+    """
+
+    _path : Path = None
+
+    _segments : 'list[_Segment]' = None
+
+    def __init__(self, path: Path) -> None:
+        self._path = Path(path)
+        self._path.mkdir(parents=True, exist_ok=True)
+
+        manifest_path = self._path.joinpath(_MANIFEST)
+        manifest = {'version': _VERSION, 'next_segment': 0, 'segments': [], 'deleted': {}}
+        if manifest_path.exists():
+            manifest = json.loads(manifest_path.read_text(encoding='utf-8'))
+
+        self._next_segment = manifest['next_segment']
+        self._segments = [_Segment(self._path.joinpath(name)) for name in manifest['segments']]
+        self._deleted = {name: set(ids) for name, ids in manifest['deleted'].items()}
+
+        # Left behind by an interrupted write or merge
+        live = set(manifest['segments'])
+        for p in self._path.iterdir():
+            if p.is_dir() and p.name not in live:
+                shutil.rmtree(p, ignore_errors=True)
+
+        self._locations = {}
+        for segment in self._segments:
+            deleted = self._deleted.get(segment.name, ())
+            for i, doi in enumerate(segment.dois):
+                if i not in deleted:
+                    self._locations[doi] = (segment, i)
+
+    def __contains__(self, doi: str) -> bool:
+        return doi in self._locations
+
+    def __len__(self) -> int:
+        return len(self._locations)
+
+    @property
+    def segment_count(self) -> int:
+        return len(self._segments)
+
+    def add(self, documents: 'Iterable[tuple[str, dict[str, int]]]') -> int:
+        """Adds documents as one new segment, replacing any already indexed under the same DOI
+
+        Args:
+            * documents (iterable of (str, dict)) : DOI and term frequencies of each document, see `term_counts`
+
+        Returns:
+            int: Number of documents added
+        """
+        dois, lengths = [], []
+        vocabulary, term_of, doc_ids, tfs = {}, [], [], []
+        seen = {}
+        for doi, counts in documents:
+            if doi in seen:
+                # A later copy in the same batch wins
+                lengths[seen[doi]] = None
+            seen[doi] = doc_id = len(dois)
+            dois.append(doi)
+            lengths.append(sum(counts.values()))
+            term_of.extend([vocabulary.setdefault(term, len(vocabulary)) for term in counts])
+            doc_ids.extend([doc_id] * len(counts))
+            tfs.extend(counts.values())
+
+        if not dois:
+            return 0
+
+        name = f'seg-{self._next_segment:06d}'
+        self._next_segment += 1
+        _write_segment(self._path.joinpath(name), dois, [l or 0 for l in lengths],
+                       *_group_by_term([t.encode('utf-8') for t in vocabulary], np.array(term_of, dtype=np.int64),
+                                       np.array(doc_ids, dtype=np.int64), np.array(tfs, dtype=np.int64)))
+
+        segment = _Segment(self._path.joinpath(name))
+        self._segments.append(segment)
+        deleted = {i for i, l in enumerate(lengths) if l is None}
+        if deleted:
+            self._deleted[name] = deleted
+        for i, doi in enumerate(dois):
+            if i in deleted:
+                continue
+            previous = self._locations.get(doi)
+            if previous is not None:
+                self._deleted.setdefault(previous[0].name, set()).add(previous[1])
+            self._locations[doi] = (segment, i)
+
+        self._write_manifest()
+        if len(self._segments) >= MERGE_FACTOR:
+            self.merge(MERGE_FACTOR)
+        return len(dois) - len(deleted)
+
+    def merge(self, count: int = None) -> None:
+        """Merges the `count` smallest segments into one, or all of them by default"""
+        if count is None or count > len(self._segments):
+            count = len(self._segments)
+        if count < 2 and not any(self._deleted.values()):
+            return
+
+        merging = sorted(self._segments, key=len)[:count]
+        # Keep the older documents first, so doc IDs follow insertion order
+        merging.sort(key=lambda s: s.name)
+
+        dois, lengths, remaps = [], [], []
+        for segment in merging:
+            keep = np.ones(len(segment), dtype=bool)
+            keep[list(self._deleted.get(segment.name, ()))] = False
+            remap = np.cumsum(keep) - 1 + len(dois)
+            remaps.append((keep, remap))
+            dois.extend(d for d, k in zip(segment.dois, keep) if k)
+            lengths.extend(np.asarray(segment.lengths)[keep].tolist())
+
+        terms, term_of, doc_ids, tfs = [], [], [], []
+        for segment, (keep, remap) in zip(merging, remaps):
+            segment_terms, dfs, ids, freqs = segment.read_all()
+            live = keep[ids]
+            term_of.append((np.repeat(np.arange(len(dfs)), dfs) + len(terms))[live])
+            doc_ids.append(remap[ids[live]])
+            tfs.append(freqs[live])
+            terms.extend(segment_terms)
+
+        # Each segment's terms are unique, so only terms found in several segments need joining
+        first = {}
+        duplicate_of = np.array([first.setdefault(t, i) for i, t in enumerate(terms)], dtype=np.int64)
+        terms, dfs, doc_ids, tfs = _group_by_term(terms, duplicate_of[np.concatenate(term_of)],
+                                                  np.concatenate(doc_ids), np.concatenate(tfs))
+
+        name = f'seg-{self._next_segment:06d}'
+        self._next_segment += 1
+        _write_segment(self._path.joinpath(name), dois, lengths, terms, dfs, doc_ids, tfs)
+        merged = _Segment(self._path.joinpath(name))
+
+        merged_names = {s.name for s in merging}
+        position = min(self._segments.index(s) for s in merging)
+        remaining = [s for s in self._segments if s.name not in merged_names]
+        self._segments = remaining[:position] + [merged] + remaining[position:]
+        for segment in merging:
+            self._deleted.pop(segment.name, None)
+        for i, doi in enumerate(dois):
+            self._locations[doi] = (merged, i)
+        self._write_manifest()
+
+        for segment in merging:
+            shutil.rmtree(segment.path, ignore_errors=True)
+
+    def search(self, query: str, k: int = 10) -> 'list[SearchHit]':
+        """Top `k` documents for `query` by BM25, best first"""
+        terms = [t.encode('utf-8') for t in dict.fromkeys(tokenize(query))]
+        if not terms or not self._segments:
+            return []
+
+        total_docs = sum(len(s) for s in self._segments)
+        live_docs = len(self._locations)
+        avgdl = sum(float(np.asarray(s.lengths, dtype=np.float64).sum()) for s in self._segments) / max(total_docs, 1)
+
+        # Lexicon rows are looked up once per segment and term, for the document frequency and the postings
+        rows = [[s.find(t) for t in terms] for s in self._segments]
+        idfs = []
+        for j in range(len(terms)):
+            df = sum(int(s.lexicon[r[j], 2]) for s, r in zip(self._segments, rows) if r[j] >= 0)
+            idfs.append(log(1 + (live_docs - df + 0.5) / (df + 0.5)) if df else 0.0)
+
+        hits = []
+        for segment, segment_rows in zip(self._segments, rows):
+            if all(r < 0 for r in segment_rows):
+                continue
+            scores = np.zeros(len(segment), dtype=np.float64)
+            norms = K1 * (1 - B + B * np.asarray(segment.lengths, dtype=np.float64) / avgdl)
+            for row, idf in zip(segment_rows, idfs):
+                if row < 0:
+                    continue
+                ids, tfs = segment.read_postings(row)
+                scores[ids] += idf * tfs * (K1 + 1) / (tfs + norms[ids])
+
+            deleted = self._deleted.get(segment.name)
+            if deleted:
+                scores[list(deleted)] = 0
+
+            candidates = np.flatnonzero(scores)
+            if len(candidates) > k:
+                candidates = candidates[np.argpartition(scores[candidates], -k)[-k:]]
+            hits.extend(SearchHit(segment.dois[i], float(scores[i])) for i in candidates)
+
+        return heapq.nlargest(k, hits, key=lambda h: h.score)
+
+    def _write_manifest(self) -> None:
+        manifest = {
+            'version': _VERSION,
+            'next_segment': self._next_segment,
+            'segments': [s.name for s in self._segments],
+            'deleted': {name: sorted(ids) for name, ids in self._deleted.items() if ids},
+        }
+        tmp = self._path.joinpath(_MANIFEST + '.tmp')
+        tmp.write_text(json.dumps(manifest), encoding='utf-8')
+        os.replace(tmp, self._path.joinpath(_MANIFEST))
+
+
+# ---- Building from the pdf store -------------------------------------------------------
+
+def term_counts(text: str) -> 'dict[str, int]':
+    """Term frequencies of `text`, as `FullTextIndex.add` takes them"""
+    return dict(Counter(tokenize(text)))
+
+
+def _extract_terms(item: 'tuple[str, object]') -> 'tuple[str, Optional[dict], Optional[str]]':
+    doi, source = item
+    try:
+        content = read_pdf(source.read_bytes())
+        return doi, term_counts('\n'.join(content.pages)), None
+    except Exception as e:
+        return doi, None, f'{type(e).__name__}: {e}'
+
+
+def index_store(store, index: FullTextIndex, workers: int = None, batch_size: int = 1000, chunksize: int = 8) -> 'dict[str, float]':
+    """Adds every pdf in a ContentStore that is not in `index` yet
+
+    Text is extracted and tokenized in a process pool, only term counts come back to this
+    process. Every `batch_size` documents become one segment.
+
+    Args:
+        * store (ContentStore) : Store to index
+        * index (FullTextIndex) : Index to add to
+        * workers (int, optional) : Worker processes. Defaults to the CPU count.
+        * batch_size (int, optional) : Documents per segment. Defaults to 1000.
+        * chunksize (int, optional) : pdfs handed to a worker at a time. Defaults to 8.
+
+    Returns:
+        dict: Counts of `indexed` and `failed` pdfs, and `seconds` taken
+    """
+    # Pruned pdfs are read from the store's archive
+    items = [(doi, store.source_for(sha256)) for doi, sha256, _ in store.items() if doi not in index]
+    counts = {'indexed': 0, 'failed': 0}
+
+    start = perf_counter()
+    batch = []
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        for doi, terms, error in pool.map(_extract_terms, items, chunksize=chunksize):
+            if terms is None:
+                counts['failed'] += 1
+                print(f'Could not index {doi}: {error}')
+                continue
+            batch.append((doi, terms))
+            if len(batch) >= batch_size:
+                counts['indexed'] += index.add(batch)
+                batch = []
+    counts['indexed'] += index.add(batch)
+
+    counts['seconds'] = perf_counter() - start
+    return counts
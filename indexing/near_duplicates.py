@@ -0,0 +1,366 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from time import perf_counter, time
+from typing import Iterable, Iterator, NamedTuple, Optional
+
+import numpy as np
+
+from indexing.fulltext import tokenize
+from indexing.pdf_text import read_pdf
+
+# Permutations per signature, split into LSH bands of BAND_ROWS rows. Pairs at Jaccard
+# similarity s share a band with probability 1 - (1 - s**8)**16: 0.99 at 0.8, 0.08 at 0.4
+NUM_PERM = 128
+BAND_ROWS = 8
+BANDS = NUM_PERM // BAND_ROWS
+
+# Words per text shingle, characters per title shingle
+TEXT_SHINGLE = 5
+TITLE_SHINGLE = 3
+
+# Titles like "Book Review" or "Reply" are shared by unrelated articles, so short ones aren't compared
+MIN_TITLE_WORDS = 4
+
+KINDS = ('text', 'title')
+
+# Shingle hashes handled at once, bounding the (chunk, NUM_PERM) intermediate
+_CHUNK = 4096
+
+# SQLite caps the number of bound parameters per statement, so lookups are chunked
+_MAX_PARAMS = 900
+
+
+def _permutation_parameters() -> 'tuple[np.ndarray, np.ndarray]':
+    # Derived from fixed digests, so stored signatures stay comparable across numpy versions
+    digests = [hashlib.blake2b(f'minhash-{i}'.encode('ascii'), digest_size=16).digest() for i in range(NUM_PERM)]
+    a = np.array([int.from_bytes(d[:8], 'little') | 1 for d in digests], dtype=np.uint64)
+    b = np.array([int.from_bytes(d[8:], 'little') for d in digests], dtype=np.uint64)
+    return a, b
+
+
+_A, _B = _permutation_parameters()
+
+
+class NearDuplicateError(Exception):
+    """An article's text or title is close to one that is already stored"""
+    pass
+
+
+class Match(NamedTuple):
+    doi: str
+    kind: str
+    similarity: float
+
+
+def minhash(shingles: Iterable[str]) -> Optional[np.ndarray]:
+    """MinHash signature of a set of shingles, NUM_PERM uint32 values
+
+    Returns:
+        ndarray: The signature, or None if there are no shingles
+    """
+    hashes = np.fromiter((zlib.crc32(s.encode('utf-8')) for s in set(shingles)), dtype=np.uint64)
+    if len(hashes) == 0:
+        return None
+
+    # Multiply-shift hashing, h(x) = ((a * x + b) mod 2**64) >> 32 with odd a, one (a, b) per permutation
+    mins = np.full(NUM_PERM, 0xffffffff, dtype=np.uint64)
+    for start in range(0, len(hashes), _CHUNK):
+        chunk = hashes[start:start + _CHUNK, None]
+        np.minimum(mins, ((chunk * _A + _B) >> np.uint64(32)).min(axis=0), out=mins)
+    return mins.astype(np.uint32)
+
+
+def normalise_title(title: str) -> str:
+    """Casefolded title words separated by single spaces, without punctuation"""
+    return ' '.join(re.findall(r'[^\W_]+', title.casefold()))
+
+
+def text_signature(text: str) -> Optional[np.ndarray]:
+    """MinHash of the word TEXT_SHINGLE-grams of `text`, None if it is too short"""
+    tokens = tokenize(text)
+    return minhash(' '.join(tokens[i:i + TEXT_SHINGLE]) for i in range(len(tokens) - TEXT_SHINGLE + 1))
+
+
+def title_signature(title: str) -> Optional[np.ndarray]:
+    """MinHash of the character TITLE_SHINGLE-grams of the normalised `title`, None for short titles"""
+    title = normalise_title(title or '')
+    if len(title.split()) < MIN_TITLE_WORDS:
+        return None
+    return minhash(title[i:i + TITLE_SHINGLE] for i in range(len(title) - TITLE_SHINGLE + 1))
+
+
+def pdf_text_signature(path) -> Optional[np.ndarray]:
+    """Text signature of a pdf, leaving out the cover page JSTOR puts in front of every download
+
+    Args:
+        * path (Path) : The pdf, or anything else to `read_bytes` it from, such as `ContentStore.source_for`
+    """
+    source = Path(path) if isinstance(path, str) else path
+    pages = read_pdf(source.read_bytes()).pages
+    return text_signature('\n'.join(pages[1:] if len(pages) > 1 else pages))
+
+
+def _pdf_text_signature_or_none(path) -> Optional[np.ndarray]:
+    try:
+        return pdf_text_signature(path)
+    except Exception:
+        return None
+
+
+def _pdf_text_signature_or_error(path) -> 'tuple[Optional[np.ndarray], Optional[str]]':
+    try:
+        return pdf_text_signature(path), None
+    except Exception as e:
+        return None, f'{type(e).__name__}: {e}'
+
+
+def pdf_text_signatures(paths: 'Iterable[Path]', workers: int = None, chunksize: int = 4) -> 'Iterator[Optional[np.ndarray]]':
+    """Text signatures of pdfs from a process pool, in the order of `paths`, None for unreadable ones"""
+    paths = list(paths)
+    if len(paths) == 1:
+        # Not worth starting a pool for
+        yield _pdf_text_signature_or_none(paths[0])
+        return
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        yield from pool.map(_pdf_text_signature_or_none, paths, chunksize=chunksize)
+
+
+def _band_keys(signature: np.ndarray) -> 'list[int]':
+    # The band number is part of the key, so one lookup covers every band
+    bands = signature.reshape(BANDS, BAND_ROWS)
+    return [int.from_bytes(hashlib.blake2b(bytes([i]) + band.tobytes(), digest_size=8).digest(), 'little', signed=True)
+            for i, band in enumerate(bands)]
+
+
+class NearDuplicateIndex:
+    """Persistent MinHash signatures of stored articles with an LSH index over them
+
+    Every article can have a text signature, from its pdf, and a title signature. Each
+    signature is filed under one key per band, so the articles that may be similar to a new
+    one are found with a single indexed lookup whatever the size of the corpus, and only
+    those are compared. Articles found to be near-duplicates are flagged until allowed.
+
+    Args:
+        * path (Path, optional) : Location of the SQLite database. Defaults to `near_duplicates.sqlite3`.
+        * text_threshold (float, optional) : Estimated Jaccard similarity of the text from which an
+            article is a near-duplicate. Defaults to 0.8.
+        * title_threshold (float, optional) : The same for titles. Defaults to 0.9.
+    """
+
+    _path : Path = None
+
+    _conn : sqlite3.Connection = None
+
+    _lock : threading.Lock = None
+
+    def __init__(self, path: Path = Path('near_duplicates.sqlite3'), text_threshold: float = 0.8, title_threshold: float = 0.9) -> None:
+        self._path = Path(path)
+        self._thresholds = {'text': text_threshold, 'title': title_threshold}
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self._path), check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        with self._conn:
+            # Articles without any signature are recorded too, so they aren't read again
+            self._conn.execute('''CREATE TABLE IF NOT EXISTS articles (
+                                    doi TEXT PRIMARY KEY,
+                                    added_at REAL NOT NULL
+                                  )''')
+            self._conn.execute('''CREATE TABLE IF NOT EXISTS signatures (
+                                    doi TEXT NOT NULL,
+                                    kind TEXT NOT NULL,
+                                    signature BLOB NOT NULL,
+                                    PRIMARY KEY (doi, kind)
+                                  ) WITHOUT ROWID''')
+            self._conn.execute('''CREATE TABLE IF NOT EXISTS bands (
+                                    kind TEXT NOT NULL,
+                                    band_key INTEGER NOT NULL,
+                                    doi TEXT NOT NULL,
+                                    PRIMARY KEY (kind, band_key, doi)
+                                  ) WITHOUT ROWID''')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS bands_doi ON bands (doi)')
+            self._conn.execute('''CREATE TABLE IF NOT EXISTS flags (
+                                    doi TEXT PRIMARY KEY,
+                                    duplicate_of TEXT NOT NULL,
+                                    kind TEXT NOT NULL,
+                                    similarity REAL NOT NULL,
+                                    allowed INTEGER NOT NULL DEFAULT 0,
+                                    flagged_at REAL NOT NULL
+                                  )''')
+
+    def __contains__(self, doi: str) -> bool:
+        with self._lock:
+            row = self._conn.execute('SELECT 1 FROM articles WHERE doi = ?', (doi,)).fetchone()
+        return row is not None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM articles').fetchone()[0]
+
+    def add(self, doi: str, text: np.ndarray = None, title: np.ndarray = None) -> None:
+        """Stores the signatures of an article, replacing any it had
+
+        Args:
+            * doi (str) : The article
+            * text (ndarray, optional) : Its text signature, see `text_signature`
+            * title (ndarray, optional) : Its title signature, see `title_signature`
+        """
+        self.add_many([(doi, text, title)])
+
+    def add_many(self, articles: 'Iterable[tuple[str, np.ndarray, np.ndarray]]') -> None:
+        """Stores the DOI, text and title signatures of many articles in one transaction"""
+        now = time()
+        with self._lock, self._conn:
+            for doi, text, title in articles:
+                self._conn.execute('INSERT OR REPLACE INTO articles (doi, added_at) VALUES (?, ?)', (doi, now))
+                self._conn.execute('DELETE FROM signatures WHERE doi = ?', (doi,))
+                self._conn.execute('DELETE FROM bands WHERE doi = ?', (doi,))
+                for kind, signature in zip(KINDS, (text, title)):
+                    if signature is None:
+                        continue
+                    self._conn.execute('INSERT INTO signatures (doi, kind, signature) VALUES (?, ?, ?)',
+                                       (doi, kind, signature.astype(np.uint32).tobytes()))
+                    self._conn.executemany('INSERT OR IGNORE INTO bands (kind, band_key, doi) VALUES (?, ?, ?)',
+                                           ((kind, key, doi) for key in _band_keys(signature)))
+
+    def query(self, signature: np.ndarray, kind: str = 'text', exclude: str = None) -> 'list[Match]':
+        """Stored articles whose `kind` signature is at least the threshold similar to `signature`
+
+        Args:
+            * signature (ndarray) : Signature to look up
+            * kind (str, optional) : 'text' or 'title'. Defaults to 'text'.
+            * exclude (str, optional) : DOI to leave out, usually the article's own
+
+        Returns:
+            list[Match]: Most similar first
+        """
+        keys = _band_keys(signature)
+        with self._lock:
+            candidates = [row[0] for row in self._conn.execute(
+                f'SELECT DISTINCT doi FROM bands WHERE kind = ? AND band_key IN ({",".join("?" * len(keys))})', (kind, *keys))]
+            candidates = [doi for doi in candidates if doi != exclude]
+
+            stored = []
+            for i in range(0, len(candidates), _MAX_PARAMS):
+                chunk = candidates[i:i + _MAX_PARAMS]
+                stored.extend(self._conn.execute(
+                    f'SELECT doi, signature FROM signatures WHERE kind = ? AND doi IN ({",".join("?" * len(chunk))})', (kind, *chunk)))
+
+        matches = []
+        for doi, blob in stored:
+            similarity = float(np.mean(np.frombuffer(blob, dtype=np.uint32) == signature))
+            if similarity >= self._thresholds[kind]:
+                matches.append(Match(doi, kind, similarity))
+        return sorted(matches, key=lambda m: m.similarity, reverse=True)
+
+    def check(self, doi: str, text: np.ndarray = None, title: np.ndarray = None,
+              pending: 'dict[str, tuple[np.ndarray, np.ndarray]]' = None) -> 'list[Match]':
+        """Near-duplicates of an article by text and by title, most similar first, see `query`
+
+        Args:
+            * doi (str) : The article
+            * text (ndarray, optional) : Its text signature
+            * title (ndarray, optional) : Its title signature
+            * pending (dict, optional) : Text and title signatures by DOI of articles that are not
+                stored yet, compared one by one as well
+        """
+        matches = []
+        for i, (kind, signature) in enumerate(zip(KINDS, (text, title))):
+            if signature is None:
+                continue
+            matches.extend(self.query(signature, kind, exclude=doi))
+            for other, signatures in (pending or {}).items():
+                if other == doi or signatures[i] is None:
+                    continue
+                similarity = float(np.mean(signatures[i] == signature))
+                if similarity >= self._thresholds[kind]:
+                    matches.append(Match(other, kind, similarity))
+        return sorted(matches, key=lambda m: m.similarity, reverse=True)
+
+    def flag(self, doi: str, match: Match) -> None:
+        """Records `doi` as a near-duplicate of `match.doi`, unless it was allowed already"""
+        with self._lock, self._conn:
+            self._conn.execute('''INSERT INTO flags (doi, duplicate_of, kind, similarity, flagged_at) VALUES (?, ?, ?, ?, ?)
+                                  ON CONFLICT (doi) DO UPDATE SET duplicate_of = excluded.duplicate_of, kind = excluded.kind,
+                                                                  similarity = excluded.similarity, flagged_at = excluded.flagged_at
+                                  WHERE NOT allowed''',
+                               (doi, match.doi, match.kind, match.similarity, time()))
+
+    def allow(self, doi: str) -> bool:
+        """Lets a flagged article be uploaded after all
+
+        Returns:
+            bool: False if `doi` was never flagged
+        """
+        with self._lock, self._conn:
+            return self._conn.execute('UPDATE flags SET allowed = 1 WHERE doi = ?', (doi,)).rowcount > 0
+
+    def unflag_duplicates_of(self, doi: str) -> int:
+        """Drops the flags of articles found to duplicate `doi`, e.g. when `doi` was never stored after all
+
+        Returns:
+            int: Number of flags dropped
+        """
+        with self._lock, self._conn:
+            return self._conn.execute('DELETE FROM flags WHERE duplicate_of = ? AND NOT allowed', (doi,)).rowcount
+
+    def flagged(self) -> 'dict[str, Match]':
+        """Every article flagged and not allowed, with the stored article it duplicates"""
+        with self._lock:
+            rows = self._conn.execute('SELECT doi, duplicate_of, kind, similarity FROM flags WHERE NOT allowed ORDER BY flagged_at').fetchall()
+        return {doi: Match(duplicate_of, kind, similarity) for doi, duplicate_of, kind, similarity in rows}
+
+    def allowed(self) -> 'set[str]':
+        """Articles that were flagged, then allowed"""
+        with self._lock:
+            return {row[0] for row in self._conn.execute('SELECT doi FROM flags WHERE allowed')}
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def index_store(store, index: NearDuplicateIndex, titles: 'dict[str, str]' = None, workers: int = None, chunksize: int = 4) -> 'dict[str, float]':
+    """Adds signatures for every pdf in a ContentStore that `index` does not have yet
+
+    Text signatures are computed in a process pool, see `index_store` in indexing.fulltext.
+    pdfs that cannot be read are left out, so the next run tries them again.
+
+    Args:
+        * store (ContentStore) : Store to index, pruned pdfs are read from its archive
+        * index (NearDuplicateIndex) : Index to add to
+        * titles (dict, optional) : Titles by DOI, e.g. from the metadata log
+        * workers (int, optional) : Worker processes. Defaults to the CPU count.
+        * chunksize (int, optional) : pdfs handed to a worker at a time. Defaults to 4.
+
+    Returns:
+        dict: Counts of `indexed` pdfs, pdfs `without_text` among them, pdfs that `failed`, and `seconds` taken
+    """
+    titles = titles or {}
+    items = [(doi, store.source_for(sha256)) for doi, sha256, _ in store.items() if doi not in index]
+    counts = {'indexed': 0, 'without_text': 0, 'failed': 0}
+
+    start = perf_counter()
+    batch = []
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        for (doi, _), (text, error) in zip(items, pool.map(_pdf_text_signature_or_error,
+                                                          (source for _, source in items), chunksize=chunksize)):
+            if error is not None:
+                counts['failed'] += 1
+                print(f'Could not sign {doi}: {error}')
+                continue
+            counts['indexed'] += 1
+            counts['without_text'] += text is None
+            batch.append((doi, text, title_signature(titles.get(doi, ''))))
+            if len(batch) >= 500:
+                index.add_many(batch)
+                batch = []
+    index.add_many(batch)
+
+    counts['seconds'] = perf_counter() - start
+    return counts
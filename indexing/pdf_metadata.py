@@ -0,0 +1,236 @@
+import json
+import os
+import re
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from time import perf_counter
+from typing import Iterator, Optional
+
+from indexing.pdf_text import read_pdf
+
+DOI_REGEX = re.compile(r'\b(10\.\d{4,9}/[^\s"<>]+[^\s"<>.,;)])')
+YEAR_REGEX = re.compile(r'\b(1[5-9]\d\d|20\d\d)\b')
+
+# JSTOR cover pages look like:
+#   <title>
+#   Author(s): Nicky Best, Deborah Ashby and Frank Dunstan
+#   Source: Journal of the Royal Statistical Society. Series A (Statistics in Society), Vol. 176, No. 1 (JANUARY 2013), pp. 53-83
+#   Published by: Wiley for the Royal Statistical Society
+#   Stable URL: https://www.jstor.org/stable/23355177
+COVER_TITLE_REGEX = re.compile(r'^\s*(?P<title>.+?)\s*\n\s*(?:Author\(s\)|Source|Reviewed work\(s\)):', re.S)
+COVER_AUTHORS_REGEX = re.compile(r'Author\(s\):\s*(?P<authors>.+?)\s*\n\s*(?:Source|Reviewed|Published|Stable)', re.S)
+COVER_SOURCE_REGEX = re.compile(r'Source:\s*(?P<source>.+?)\s*\n\s*(?:Published|Stable|Accessed)', re.S)
+COVER_STABLE_REGEX = re.compile(r'Stable URL:\s*\S*?/stable/(?P<docid>[\w.]+)')
+
+_JOURNAL_FROM_SOURCE_REGEX = re.compile(r'^(?P<journal>.+?),\s*(?:Vol\.|No\.)')
+_AUTHOR_SPLIT_REGEX = re.compile(r'\s*(?:,\s*and\s+|,\s*|\s+and\s+|;\s*)')
+
+_XMP_NS = {
+    'rdf': 'http://www.w3.org/1999/02/22-rdf-syntax-ns#',
+    'dc': 'http://purl.org/dc/elements/1.1/',
+    'prism': 'http://prismstandard.org/namespaces/basic/2.0/',
+    'prism2': 'http://prismstandard.org/namespaces/basic/2.1/',
+    'pdfx': 'http://ns.adobe.com/pdfx/1.3/',
+}
+
+
+@dataclass
+class PdfMetadata:
+    """Article metadata recovered from a pdf
+
+    Attributes:
+        * doi (str) : DOI, from XMP, the info dictionary or the first page text
+        * title (str) : Article title
+        * authors (list[str]) : Author names in listed order
+        * journal (str) : Journal name
+        * year (str) : Year of publication
+        * sources (dict) : Where each field was found, `xmp`, `info` or `text`
+    """
+    doi: Optional[str] = None
+    title: Optional[str] = None
+    authors: 'list[str]' = field(default_factory=list)
+    journal: Optional[str] = None
+    year: Optional[str] = None
+    sources: 'dict[str, str]' = field(default_factory=dict)
+
+    def _fill(self, source: str, **values) -> None:
+        # Earlier sources win, later ones only fill gaps
+        for key, value in values.items():
+            if value and not getattr(self, key):
+                setattr(self, key, value)
+                self.sources[key] = source
+
+    def as_content_data(self) -> dict:
+        """The metadata in the shape of JSTOR's Vue store `contentData`, which main.py reads"""
+        return {
+            'doi': self.doi,
+            'displayTitle': self.title or '',
+            'authors': self.authors,
+            'journal': self.journal,
+            'year': self.year,
+        }
+
+
+def _xmp_fields(xmp: bytes) -> dict:
+    try:
+        root = ET.fromstring(xmp)
+    except ET.ParseError:
+        return {}
+
+    def texts(path: str) -> 'list[str]':
+        return [e.text.strip() for e in root.iterfind(path, _XMP_NS) if e.text and e.text.strip()]
+
+    def first(*paths: str) -> Optional[str]:
+        for p in paths:
+            found = texts(p)
+            if found:
+                return found[0]
+        return None
+
+    doi = first('.//prism:doi', './/prism2:doi', './/pdfx:doi')
+    if doi is None:
+        identifier = first('.//dc:identifier')
+        m = DOI_REGEX.search(identifier or '')
+        doi = m.group(1) if m else None
+
+    date = first('.//prism:coverDate', './/prism2:coverDate', './/prism:publicationDate', './/dc:date//rdf:li', './/dc:date')
+    year = YEAR_REGEX.search(date or '')
+
+    return {
+        'doi': doi,
+        'title': first('.//dc:title//rdf:li', './/dc:title'),
+        'authors': texts('.//dc:creator//rdf:li'),
+        'journal': first('.//prism:publicationName', './/prism2:publicationName'),
+        'year': year.group(1) if year else None,
+    }
+
+
+def _info_fields(info: 'dict[str, str]') -> dict:
+    doi = info.get('doi') or info.get('DOI')
+    if doi is None:
+        m = DOI_REGEX.search(' '.join(info.get(k, '') for k in ('Subject', 'Keywords')))
+        doi = m.group(1) if m else None
+
+    # Only publication dates, not the CreationDate of a re-rendered file
+    year = YEAR_REGEX.search(info.get('Subject', ''))
+
+    authors = [a for a in _AUTHOR_SPLIT_REGEX.split(info.get('Author', '').strip()) if a]
+
+    return {
+        'doi': doi,
+        'title': info.get('Title', '').strip() or None,
+        'authors': authors,
+        'year': year.group(1) if year else None,
+    }
+
+
+def _text_fields(text: str) -> dict:
+    values = {}
+
+    m = DOI_REGEX.search(text)
+    if m is not None:
+        values['doi'] = m.group(1)
+
+    m = COVER_TITLE_REGEX.search(text)
+    if m is not None:
+        values['title'] = ' '.join(m.group('title').split())
+
+    m = COVER_AUTHORS_REGEX.search(text)
+    if m is not None:
+        values['authors'] = [a for a in _AUTHOR_SPLIT_REGEX.split(' '.join(m.group('authors').split())) if a]
+
+    m = COVER_SOURCE_REGEX.search(text)
+    if m is not None:
+        source = ' '.join(m.group('source').split())
+        journal = _JOURNAL_FROM_SOURCE_REGEX.search(source)
+        values['journal'] = journal.group('journal') if journal else source.split(',')[0]
+        year = YEAR_REGEX.findall(source)
+        if year:
+            values['year'] = year[-1]
+
+    m = COVER_STABLE_REGEX.search(text)
+    if m is not None and 'doi' not in values:
+        # JSTOR's own articles use their stable ID under the 10.2307 prefix
+        values['doi'] = f'10.2307/{m.group("docid")}'
+
+    return values
+
+
+def extract_pdf_metadata(data: bytes) -> PdfMetadata:
+    """Recovers DOI, title, authors, journal and year from a pdf without a browser
+
+    XMP metadata is trusted first, then the document information dictionary, then the text
+    of the first page, which for JSTOR downloads is the cover page.
+
+    Args:
+        * data (bytes or memoryview) : The pdf
+
+    Returns:
+        PdfMetadata: The fields found, missing ones are None or empty
+    """
+    content = read_pdf(data, max_pages=1)
+
+    metadata = PdfMetadata()
+    if content.xmp:
+        metadata._fill('xmp', **_xmp_fields(content.xmp))
+    metadata._fill('info', **_info_fields(content.info))
+    if content.pages:
+        metadata._fill('text', **_text_fields(content.pages[0]))
+
+    return metadata
+
+
+def extract_pdf_metadata_from_path(path: Path) -> PdfMetadata:
+    return extract_pdf_metadata(Path(path).read_bytes())
+
+
+def _extract_job(item: 'tuple[str, object]') -> 'tuple[str, Optional[dict], Optional[str]]':
+    doi, source = item
+    try:
+        return doi, asdict(extract_pdf_metadata(source.read_bytes())), None
+    except Exception as e:
+        return doi, None, f'{type(e).__name__}: {e}'
+
+
+def reindex_store(store, out_path: Path, workers: int = None, chunksize: int = 8) -> 'dict[str, float]':
+    """Extracts metadata for every pdf in a ContentStore in a process pool
+
+    Results are appended to `out_path` as JSON lines with the store's DOI under `stored_doi`.
+    Workers read the pdfs from disk themselves, loose or archived, only their locations and the
+    results cross process boundaries.
+
+    Args:
+        * store (ContentStore) : Store to re-index
+        * out_path (Path) : JSONL file the results are written to
+        * workers (int, optional) : Worker processes. Defaults to the CPU count.
+        * chunksize (int, optional) : pdfs handed to a worker at a time. Defaults to 8.
+
+    Returns:
+        dict: Counts of `indexed` and `failed` pdfs, and `seconds` taken
+    """
+    items = [(doi, store.source_for(sha256)) for doi, sha256, _ in store.items()]
+    counts = {'indexed': 0, 'failed': 0}
+
+    start = perf_counter()
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool, \
+         Path(out_path).open('a', encoding='utf-8') as out:
+        for doi, metadata, error in pool.map(_extract_job, items, chunksize=chunksize):
+            if metadata is None:
+                counts['failed'] += 1
+                out.write(json.dumps({'stored_doi': doi, 'error': error}) + '\n')
+            else:
+                counts['indexed'] += 1
+                out.write(json.dumps({'stored_doi': doi, **metadata}, ensure_ascii=False) + '\n')
+
+    counts['seconds'] = perf_counter() - start
+    return counts
+
+
+def iter_reindexed(path: Path) -> Iterator[dict]:
+    """Reads back the records written by reindex_store"""
+    with Path(path).open(encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
@@ -0,0 +1,225 @@
+import io
+import re
+import zlib
+from typing import NamedTuple, Optional, Union
+
+# pypdf gives proper page order and font decoding, without it a byte-level fallback is used
+try:
+    from pypdf import PdfReader
+except ImportError:
+    PdfReader = None
+
+
+class PdfContent(NamedTuple):
+    """What can be read from a pdf without rendering it
+
+    Attributes:
+        * info (dict) : Document information dictionary, keys without the leading `/`
+        * xmp (bytes) : Raw XMP metadata packet, None if the pdf has none
+        * pages (list[str]) : Extracted text, one entry per page (best effort without pypdf)
+    """
+    info: 'dict[str, str]'
+    xmp: Optional[bytes]
+    pages: 'list[str]'
+
+
+def read_pdf(data: Union[bytes, memoryview], max_pages: int = None) -> PdfContent:
+    """Reads the info dictionary, XMP packet and page text of a pdf
+
+    The pdf is never copied as a whole, so a memory-mapped file stays on disk and only the
+    objects that are looked at are read into memory.
+
+    Args:
+        * data (bytes or memoryview) : The pdf
+        * max_pages (int, optional) : Only extract text from this many leading pages
+
+    Returns:
+        PdfContent: Whatever could be read, fields are empty rather than missing
+    """
+    # Released on return, so the caller can close a memory map right after
+    with memoryview(data).cast('B') as view:
+        if PdfReader is not None:
+            try:
+                return _read_with_pypdf(view, max_pages)
+            except Exception:
+                # Damaged files are often still readable byte by byte
+                pass
+        return _read_raw(view, max_pages)
+
+
+class _ViewReader(io.RawIOBase):
+    """Seekable file over a memoryview, unlike BytesIO it does not copy the buffer"""
+
+    def __init__(self, view: memoryview) -> None:
+        self._view = view
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        n = max(0, min(len(b), len(self._view) - self._pos))
+        b[:n] = self._view[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: len(self._view)}[whence]
+        self._pos = max(0, base + offset)
+        return self._pos
+
+    def tell(self) -> int:
+        return self._pos
+
+
+def _read_with_pypdf(view: memoryview, max_pages: int) -> PdfContent:
+    reader = PdfReader(_ViewReader(view), strict=False)
+
+    info = {}
+    if reader.metadata is not None:
+        info = {k.lstrip('/'): str(v) for k, v in reader.metadata.items() if v is not None}
+
+    xmp = None
+    root_metadata = reader.trailer['/Root'].get('/Metadata')
+    if root_metadata is not None:
+        xmp = root_metadata.get_object().get_data()
+
+    pages = reader.pages if max_pages is None else reader.pages[:max_pages]
+    return PdfContent(info, xmp, [p.extract_text() or '' for p in pages])
+
+
+# ---- Byte-level fallback ---------------------------------------------------------------
+
+_OBJ_REGEX = re.compile(rb'(\d+)\s+(\d+)\s+obj\b')
+_STREAM_REGEX = re.compile(rb'stream\r?\n')
+_INFO_REF_REGEX = re.compile(rb'/Info\s+(\d+)\s+(\d+)\s+R')
+_XMP_REGEX = re.compile(rb'<x:xmpmeta.*?</x:xmpmeta>', re.S)
+_INFO_ENTRY_REGEX = re.compile(rb'/([A-Za-z]+)\s*(\((?:\\.|[^\\)])*\)|<[0-9A-Fa-f\s]*>)', re.S)
+# Strings and arrays shown by the text operators Tj, TJ, ' and "
+_TEXT_OP_REGEX = re.compile(
+    rb'(\((?:\\.|[^\\)])*\)|<[0-9A-Fa-f\s]*>)\s*(?:Tj|\'|")'
+    rb'|\[((?:\\.|[^\]\\])*)\]\s*TJ'
+    rb'|(T\*|Td|TD|ET)',
+    re.S
+)
+_ARRAY_STRING_REGEX = re.compile(rb'\((?:\\.|[^\\)])*\)|<[0-9A-Fa-f\s]*>|(-?\d+(?:\.\d+)?)')
+
+_ESCAPES = {b'n': b'\n', b'r': b'\r', b't': b'\t', b'b': b'\b', b'f': b'\f'}
+
+
+def _unescape_literal(raw: bytes) -> bytes:
+    out = bytearray()
+    i = 0
+    while i < len(raw):
+        c = raw[i:i + 1]
+        if c != b'\\':
+            out += c
+            i += 1
+            continue
+        nxt = raw[i + 1:i + 2]
+        if nxt in _ESCAPES:
+            out += _ESCAPES[nxt]
+            i += 2
+        elif nxt.isdigit():
+            octal = re.match(rb'[0-7]{1,3}', raw[i + 1:i + 4]).group(0)
+            out.append(int(octal, 8) & 0xFF)
+            i += 1 + len(octal)
+        elif nxt in (b'\r', b'\n'):
+            # Line continuation
+            i += 2
+        else:
+            out += nxt
+            i += 2
+    return bytes(out)
+
+
+def decode_pdf_string(token: bytes) -> str:
+    """Decodes a pdf literal `(...)` or hex `<...>` string token"""
+    if token.startswith(b'<'):
+        hexdigits = re.sub(rb'\s', b'', token[1:-1])
+        if len(hexdigits) % 2:
+            hexdigits += b'0'
+        raw = bytes.fromhex(hexdigits.decode('ascii'))
+    else:
+        raw = _unescape_literal(token[1:-1])
+
+    if raw.startswith(b'\xfe\xff'):
+        return raw[2:].decode('utf-16-be', errors='replace')
+    # PDFDocEncoding agrees with latin-1 for everything that matters here
+    return raw.decode('latin-1')
+
+
+def _object_bodies(data: memoryview) -> 'dict[int, memoryview]':
+    # Slices of the view, each is only copied when it is parsed
+    bodies = {}
+    matches = list(_OBJ_REGEX.finditer(data))
+    for m, nxt in zip(matches, matches[1:] + [None]):
+        end = nxt.start() if nxt is not None else len(data)
+        bodies[int(m.group(1))] = data[m.end():end]
+    return bodies
+
+
+def _stream_data(body: bytes) -> Optional[bytes]:
+    m = _STREAM_REGEX.search(body)
+    if m is None:
+        return None
+    end = body.rfind(b'endstream')
+    raw = body[m.end():end if end != -1 else len(body)]
+    if b'/FlateDecode' in body[:m.start()]:
+        try:
+            return zlib.decompressobj().decompress(raw)
+        except zlib.error:
+            return None
+    return raw
+
+
+def _text_from_content(content: bytes) -> str:
+    parts = []
+    for m in _TEXT_OP_REGEX.finditer(content):
+        shown, array, op = m.groups()
+        if shown is not None:
+            parts.append(decode_pdf_string(shown))
+        elif array is not None:
+            for s in _ARRAY_STRING_REGEX.finditer(array):
+                if s.group(1) is not None:
+                    # Large negative kerning is how most generators draw a space
+                    if float(s.group(1)) < -200:
+                        parts.append(' ')
+                else:
+                    parts.append(decode_pdf_string(s.group(0)))
+        elif op is not None:
+            parts.append('\n')
+    return re.sub(r'\n{2,}', '\n', ''.join(parts))
+
+
+def _read_raw(data: memoryview, max_pages: int) -> PdfContent:
+    bodies = _object_bodies(data)
+
+    info = {}
+    refs = _INFO_REF_REGEX.findall(data)
+    if refs:
+        body = bytes(bodies.get(int(refs[-1][0]), b''))
+        for key, token in _INFO_ENTRY_REGEX.findall(body.split(b'endobj')[0]):
+            info[key.decode('ascii')] = decode_pdf_string(token)
+
+    xmp = None
+    pages = []
+    for num in sorted(bodies):
+        stream = _stream_data(bytes(bodies[num]))
+        if stream is None:
+            continue
+        if xmp is None:
+            m = _XMP_REGEX.search(stream)
+            if m is not None:
+                xmp = m.group(0)
+                continue
+        # Without the page tree, every stream with text operators is taken as a page in object order
+        if b'BT' in stream and (max_pages is None or len(pages) < max_pages):
+            text = _text_from_content(stream)
+            if text.strip():
+                pages.append(text)
+
+    return PdfContent(info, xmp, pages)
@@ -0,0 +1,177 @@
+import functools
+import json
+import os
+import random
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from time import perf_counter, time
+from typing import Callable, Iterator
+
+# Quantiles reported for every span
+QUANTILES = (0.5, 0.95, 0.99)
+
+# Durations kept per span for the quantiles, counts and sums are always exact
+MAX_SAMPLES = 10000
+
+
+class _SpanStats:
+
+    __slots__ = ('count', 'errors', 'total', 'max', 'samples')
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = []
+
+
+class Recorder:
+    """Collects span durations and summarises them per span name
+
+    Every span keeps an exact count, error count, sum and maximum. Quantiles come from a
+    uniform reservoir sample of at most `max_samples` durations, so memory stays bounded on
+    long runs. Safe to use from several threads.
+
+    Args:
+        * max_samples (int, optional) : Durations kept per span. Defaults to `MAX_SAMPLES`.
+    """
+
+    _stats : 'dict[str, _SpanStats]' = None
+
+    _lock : threading.Lock = None
+
+    def __init__(self, max_samples: int = MAX_SAMPLES) -> None:
+        self.max_samples = max_samples
+        self.enabled = True
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._rng = random.Random()
+
+    def record(self, name: str, seconds: float, error: bool = False) -> None:
+        """Adds one duration to the span `name`"""
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                stats = self._stats[name] = _SpanStats()
+            stats.count += 1
+            stats.errors += error
+            stats.total += seconds
+            if seconds > stats.max:
+                stats.max = seconds
+            if len(stats.samples) < self.max_samples:
+                stats.samples.append(seconds)
+            else:
+                # Reservoir sampling keeps every duration equally likely to be in the sample
+                i = self._rng.randrange(stats.count)
+                if i < self.max_samples:
+                    stats.samples[i] = seconds
+
+    def summary(self) -> 'dict[str, dict]':
+        """Count, errors, total, mean, max and quantiles in seconds for every span, by name"""
+        with self._lock:
+            snapshot = {name: (s.count, s.errors, s.total, s.max, sorted(s.samples)) for name, s in self._stats.items()}
+
+        summary = {}
+        for name, (count, errors, total, longest, samples) in sorted(snapshot.items()):
+            summary[name] = {
+                'count': count,
+                'errors': errors,
+                'total_s': total,
+                'mean_s': total / count,
+                'max_s': longest,
+                **{f'p{round(q * 100)}_s': _quantile(samples, q) for q in QUANTILES},
+            }
+        return summary
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats = {}
+
+    def write_jsonl(self, path: Path, **labels) -> None:
+        """Appends one JSON line per span to `path`, tagged with the time, process ID and `labels`"""
+        now = time()
+        with Path(path).open(mode='a', encoding='utf-8') as f:
+            for name, stats in self.summary().items():
+                f.write(json.dumps({'time': now, 'pid': os.getpid(), **labels, 'span': name, **stats}) + '\n')
+
+    def write_prometheus(self, path: Path, metric: str = 'information_retrieval_span_seconds') -> None:
+        """Writes the spans as a Prometheus summary in the text exposition format
+
+        The file is replaced atomically, so it can be picked up by node_exporter's textfile collector.
+        """
+        lines = [
+            f'# HELP {metric} Duration of instrumented pipeline spans',
+            f'# TYPE {metric} summary',
+        ]
+        errors = []
+        for name, stats in self.summary().items():
+            label = name.replace('\\', '\\\\').replace('"', '\\"')
+            for q in QUANTILES:
+                lines.append(f'{metric}{{span="{label}",quantile="{q}"}} {stats[f"p{round(q * 100)}_s"]:.9g}')
+            lines.append(f'{metric}_sum{{span="{label}"}} {stats["total_s"]:.9g}')
+            lines.append(f'{metric}_count{{span="{label}"}} {stats["count"]}')
+            errors.append(f'{metric[:-len("_seconds")]}_errors_total{{span="{label}"}} {stats["errors"]}')
+
+        if errors:
+            lines.append(f'# TYPE {metric[:-len("_seconds")]}_errors_total counter')
+            lines.extend(errors)
+
+        path = Path(path)
+        tmp = path.with_name(path.name + '.tmp')
+        tmp.write_text('\n'.join(lines) + '\n', encoding='utf-8')
+        os.replace(tmp, path)
+
+    def print_summary(self) -> None:
+        """Prints one aligned line per span, in milliseconds"""
+        for name, s in self.summary().items():
+            print(f'{name:<36} n={s["count"]:<6} err={s["errors"]:<4} '
+                  f'p50 {s["p50_s"] * 1e3:>9.1f}ms  p95 {s["p95_s"] * 1e3:>9.1f}ms  '
+                  f'p99 {s["p99_s"] * 1e3:>9.1f}ms  total {s["total_s"]:>8.1f}s')
+
+
+def _quantile(samples: 'list[float]', q: float) -> float:
+    # Nearest rank on sorted samples
+    if not samples:
+        return 0.0
+    return samples[min(len(samples) - 1, max(0, round(q * len(samples) + 0.5) - 1))]
+
+
+# Process-wide recorder used unless another is passed in
+RECORDER = Recorder()
+
+
+@contextmanager
+def span(name: str, recorder: Recorder = None) -> Iterator[None]:
+    """Times the enclosed block as one occurrence of the span `name`
+
+    An exception leaving the block is counted as an error of the span and re-raised.
+    """
+    recorder = recorder or RECORDER
+    if not recorder.enabled:
+        yield
+        return
+
+    start = perf_counter()
+    failed = False
+    try:
+        yield
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        recorder.record(name, perf_counter() - start, failed)
+
+
+def timed(name: str = None, recorder: Recorder = None) -> Callable:
+    """Decorator timing every call of a function as the span `name`, defaulting to its qualified name"""
+    def decorate(fn: Callable) -> Callable:
+        span_name = name or f'{fn.__module__}.{fn.__qualname__}'
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(span_name, recorder):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
@@ -1,66 +1,48 @@
-import random
-import re
+"""Harvests JSTOR articles for the aaronskit API
+
+Each stage runs on its own against the job store, so the offline stages can be run and
+scaled separately from the browser. Only `harvest` starts a browser:
+
+    python main.py harvest --journal Econometrica --no-upload
+    python main.py check
+    python main.py upload --workers 8
+    python main.py store validate --quarantine
+    python main.py reindex --out reindex.jsonl
+    python main.py catalogue report --missing
+    python main.py bench search_parser -- --copies 20
+    python main.py report
+
+Endpoints and paths come from `config.json`, or the file given with `--config`, and so
+does the API transport: `"transport": "stub"` runs every stage against a local stub. Stage
+timings are written with `--metrics timings.jsonl` and `--prometheus timings.prom`.
+"""
+import argparse
 import json
+import re
+import sys
+from functools import lru_cache
 from pathlib import Path
-from typing import Callable
-from random import choice
-import requests
-
-from selenium import webdriver
-from webdriver_manager.chrome import ChromeDriverManager
-from bs4 import BeautifulSoup
 
-from scraper.scraper import JstorScraper
-from connection_controllers.uct_connection_controller import UctConnectionController
+from pipeline.config import load_config
 
 
 USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/92.0.4515.159 Safari/537.36'
 
-API_DOI_ENDPOINT = "https://api-aaronskit.org/api/articles/doi?checkdoi="
-API_PAPER_ENDPOINT = "https://api-aaronskit.org/api/upload-paper-droplet"
-API_META_ENDPOINT="https://api-aaronskit.org/api/upload-metadata"
-API_CLOUD_ENDPOINT="https://api-aaronskit.org/api/upload-pdf?paperDOI="
-
-DEFAULT_TIMEOUT = 20
-
-# Checks by article DOI if it's in the database
-def check_doi(article_meta_data):
-    api_link=API_DOI_ENDPOINT+article_meta_data
-    r = requests.get(url = api_link)
-    response= r.json()
-    return(response)
-
-def post_pdf_server(pdfname):
-    files = {
-    'file': (pdfname, open(pdfname, 'rb')),
-    }
-    response = requests.post(API_PAPER_ENDPOINT, files=files)
-    if response.ok:
-        print("Upload of pdf completed successfully!")
-        print(response.text)
-    else:
-        print("Something went wrong with pdf server upload!")
-        
-def post_meta_server(jsonname):
-    files = {
-    'file': (jsonname, open(jsonname, 'rb')),
-    }
-    response = requests.post(API_META_ENDPOINT, files=files)
-    if response.ok:
-        print("Upload of meta completed successfully!")
-        print(response.text)
-    else:
-        print("Something went wrong with meta server upload!")
-        
-def upload_to_cloud(pdfname): 
-    print("hi")
+# journal.json and the docs lists, merged once and cached between runs
+@lru_cache(maxsize=None)
+def journal_catalogue():
+    from pipeline.journal_catalogue import JournalCatalogue
+    return JournalCatalogue()
+
+# Trigram index over the catalogue, maps journal names as written anywhere to one catalogue entry
+@lru_cache(maxsize=None)
+def journal_resolver():
+    from pipeline.journal_resolver import JournalResolver
+    return JournalResolver(journal_catalogue())
 
-# Fetches a random journal from the masterlist
+# Fetches a random journal from the catalogue
 def random_jounal():
-    with open("journal.json") as f:
-        content = json.loads(f.read())
-        journal = choice(content["masterlist"])
-    return journal["Journal Name "]
+    return journal_catalogue().random_name()
 
 # Converts a request's cookie string into a dictionary that we can use with requests.
 def parse_cookies(cookiestring: str) -> dict:
@@ -70,130 +52,566 @@ def parse_cookies(cookiestring: str) -> dict:
 
     cookies = {}
     kv_regex = re.compile(r'(?P<key>[^;=]+)=(?P<val>[^;]*);')
-    
+
     for c in kv_regex.finditer(cookiestring):
         cookies[c.group('key')] = c.group('val')
 
     return cookies
 
 # --------------------------------------------------
-# Code that runs test: 
-chrome_options = webdriver.ChromeOptions()
-# ------ #
-# uncomment the below if you dont want the google chrome browser UI to show up.
-
-#chrome_options.add_argument('--headless')
-
-curdir = Path.cwd().joinpath("BrowserProfile")
-
-chrome_options.add_argument(f'user-agent={USER_AGENT}')
-chrome_options.add_argument('--disable-blink-features=AutomationControlled')
-# chrome_options.add_argument(f'--user-data-dir="{curdir}"')
-chrome_options.add_extension('./extension_1_38_6_0.crx')
-chrome_options.add_experimental_option("excludeSwitches", ["enable-automation"])
-chrome_options.add_experimental_option("useAutomationExtension", False)
-
-driver = webdriver.Chrome(ChromeDriverManager().install(), options = chrome_options)
-
-driver.execute_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
-
-with open(r'uctpw.json', 'r') as logon_file:
-
-    logon_deets = json.load(logon_file)
-
-web_session = UctConnectionController(driver, 
-                                      'https://www.jstor.org',
-                                      logon_deets['user'],
-                                      logon_deets['pass'])
-
-
-
-
-the_scraper = JstorScraper(web_session)
-
-#Random Journal Option
-#articles = the_scraper.get_search_results(journal_name= random_jounal())
-
-#Input Journal Option
-articles = the_scraper.get_search_results(journal_name= 'Econometrica')
-
-# Option 1:scrapes based on doi check 
-doilist=list()
-for article in articles:
-     doilist.append(article.docid)
-     response=check_doi(article.doi)
-     print("API response was : %s" % response)
-     if(response==[]):
-        name=article.doi.replace("/", "_", 1)
-        filename="%s.pdf" % name
-        pdf = the_scraper.get_payload_data(article.doi) 
-        files = {
-            'file': (filename, pdf._pdf_blob),
-            }
-        response=requests.post(API_PAPER_ENDPOINT, files = files)
-        if response.ok:
-            print("Upload of pdf completed successfully!")
-            print(response.text)
-        else:
-            print("Something went wrong with pdf server upload!")
-            
-        jsonname="%s.json" % name
-        db=pdf.metadata_json
-        author=db['authors'][0]
-        initial=author[0]
-        #middlename=author.split(" ", 1)[1].rsplit(" ", 1)[0]
-        #surname=author.split(" ", 1)[1].rsplit(" ", 1)[1]
-
-        names = re.match(r'^\W*((?P<surname>\w+), ?)?((?P<firstname>\w+).? )((?P<namei>\w+).? )*(?P<surname2>\w+)\W*$', author)
-
-        if names == None:
-            initial = "Unknown"
-            surname = "Unknown"
-        else:
-            if names['surname'] != None:
-                surname = names['surname']
-            else:
-                surname = names['surname2']
-            initial = names['namei'][0]
-
-        #if (middlename>surname):
-        #    surname=middlename
-            
-        jsondata={
-            "JournalName": db['journal'],
-            "AuthorInitial": initial,
-            "AuthorSurname": surname,
-            "Title": db['displayTitle'].lower(),
-            "YearPublished": db['year'],
-            "CategoryID": "100",
-            "DOI": db['doi']
-            }
-        encode_data = json.dumps(jsondata, indent=2).encode('utf-8')
-        files = {
-         'file': (jsonname, encode_data),
-         }
-           
-        response_meta=requests.post(API_META_ENDPOINT, files = files)
-        if response_meta.ok:
-            print("Upload of meta completed successfully!")
-            print(response_meta.text)
-        else:
-            print("Something went wrong with meta server upload!")
-        api_upload=API_CLOUD_ENDPOINT+name    
-        r = requests.get(url = api_upload)
-        print("The status code for final DOI was %s" % r.status_code)
-        response=check_doi(article.doi)
-        print("The results for storing that final DOI was %s" % response)
-     
-    
-'''
-# Option 2: Just scrapes but no uploading and saving not finalized     
-pdfs=the_scraper.get_multi_payload_data(document_ids=doilist)
-i=0
-for pdf in pdfs:
-    OUT_FILE=r'F:\woo' 
-    i=i+1
-    name = OUT_FILE+str(i)
-    filename = "%s.pdf" % name
-    pdf.save_pdf(Path(filename))
-    '''
+# Shared set-up, each stage imports only what it needs
+
+def open_job_store(config):
+    from pipeline.job_store import JobStore
+    # Every article's progress is checkpointed, so a restarted run resumes where it stopped
+    return JobStore(config.job_store)
+
+def open_session(config, pool_maxsize=10):
+    from api.transport import make_session
+    # live, record, replay or stub, with optional latency and error injection
+    return make_session(config.transport,
+                        config.cassette,
+                        latency_s=config.transport_latency_s,
+                        error_rate=config.transport_error_rate,
+                        pool_maxsize=pool_maxsize)
+
+def open_doi_index(config):
+    from api.doi_index import DoiIndex
+    # Local dedup index in front of the checkdoi endpoint, answers a whole search batch at once
+    return DoiIndex(config.doi_index, session=open_session(config))
+
+def open_pdf_store(config):
+    from storage.content_store import ContentStore
+    # Finished pdfs are kept once per content hash, indexed by DOI
+    archive = open_archive(config) if Path(config.archive_dir).exists() else None
+    return ContentStore(config.store_dir, archive=archive)
+
+def open_archive(config):
+    from storage.pack_archive import PackArchive
+    # Uploaded pdfs moved out of the store into a few large pack files
+    return PackArchive(config.archive_dir)
+
+def open_near_duplicates(config):
+    from indexing.near_duplicates import NearDuplicateIndex
+    # Same paper under another DOI, reprints, or a new cover page on a stored pdf
+    return NearDuplicateIndex(config.near_duplicates)
+
+def open_catalogue(config):
+    from storage.metadata_catalogue import MetadataCatalogue
+    # Parquet copy of the uploaded metadata, partitioned by catalogue journal
+    return MetadataCatalogue(config.catalogue_dir, resolver=journal_resolver())
+
+def open_upload_stage(config, job_store, doi_index, pdf_store, workers=None, screen=True):
+    from pipeline.upload_stage import UploadStage
+
+    workers = workers or config.upload_workers
+    try:
+        catalogue = open_catalogue(config)
+    except ImportError as e:
+        print("Not cataloguing uploads: %s" % e)
+        catalogue = None
+    return UploadStage(job_store,
+                       doi_index,
+                       pdf_store,
+                       config.quarantine_dir,
+                       config.paper_endpoint,
+                       config.meta_endpoint,
+                       config.cloud_endpoint,
+                       metadata_log=config.metadata_log,
+                       workers=workers,
+                       session=open_session(config, pool_maxsize=2 * workers + 1),
+                       near_duplicates=open_near_duplicates(config) if screen else None,
+                       catalogue=catalogue)
+
+def open_scraper(config, headless=False):
+    from connection_controllers.chrome_driver import create_chrome_driver
+    from connection_controllers.uct_connection_controller import UctConnectionController
+    from scraper.scraper import JstorScraper
+
+    driver = create_chrome_driver(USER_AGENT, extension=config.extension, headless=headless)
+
+    with open(config.credentials, 'r') as logon_file:
+
+        logon_deets = json.load(logon_file)
+
+    web_session = UctConnectionController(driver,
+                                          'https://www.jstor.org',
+                                          logon_deets['user'],
+                                          logon_deets['pass'])
+
+    # Downloaded pdfs are streamed straight to disk and moved into the store from there
+    return JstorScraper(web_session,
+                        mean_request_delay_s=config.request_delay_s,
+                        spool_dir=config.spool_dir)
+
+def print_counts(job_store):
+    print("Job states: %s" % {state.name: n for state, n in job_store.counts().items()})
+
+def print_exhausted(config, job_store, journal=None):
+    from pipeline.job_store import JobState
+
+    exhausted = [job for job in job_store.jobs(JobState.CHECKED, journal=journal)
+                 if job.attempts >= config.max_download_attempts]
+    for job in exhausted:
+        print("%s not downloaded after %d attempts: %s" % (job.doi, job.attempts, job.error))
+    if exhausted:
+        print("%d articles are no longer tried, see max_download_attempts" % len(exhausted))
+
+def choose_journal(name, job_store):
+    if name == 'random':
+        return random_jounal()
+    if name == 'next':
+        # Earlier runs count under whatever spelling they were started with
+        return journal_catalogue().next_to_harvest(job_store, journal_resolver()).name
+    if journal_resolver().resolve(name) is None:
+        print("%r is not in the journal catalogue" % name)
+    return name
+
+# --------------------------------------------------
+# Stages
+
+def check_discovered(config, job_store, doi_index, journal=None):
+    """Asks the API which discovered articles are stored already, the rest are marked for download"""
+    from pipeline.job_store import JobState
+
+    discovered = job_store.jobs(JobState.DISCOVERED, journal=journal)
+    stored_dois, failed = doi_index.lookup_batch([job.doi for job in discovered], config.doi_endpoint)
+    print("%d of %d articles already stored" % (len(stored_dois), len(discovered)))
+    if failed:
+        print("%d lookups failed, those articles are checked again on the next run" % len(failed))
+    job_store.advance_many(stored_dois, JobState.CONFIRMED)
+    job_store.advance_many([job.doi for job in discovered if job.doi not in stored_dois and job.doi not in failed],
+                           JobState.CHECKED)
+
+def download_checked(config, the_scraper, job_store, pdf_store, journal, limit=None, stage=None):
+    """Downloads checked articles into the pdf store, queueing each on `stage` if one is given"""
+    from api.metadata_batcher import api_metadata, encode_metadata
+    from pipeline.job_store import JobState
+    from pipeline.upload_stage import reject_download
+    from pipeline.validation import validate_pdf
+    from scraper.scraper import PayloadFailure
+
+    # Articles that keep failing don't take the places of the others on every run
+    to_download = job_store.jobs(JobState.CHECKED, journal=journal, max_attempts=config.max_download_attempts)[:limit]
+    print_exhausted(config, job_store, journal)
+    # Each article is saved and queued for upload as soon as it is downloaded, in the order asked for
+    for job, pdf in zip(to_download, the_scraper.iter_multi_payload_data(job.doi for job in to_download)):
+        if isinstance(pdf, PayloadFailure):
+            # One failed article shouldn't stop the rest of the batch
+            print("Could not obtain %s: %s" % (job.doi, pdf.error))
+            job_store.record_failure(job.doi, pdf.error)
+            continue
+
+        encode_data = encode_metadata(api_metadata(pdf.metadata_json))
+
+        # Metadata taken from the pdf may have no journal at all
+        found_in = journal_resolver().resolve(pdf.metadata_json.get('journal'))
+        searched = journal_resolver().resolve(job.journal)
+        if found_in is not None and searched is not None and found_in.journal_id != searched.journal_id:
+            print("%s is from %r, not %r" % (job.doi, found_in.name, searched.name))
+
+        # Moved from the spool into the store without copying, uploads read it from there
+        pdf_path = pdf.save_to_store(pdf_store)
+
+        # Truncated downloads and error pages served as pdfs never reach the uploader
+        result = validate_pdf(pdf_path)
+        if not result.ok:
+            reject_download(job_store, pdf_store, config.quarantine_dir, job, result)
+            continue
+
+        job_store.advance(job.doi, JobState.DOWNLOADED, pdf_path=pdf_path, metadata=encode_data)
+        job.state, job.pdf_path, job.metadata = JobState.DOWNLOADED, pdf_path, encode_data
+        if stage is not None:
+            stage.queue(job)
+
+# --------------------------------------------------
+# Subcommands
+
+def harvest(args, config):
+    job_store = open_job_store(config)
+    doi_index = open_doi_index(config)
+    pdf_store = open_pdf_store(config)
+    journal_name = choose_journal(args.journal, job_store)
+
+    the_scraper = open_scraper(config, headless=args.headless)
+
+    # The search is only parsed once per journal, later runs work from the job store
+    if args.research or not job_store.has_searched(journal_name):
+        articles = the_scraper.get_search_results(journal_name= journal_name)
+        # DOIs the local index already knows are stored never become jobs
+        new_articles = articles - doi_index.known(articles.dois)
+        print("%d of %d articles not yet stored" % (len(new_articles), len(articles)))
+        print("%d new articles discovered" % job_store.record_search(journal_name, new_articles))
+
+    if args.search_only:
+        print_counts(job_store)
+        return
+
+    check_discovered(config, job_store, doi_index, journal_name)
+
+    # Without uploads the articles wait in the job store for the upload stage
+    stage = None if args.no_upload else open_upload_stage(config, job_store, doi_index, pdf_store)
+    if stage is not None:
+        # Uploads that were interrupted go first, as long as their pdf is still on disk and valid
+        stage.resume()
+
+    download_checked(config, the_scraper, job_store, pdf_store, journal_name, args.limit, stage)
+
+    if stage is not None:
+        stage.close()
+    print_counts(job_store)
+
+def check(args, config):
+    job_store = open_job_store(config)
+    doi_index = open_doi_index(config)
+    if args.refresh:
+        if config.doi_list_endpoint is None:
+            raise SystemExit("check --refresh needs doi_list_endpoint in the config, a URL listing every stored article")
+        # Seeds the index in bulk from the API's listing of stored articles
+        print("%d stored DOIs known" % doi_index.refresh_from_api(config.doi_list_endpoint))
+    check_discovered(config, job_store, doi_index, args.journal)
+    print_counts(job_store)
+
+def upload(args, config):
+    if args.asynchronous:
+        return upload_async(args, config)
+
+    job_store = open_job_store(config)
+    with open_upload_stage(config, job_store, open_doi_index(config), open_pdf_store(config), args.workers,
+                           screen=not args.no_dedup) as stage:
+        print("%d downloaded articles queued for upload" % stage.resume())
+    print_counts(job_store)
+
+def upload_async(args, config):
+    from dataclasses import replace
+
+    # The async client has its own connections, so of the transports only the stub carries over
+    if config.transport == 'stub':
+        from api.transport import local_stub, stub_url
+        local_stub()[1].latency_s = config.transport_latency_s
+        config = replace(config,
+                         paper_endpoint=stub_url(config.paper_endpoint),
+                         meta_endpoint=stub_url(config.meta_endpoint),
+                         cloud_endpoint=stub_url(config.cloud_endpoint))
+    elif config.transport != 'live' or config.transport_error_rate:
+        raise SystemExit("upload --async only supports the live and stub transports, without injected errors")
+
+    job_store = open_job_store(config)
+    with open_upload_stage(config, job_store, open_doi_index(config), open_pdf_store(config),
+                           screen=not args.no_dedup) as stage:
+        try:
+            print("%d downloaded articles uploaded" % stage.resume_async(args.in_flight))
+        except ImportError as e:
+            raise SystemExit(str(e))
+    print_counts(job_store)
+
+def store(args, config):
+    pdf_store = open_pdf_store(config)
+
+    if args.action == 'ingest':
+        # Staged pdfs are named after their DOI with the first "/" replaced by "_"
+        spooled = sorted(Path(config.spool_dir).glob('*.pdf'))
+        for f in spooled:
+            pdf_store.put_file(f.stem.replace('_', '/', 1), f, move=True)
+        print("%d spooled pdfs moved into the store" % len(spooled))
+
+    elif args.action == 'validate':
+        from pipeline.validation import validate_store
+
+        report, rejected = validate_store(pdf_store,
+                                          config.quarantine_dir if args.quarantine else None,
+                                          workers=args.workers)
+        for result in rejected:
+            print("%s: %s" % (result.path, result.error))
+        print(report)
+
+        if Path(config.archive_dir).exists():
+            corrupt = open_archive(config).verify()
+            for sha256 in corrupt:
+                print("archived %s is corrupt" % sha256)
+            print("%d corrupt archived pdfs" % len(corrupt))
+
+    elif args.action == 'stats':
+        items = list(pdf_store.items())
+        hashes = {sha256: size for _, sha256, size in items}
+        print("%d DOIs, %d distinct pdfs, %.1f MB stored" % (len(items), len(hashes), sum(hashes.values()) / 1e6))
+        if Path(config.archive_dir).exists():
+            stats = open_archive(config).stats()
+            print("%(packs)d packs, %(disk_bytes)d bytes on disk for %(pdf_bytes)d bytes of archived pdfs" % stats)
+
+    elif args.action == 'pack':
+        from pipeline.job_store import JobState
+        from storage.pack_archive import archive_store
+
+        # Pending uploads still read their pdf by path, so by default only uploaded ones are archived
+        if args.all and args.prune:
+            raise SystemExit("store pack --all cannot prune, pending uploads read their pdfs from the store")
+        dois = None if args.all else {job.doi for job in open_job_store(config).jobs(JobState.CONFIRMED)}
+        counts = archive_store(pdf_store, open_archive(config), dois, prune=args.prune)
+        print("%(archived)d pdfs archived, %(skipped)d already archived, %(missing)d missing, "
+              "%(pruned)d loose pdfs pruned" % counts)
+
+    elif args.action == 'compact':
+        print("%d packs compacted" % open_archive(config).compact())
+
+    elif args.action == 'export':
+        export_archived(args, config)
+
+def export_archived(args, config):
+    from functools import partial
+
+    from api.uploader import Uploader, UploadJob
+
+    archive = open_archive(config)
+    job_store = open_job_store(config)
+    # Straight from the pack files, no pdf is written back to disk
+    uploader = Uploader(config.paper_endpoint,
+                        config.meta_endpoint,
+                        config.cloud_endpoint,
+                        workers=args.workers or config.upload_workers,
+                        session=open_session(config),
+                        on_complete=lambda job: print("Export of %s completed successfully!" % job.doi),
+                        on_error=lambda job, error: print("Export of %s failed: %s" % (job.doi, error)))
+    exported = 0
+    for doi in args.dois or [doi for doi, _, _ in archive.items()]:
+        job = job_store.get(doi)
+        if job is None or not job.metadata or doi not in archive:
+            print("%s has no archived pdf and metadata to export" % doi)
+            continue
+        uploader.submit(UploadJob(job.name, doi, None, job.metadata, open_pdf=partial(archive.open, doi)))
+        exported += 1
+    uploader.close()
+    print("%d archived articles exported" % exported)
+
+def reindex(args, config):
+    from indexing.pdf_metadata import reindex_store
+
+    counts = reindex_store(open_pdf_store(config), args.out, workers=args.workers)
+    print("%(indexed)d pdfs indexed, %(failed)d failed in %(seconds).2fs" % counts, "->", args.out)
+
+def index(args, config):
+    from indexing.fulltext import FullTextIndex, index_store
+
+    full_text = FullTextIndex(config.index_dir)
+    if args.action == 'build':
+        counts = index_store(open_pdf_store(config), full_text, workers=args.workers)
+        print("%(indexed)d pdfs indexed, %(failed)d failed in %(seconds).2fs" % counts)
+        print("%d documents in %d segments" % (len(full_text), full_text.segment_count))
+    elif args.action == 'merge':
+        full_text.merge()
+    else:
+        if not args.query:
+            raise SystemExit("index search needs a query")
+        for hit in full_text.search(' '.join(args.query), args.k):
+            print("%8.3f  %s" % (hit.score, hit.doi))
+
+def dedup(args, config):
+    near_duplicates = open_near_duplicates(config)
+
+    if args.action == 'build':
+        from indexing.near_duplicates import index_store
+        from pipeline.job_store import JobState
+
+        # Titles come from the metadata recorded with each download
+        titles = {job.doi: json.loads(job.metadata).get('Title', '')
+                  for job in open_job_store(config).jobs(*JobState) if job.metadata}
+        counts = index_store(open_pdf_store(config), near_duplicates, titles, workers=args.workers)
+        print("%(indexed)d pdfs signed, %(without_text)d without text, %(failed)d failed in %(seconds).2fs" % counts)
+        print("%d articles in the index" % len(near_duplicates))
+
+    elif args.action == 'list':
+        for doi, match in near_duplicates.flagged().items():
+            print("%s  %s %3.0f%% similar to %s" % (doi, match.kind, 100 * match.similarity, match.doi))
+
+    else:
+        for doi in args.dois:
+            if not near_duplicates.allow(doi):
+                print("%s was not flagged" % doi)
+
+def catalogue(args, config):
+    try:
+        metadata = open_catalogue(config)
+    except ImportError as e:
+        raise SystemExit(str(e))
+
+    if args.action == 'import':
+        from storage.metadata_catalogue import read_metadata_log
+
+        if config.metadata_log is None or not Path(config.metadata_log).exists():
+            raise SystemExit("No metadata log to import, see metadata_log in the config")
+        from pipeline.job_store import JobState
+
+        # The log has every accepted metadata post, also of articles whose pdf never made it
+        # and of batches sent again, so only the latest record of each confirmed DOI is taken
+        confirmed = {job.doi for job in open_job_store(config).jobs(JobState.CONFIRMED)}
+        records = {record['DOI']: record for record in read_metadata_log(config.metadata_log)
+                   if record.get('DOI') in confirmed}
+        catalogued = metadata.dois()
+        with metadata:
+            metadata.add_many(record for doi, record in records.items() if doi not in catalogued)
+        print("%d records imported, %d in the catalogue" % (len(records.keys() - catalogued), len(metadata)))
+
+    elif args.action == 'compact':
+        print("%d journals compacted" % metadata.compact())
+
+    elif args.missing:
+        for journal, years in sorted(metadata.missing_years(args.journal).items()):
+            if years:
+                print("%s: %s" % (journal, ", ".join(map(str, years))))
+
+    else:
+        counts = metadata.papers_per_journal_year(args.journal).to_pandas()
+        print(counts.to_string(index=False))
+
+def bench(args, config):
+    import runpy
+
+    available = sorted(p.stem[len('bench_'):] for p in Path(__file__).resolve().parent.joinpath('benchmarks').glob('bench_*.py'))
+    if not args.names:
+        print("Benchmarks: %s" % ", ".join(available))
+        return
+
+    for name in args.names:
+        if name not in available:
+            raise SystemExit("Unknown benchmark %r, choose from %s" % (name, ", ".join(available)))
+        print("== %s" % name)
+        sys.argv = ['benchmarks.bench_' + name] + args.passthrough
+        runpy.run_module('benchmarks.bench_' + name, run_name='__main__', alter_sys=True)
+
+def parse(args, config):
+    from scraper.page_parser import parse_search_page
+
+    frame = parse_search_page(Path(args.page).read_text(encoding='utf-8'), backend=args.backend)
+    if args.resolve_journals:
+        resolved = journal_resolver().resolve_many(frame['Journal'].fillna(''))
+        frame['Journal ID'] = [r.journal_id if r is not None else None for r in resolved]
+    if args.out is None:
+        print(frame.to_string())
+    else:
+        frame.to_csv(args.out, index=False)
+        print("%d results written to %s" % (len(frame), args.out))
+
+def report(args, config):
+    job_store = open_job_store(config)
+    print_counts(job_store)
+    print_exhausted(config, job_store)
+    for journal, at in sorted(job_store.last_harvested().items(), key=lambda item: item[1]):
+        print("%s last harvested at %s" % (journal, at))
+
+def write_timings(args):
+    from instrumentation.timing import RECORDER
+
+    if args.metrics is not None:
+        RECORDER.write_jsonl(args.metrics, command=args.command)
+    if args.prometheus is not None:
+        RECORDER.write_prometheus(args.prometheus)
+    if args.timings:
+        RECORDER.print_summary()
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--config', type=Path, default=None, help='JSON config file, defaults to config.json if present')
+    parser.add_argument('--metrics', type=Path, default=None, help='Append per-stage timings (p50/p95/p99) to this JSONL file')
+    parser.add_argument('--prometheus', type=Path, default=None, help='Write per-stage timings to this Prometheus text file')
+    parser.add_argument('--timings', action='store_true', help='Print per-stage timings when the command finishes')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    p = commands.add_parser('harvest', help='Search a journal in the browser and download its articles')
+    p.add_argument('--journal', default='Econometrica',
+                   help="Journal to search, 'random' for a weighted random one or 'next' for the least recently harvested")
+    p.add_argument('--limit', type=int, default=None, help='Download at most this many articles')
+    p.add_argument('--search-only', action='store_true', help='Only record the search results as jobs')
+    p.add_argument('--research', action='store_true', help='Search again even if the journal was searched before')
+    p.add_argument('--no-upload', action='store_true', help="Only download, leave uploads to the upload stage")
+    p.add_argument('--headless', action='store_true', help="Don't show the browser UI")
+    p.set_defaults(func=harvest)
+
+    p = commands.add_parser('check', help='Look up discovered articles in the API, marking the rest for download')
+    p.add_argument('--journal', default=None, help='Only check articles found under this journal')
+    p.add_argument('--refresh', action='store_true', help='Reload the local DOI index from doi_list_endpoint first')
+    p.set_defaults(func=check)
+
+    p = commands.add_parser('upload', help='Upload every downloaded article that is not confirmed yet')
+    p.add_argument('--workers', type=int, default=None)
+    p.add_argument('--async', dest='asynchronous', action='store_true', help='Drain the backlog with the httpx async uploader')
+    p.add_argument('--in-flight', type=int, default=32, help='--async: articles uploaded concurrently')
+    p.add_argument('--no-dedup', action='store_true', help="Don't hold back near-duplicates of stored articles")
+    p.set_defaults(func=upload)
+
+    p = commands.add_parser('store', help='Maintain the local pdf store')
+    p.add_argument('action', choices=['ingest', 'validate', 'stats', 'pack', 'compact', 'export'],
+                   help='ingest spooled pdfs, validate every stored pdf, show totals, archive uploaded pdfs '
+                        'into pack files, compact the packs, or upload archived pdfs again')
+    p.add_argument('dois', nargs='*', help='export: DOIs to upload, defaults to every archived pdf')
+    p.add_argument('--quarantine', action='store_true', help='validate: move invalid pdfs out of the store')
+    p.add_argument('--prune', action='store_true', help='pack: delete the loose pdfs once archived')
+    p.add_argument('--all', action='store_true', help='pack: every stored pdf, not only the uploaded ones')
+    p.add_argument('--workers', type=int, default=None)
+    p.set_defaults(func=store)
+
+    p = commands.add_parser('reindex', help='Extract metadata from every stored pdf')
+    p.add_argument('--out', type=Path, default=Path('reindex.jsonl'))
+    p.add_argument('--workers', type=int, default=None)
+    p.set_defaults(func=reindex)
+
+    p = commands.add_parser('index', help='Full-text index of the stored pdfs')
+    p.add_argument('action', choices=['build', 'search', 'merge'],
+                   help='index newly stored pdfs, search the index, or merge it into one segment')
+    p.add_argument('query', nargs='*', help='search: query terms')
+    p.add_argument('-k', type=int, default=10, help='search: number of results')
+    p.add_argument('--workers', type=int, default=None)
+    p.set_defaults(func=index)
+
+    p = commands.add_parser('dedup', help='Near-duplicate detection over the stored articles')
+    p.add_argument('action', choices=['build', 'list', 'allow'],
+                   help='sign stored pdfs not in the index yet, list flagged articles, or let flagged ones be uploaded')
+    p.add_argument('dois', nargs='*', help='allow: DOIs to upload after all')
+    p.add_argument('--workers', type=int, default=None)
+    p.set_defaults(func=dedup)
+
+    p = commands.add_parser('catalogue', help='Parquet catalogue of the uploaded metadata')
+    p.add_argument('action', choices=['import', 'report', 'compact'],
+                   help='add the records of the metadata log, count papers per journal and year, or merge small files')
+    p.add_argument('--journal', default=None, help='report: only this journal')
+    p.add_argument('--missing', action='store_true', help='report: years without papers between the first and last year')
+    p.set_defaults(func=catalogue)
+
+    p = commands.add_parser('bench', help='Run benchmarks, lists them without a name')
+    p.add_argument('names', nargs='*', help='Benchmarks to run, arguments after -- are passed on to them')
+    p.set_defaults(func=bench)
+
+    p = commands.add_parser('parse', help='Parse a saved search results page')
+    p.add_argument('page', help='Saved search results html')
+    p.add_argument('--backend', default=None, help='Search page parsing backend')
+    p.add_argument('--out', default=None, help='CSV file to write, prints the results otherwise')
+    p.add_argument('--resolve-journals', action='store_true', help='Add the catalogue ID of each journal')
+    p.set_defaults(func=parse)
+
+    p = commands.add_parser('report', help='Show job states and when each journal was last harvested')
+    p.set_defaults(func=report)
+
+    return parser
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    # Everything after -- is passed through untouched, e.g. to a benchmark
+    passthrough = []
+    if '--' in argv:
+        argv, passthrough = argv[:argv.index('--')], argv[argv.index('--') + 1:]
+
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    args.passthrough = passthrough
+
+    try:
+        config = load_config(args.config)
+    except (OSError, ValueError) as e:
+        parser.error("could not load config: %s" % e)
+
+    try:
+        args.func(args, config)
+    finally:
+        write_timings(args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+import json
+from dataclasses import dataclass, field, fields, replace
+from pathlib import Path
+
+DEFAULT_CONFIG_PATH = Path('config.json')
+
+# Fields holding filesystem paths, relative values are resolved against the config file
+_PATH_FIELDS = ('spool_dir', 'store_dir', 'quarantine_dir', 'job_store', 'doi_index',
+                'metadata_log', 'credentials', 'extension', 'cassette', 'index_dir',
+                'near_duplicates', 'catalogue_dir', 'archive_dir')
+
+
+@dataclass(frozen=True)
+class Config:
+    """Endpoints and paths shared by every CLI stage
+
+    Attributes:
+        * doi_endpoint (str) : URL prefix checking whether a DOI is stored, the DOI is appended
+        * paper_endpoint (str) : URL the pdfs are posted to
+        * meta_endpoint (str) : URL the metadata batches are posted to
+        * cloud_endpoint (str) : URL prefix for the cloud upload confirmation, the file stem is appended
+        * doi_list_endpoint (str) : URL listing every stored article, for `check --refresh`. The API
+            is not known to have one, so there is none by default.
+        * spool_dir (Path) : Where pdfs are streamed while they download
+        * store_dir (Path) : Content-addressed pdf store
+        * quarantine_dir (Path) : Where pdfs that fail validation are moved
+        * job_store (Path) : Job store database
+        * doi_index (Path) : Local index of stored DOIs
+        * metadata_log (Path) : Append-only log of every metadata record the API accepted
+        * credentials (Path) : JSON file with the institution's `user` and `pass`
+        * extension (Path) : Chrome extension installed in the browser
+        * upload_workers (int) : Articles uploaded concurrently
+        * max_download_attempts (int) : Failed downloads after which an article is no longer tried
+        * request_delay_s (float) : Mean delay between browser requests
+        * transport (str) : How API calls are made, 'live', 'record', 'replay' or 'stub', see api.transport
+        * cassette (Path) : Cassette the 'record' transport writes and the 'replay' transport reads
+        * transport_latency_s (float) : Delay added to every API call
+        * transport_error_rate (float) : Share of API calls failed with an injected 503
+        * index_dir (Path) : Full-text index of the stored pdfs
+        * near_duplicates (Path) : MinHash signatures of stored articles, checked before every upload
+        * catalogue_dir (Path) : Parquet catalogue of the metadata of every confirmed upload
+        * archive_dir (Path) : Pack files that uploaded pdfs are moved into by `store pack`
+    """
+    doi_endpoint: str = 'https://api-aaronskit.org/api/articles/doi?checkdoi='
+    paper_endpoint: str = 'https://api-aaronskit.org/api/upload-paper-droplet'
+    meta_endpoint: str = 'https://api-aaronskit.org/api/upload-metadata'
+    cloud_endpoint: str = 'https://api-aaronskit.org/api/upload-pdf?paperDOI='
+    doi_list_endpoint: str = None
+    spool_dir: Path = field(default=Path('TempStorage'))
+    store_dir: Path = field(default=Path('Storage'))
+    quarantine_dir: Path = field(default=Path('Quarantine'))
+    job_store: Path = field(default=Path('jobs.sqlite3'))
+    doi_index: Path = field(default=Path('doi_index.sqlite3'))
+    metadata_log: Path = field(default=Path('metadata_log.jsonl'))
+    credentials: Path = field(default=Path('uctpw.json'))
+    extension: Path = field(default=Path('extension_1_38_6_0.crx'))
+    upload_workers: int = 4
+    max_download_attempts: int = 3
+    request_delay_s: float = 10
+    transport: str = 'live'
+    cassette: Path = field(default=Path('cassette.jsonl'))
+    transport_latency_s: float = 0
+    transport_error_rate: float = 0
+    index_dir: Path = field(default=Path('Index'))
+    near_duplicates: Path = field(default=Path('near_duplicates.sqlite3'))
+    catalogue_dir: Path = field(default=Path('Catalogue'))
+    archive_dir: Path = field(default=Path('Archive'))
+
+
+def load_config(path: Path = None) -> Config:
+    """Reads a JSON config file, any key left out keeps its default
+
+    Relative paths in the file are taken relative to the file itself, so a config can be
+    shared between checkouts. Without a file, or if `config.json` does not exist, the
+    defaults are used relative to the working directory.
+
+    Args:
+        * path (Path, optional) : Config file. Defaults to `config.json` if it exists.
+
+    Raises:
+        FileNotFoundError: If an explicitly given `path` does not exist
+        ValueError: If the file has keys that are not config fields
+    """
+    if path is None:
+        if not DEFAULT_CONFIG_PATH.exists():
+            return Config()
+        path = DEFAULT_CONFIG_PATH
+
+    path = Path(path)
+    with path.open(encoding='utf-8-sig') as f:
+        values = json.load(f)
+
+    known = {f.name for f in fields(Config)}
+    unknown = set(values) - known
+    if unknown:
+        raise ValueError(f'Unknown config keys in {path}: {", ".join(sorted(unknown))}')
+
+    base = path.resolve().parent
+    for name in _PATH_FIELDS:
+        if name in values:
+            values[name] = base.joinpath(values[name])
+
+    return replace(Config(), **values)
@@ -0,0 +1,224 @@
+import sqlite3
+import threading
+from dataclasses import dataclass
+from enum import IntEnum
+from pathlib import Path
+from time import time
+from typing import Iterable
+
+from scraper.search_results import SearchResponse
+
+
+class JobState(IntEnum):
+    """Stages an article passes through, in order. A job only ever moves forward."""
+    DISCOVERED = 0
+    CHECKED = 1
+    DOWNLOADED = 2
+    METADATA_UPLOADED = 3
+    PDF_UPLOADED = 4
+    CONFIRMED = 5
+
+
+@dataclass
+class Job:
+    """A single article tracked by the JobStore
+
+    Attributes:
+        * doi (str) : DOI of the article, identifies the job
+        * url (str) : Download link from the search results
+        * docid (str) : JSTOR document ID
+        * journal (str) : Journal name the article was found under
+        * state (JobState) : Furthest stage the article has completed
+        * pdf_path (Path) : Location of the downloaded pdf, once downloaded
+        * metadata (bytes) : Encoded metadata JSON document, once downloaded
+        * attempts (int) : Number of failures recorded for the job
+        * error (str) : Last recorded failure
+    """
+    doi: str
+    url: str
+    docid: str
+    journal: str
+    state: JobState
+    pdf_path: Path = None
+    metadata: bytes = None
+    attempts: int = 0
+    error: str = None
+
+    @property
+    def name(self) -> str:
+        """File stem used for uploads, the DOI with its first `/` replaced by `_`"""
+        return self.doi.replace('/', '_', 1)
+
+
+_COLUMNS = 'doi, url, docid, journal, state, pdf_path, metadata, attempts, error'
+
+
+class JobStore:
+    """Persistent work queue that checkpoints every article of a harvest run
+
+    Each SearchResponse becomes a job whose state is advanced as the article is checked,
+    downloaded and uploaded. The store is a SQLite database in WAL mode, so every step is
+    durable as soon as it is recorded and a restarted run can pick up each job at the stage
+    where it stopped.
+
+    Args:
+        * path (Path, optional) : Location of the SQLite database. Defaults to `jobs.sqlite3`.
+    """
+
+    _path : Path = None
+
+    _conn : sqlite3.Connection = None
+
+    _lock : threading.Lock = None
+
+    def __init__(self, path: Path = Path('jobs.sqlite3')) -> None:
+        self._path = Path(path)
+        # Upload workers advance jobs from their own threads
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self._path), check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        with self._conn:
+            self._conn.execute('''CREATE TABLE IF NOT EXISTS jobs (
+                                    doi TEXT PRIMARY KEY,
+                                    url TEXT,
+                                    docid TEXT,
+                                    journal TEXT,
+                                    state INTEGER NOT NULL,
+                                    pdf_path TEXT,
+                                    metadata BLOB,
+                                    attempts INTEGER NOT NULL DEFAULT 0,
+                                    error TEXT,
+                                    updated_at REAL NOT NULL
+                                  )''')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state)')
+            self._conn.execute('''CREATE TABLE IF NOT EXISTS searches (
+                                    journal TEXT PRIMARY KEY,
+                                    searched_at REAL NOT NULL
+                                  )''')
+
+    def has_searched(self, journal: str) -> bool:
+        """True if the search results for `journal` have already been recorded"""
+        with self._lock:
+            row = self._conn.execute('SELECT 1 FROM searches WHERE journal = ?', (journal,)).fetchone()
+        return row is not None
+
+    def record_search(self, journal: str, results: 'Iterable[SearchResponse]') -> int:
+        """Records the results of a journal search as discovered jobs
+
+        Jobs that already exist keep their state, so recording a search twice is harmless.
+
+        Returns:
+            int: Number of new jobs
+        """
+        now = time()
+        with self._lock, self._conn:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                'INSERT OR IGNORE INTO jobs (doi, url, docid, journal, state, updated_at) VALUES (?, ?, ?, ?, ?, ?)',
+                ((r.doi, r.url, r.docid, journal, int(JobState.DISCOVERED), now) for r in results)
+            )
+            added = self._conn.total_changes - before
+            self._conn.execute('INSERT OR REPLACE INTO searches (journal, searched_at) VALUES (?, ?)', (journal, now))
+        return added
+
+    def last_harvested(self) -> 'dict[str, float]':
+        """Time each journal was last searched or had one of its jobs updated, by journal name"""
+        with self._lock:
+            rows = self._conn.execute('''SELECT journal, MAX(at) FROM (
+                                            SELECT journal, searched_at AS at FROM searches
+                                            UNION ALL
+                                            SELECT journal, MAX(updated_at) FROM jobs GROUP BY journal
+                                         ) WHERE journal IS NOT NULL GROUP BY journal''').fetchall()
+        return dict(rows)
+
+    def advance(self, doi: str, state: JobState, pdf_path: Path = None, metadata: bytes = None) -> None:
+        """Moves a job forward to `state`, never backwards
+
+        Args:
+            * doi (str) : DOI of the job
+            * state (JobState) : The stage the job has just completed
+            * pdf_path (Path, optional) : Where the pdf was downloaded to
+            * metadata (bytes, optional) : Encoded metadata JSON document
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                '''UPDATE jobs SET state = ?,
+                                   pdf_path = COALESCE(?, pdf_path),
+                                   metadata = COALESCE(?, metadata),
+                                   error = NULL,
+                                   updated_at = ?
+                   WHERE doi = ? AND state < ?''',
+                (int(state), str(pdf_path) if pdf_path is not None else None, metadata, time(), doi, int(state))
+            )
+
+    def advance_many(self, dois: Iterable[str], state: JobState) -> None:
+        """Moves several jobs forward to `state` in one transaction"""
+        now = time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                'UPDATE jobs SET state = ?, error = NULL, updated_at = ? WHERE doi = ? AND state < ?',
+                ((int(state), now, d, int(state)) for d in dois)
+            )
+
+    def reset(self, doi: str, state: JobState) -> None:
+        """Moves a job back to `state`, e.g. when its downloaded pdf has gone missing"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                'UPDATE jobs SET state = ?, updated_at = ? WHERE doi = ? AND state > ?',
+                (int(state), time(), doi, int(state))
+            )
+
+    def record_failure(self, doi: str, error: Exception) -> None:
+        """Notes a failed attempt without changing the job's state"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                'UPDATE jobs SET attempts = attempts + 1, error = ?, updated_at = ? WHERE doi = ?',
+                (f'{type(error).__name__}: {error}', time(), doi)
+            )
+
+    def jobs(self, *states: JobState, journal: str = None, max_attempts: int = None) -> 'list[Job]':
+        """Returns the jobs currently in any of `states`, oldest first
+
+        Args:
+            * states (JobState) : States to select
+            * journal (str, optional) : Only return jobs found under this journal
+            * max_attempts (int, optional) : Skip jobs that have failed at least this often
+        """
+        query = f'SELECT {_COLUMNS} FROM jobs WHERE state IN ({",".join("?" * len(states))})'
+        params = [int(s) for s in states]
+        if journal is not None:
+            query += ' AND journal = ?'
+            params.append(journal)
+        if max_attempts is not None:
+            query += ' AND attempts < ?'
+            params.append(max_attempts)
+        query += ' ORDER BY updated_at'
+
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+
+        return [_job_from_row(r) for r in rows]
+
+    def get(self, doi: str) -> Job:
+        with self._lock:
+            row = self._conn.execute(f'SELECT {_COLUMNS} FROM jobs WHERE doi = ?', (doi,)).fetchone()
+        return _job_from_row(row) if row is not None else None
+
+    def counts(self) -> 'dict[JobState, int]':
+        """Number of jobs in each state"""
+        with self._lock:
+            rows = self._conn.execute('SELECT state, COUNT(*) FROM jobs GROUP BY state').fetchall()
+        counts = {s: 0 for s in JobState}
+        counts.update({JobState(s): n for s, n in rows})
+        return counts
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+def _job_from_row(row: tuple) -> Job:
+    doi, url, docid, journal, state, pdf_path, metadata, attempts, error = row
+    return Job(doi, url, docid, journal, JobState(state),
+               Path(pdf_path) if pdf_path is not None else None,
+               metadata, attempts, error)
@@ -0,0 +1,204 @@
+import json
+import os
+import pickle
+import random
+import re
+from bisect import bisect
+from itertools import accumulate
+from pathlib import Path
+from typing import Iterator, NamedTuple, Optional
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+# Journal lists in the order their spelling of a name is preferred
+DEFAULT_SOURCES = (
+    REPO_ROOT.joinpath('journal.json'),
+    REPO_ROOT.joinpath('docs', 'masterlist.json'),
+    REPO_ROOT.joinpath('docs', 'JSTORlist.json'),
+)
+
+DEFAULT_CACHE = REPO_ROOT.joinpath('.journal_catalogue.pickle')
+
+# Bumped whenever the pickled layout changes, so old caches are rebuilt
+_CACHE_VERSION = 1
+
+_SPACES_REGEX = re.compile(r'\s+')
+
+
+class Journal(NamedTuple):
+    """One entry of the journal catalogue
+
+    Attributes:
+        * name (str) : Journal name as listed, with surrounding and repeated whitespace removed
+        * sources (tuple[str]) : File names of the lists the journal appears in
+    """
+    name: str
+    sources: 'tuple[str, ...]'
+
+    @property
+    def weight(self) -> int:
+        """Journals listed in more places are sampled more often"""
+        return len(self.sources)
+
+
+def normalise_name(name: str) -> str:
+    return _SPACES_REGEX.sub(' ', name).strip()
+
+
+def journal_key(name: str) -> str:
+    """Lookup key of a journal name, insensitive to case and whitespace"""
+    return normalise_name(name).casefold()
+
+
+def _read_list(path: Path) -> 'list[str]':
+    # The docs lists start with a byte order mark
+    with Path(path).open(encoding='utf-8-sig') as f:
+        content = json.load(f)
+    names = []
+    for entry in content['masterlist']:
+        # Keys are spelt "Journal Name " with a trailing space
+        for key, value in entry.items():
+            if key.strip() == 'Journal Name' and value and value.strip():
+                names.append(normalise_name(value))
+    return names
+
+
+class JournalCatalogue:
+    """Every journal in the catalogue files, loaded and merged once
+
+    The lists are merged into one entry per journal, in the order they are first listed.
+    The merged catalogue is pickled next to the sources and reused for as long as none of the
+    source files has changed, so later runs skip the JSON parsing entirely.
+
+    Args:
+        * sources (tuple[Path], optional) : Journal lists to merge. Defaults to `DEFAULT_SOURCES`.
+        * cache_path (Path, optional) : Pickle cache location, None disables caching. Defaults to `DEFAULT_CACHE`.
+    """
+
+    _journals : 'list[Journal]' = None
+
+    _index : 'dict[str, int]' = None
+
+    _cum_weights : 'list[int]' = None
+
+    def __init__(self, sources: 'tuple[Path, ...]' = DEFAULT_SOURCES, cache_path: Optional[Path] = DEFAULT_CACHE) -> None:
+        sources = tuple(Path(p) for p in sources)
+        signature = (_CACHE_VERSION,) + tuple((str(p), *_file_stamp(p)) for p in sources)
+
+        journals = _load_cache(cache_path, signature) if cache_path is not None else None
+        if journals is None:
+            journals = _merge(sources)
+            if cache_path is not None:
+                _save_cache(cache_path, signature, journals)
+
+        self._journals = journals
+        self._index = {journal_key(j.name): i for i, j in enumerate(journals)}
+        self._cum_weights = list(accumulate(j.weight for j in journals))
+
+    def __len__(self) -> int:
+        return len(self._journals)
+
+    def __iter__(self) -> Iterator[Journal]:
+        return iter(self._journals)
+
+    def __contains__(self, name: str) -> bool:
+        return journal_key(name) in self._index
+
+    def __getitem__(self, name: str) -> Journal:
+        """Looks a journal up by name, ignoring case and whitespace
+
+        Raises:
+            KeyError: If the journal is not in the catalogue
+        """
+        return self._journals[self._index[journal_key(name)]]
+
+    def get(self, name: str, default: Journal = None) -> Journal:
+        i = self._index.get(journal_key(name))
+        return self._journals[i] if i is not None else default
+
+    @property
+    def names(self) -> 'list[str]':
+        return [j.name for j in self._journals]
+
+    def sample(self, k: int = 1, rng: random.Random = None) -> 'list[Journal]':
+        """Draws `k` journals with replacement, weighted by the number of lists each appears in"""
+        rng = rng or random
+        total = self._cum_weights[-1]
+        return [self._journals[bisect(self._cum_weights, rng.random() * total)] for _ in range(k)]
+
+    def random_name(self, rng: random.Random = None) -> str:
+        """Name of one weighted random journal"""
+        return self.sample(1, rng)[0].name
+
+    def least_recently_harvested(self, job_store, resolver=None) -> 'list[Journal]':
+        """Journals ordered for harvesting, never harvested ones first, then the longest ago
+
+        Ties keep catalogue order, so the lists' priorities are respected.
+
+        Args:
+            * job_store (JobStore) : Store whose searches and job updates say when each journal was last worked on
+            * resolver (JournalResolver, optional) : Matches harvested names to catalogue journals, so
+                e.g. "Econometrica" counts for "Econometrica, Econometric Society". Defaults to exact
+                matches, ignoring case and whitespace.
+        """
+        def key(name):
+            resolved = resolver.resolve(name) if resolver is not None else None
+            return resolved.name if resolved is not None else journal_key(name)
+
+        harvested = {}
+        for name, at in job_store.last_harvested().items():
+            k = key(name)
+            harvested[k] = max(at, harvested.get(k, at))
+
+        return sorted(self._journals, key=lambda j: harvested.get(key(j.name), float('-inf')))
+
+    def next_to_harvest(self, job_store, resolver=None) -> Journal:
+        """The least recently harvested journal, see `least_recently_harvested`"""
+        return self.least_recently_harvested(job_store, resolver)[0]
+
+
+def _file_stamp(path: Path) -> 'tuple[int, int]':
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return (-1, -1)
+    return (st.st_mtime_ns, st.st_size)
+
+
+def _merge(sources: 'tuple[Path, ...]') -> 'list[Journal]':
+    order = {}
+    found_in = {}
+    for path in sources:
+        if not path.exists():
+            continue
+        for name in _read_list(path):
+            key = journal_key(name)
+            order.setdefault(key, name)
+            found_in.setdefault(key, [])
+            if path.name not in found_in[key]:
+                found_in[key].append(path.name)
+    return [Journal(name, tuple(found_in[key])) for key, name in order.items()]
+
+
+def _load_cache(path: Path, signature: tuple) -> 'Optional[list[Journal]]':
+    try:
+        with Path(path).open(mode='rb') as f:
+            cached_signature, rows = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+        return None
+    if cached_signature != signature:
+        return None
+    # Stored as plain tuples, so the cache does not depend on where Journal is defined
+    return [Journal(name, tuple(sources)) for name, sources in rows]
+
+
+def _save_cache(path: Path, signature: tuple, journals: 'list[Journal]') -> None:
+    path = Path(path)
+    tmp = path.with_name(path.name + '.tmp')
+    try:
+        with tmp.open(mode='wb') as f:
+            pickle.dump((signature, [tuple(j) for j in journals]), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+    except OSError:
+        # A read-only checkout just goes without the cache
+        tmp.unlink(missing_ok=True)
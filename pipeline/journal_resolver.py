@@ -0,0 +1,176 @@
+import re
+import unicodedata
+from math import log
+from typing import Iterable, NamedTuple, Optional
+
+import numpy as np
+
+from pipeline.journal_catalogue import Journal, JournalCatalogue
+
+# Catalogue names are often "Title, Publisher". When the part after the first comma has one of
+# these words, the title on its own is indexed too, so "Econometrica" finds "Econometrica,
+# Econometric Society" but "Journal of Speech" doesn't find "Journal of Speech, Language, ..."
+_PUBLISHER_WORDS = frozenset('''
+    association associates corporation elsevier institute institution journals ltd macmillan press
+    publishing reviews sage society springer sons university wiley
+'''.split())
+
+_PARENTHESES_REGEX = re.compile(r'\([^)]*\)|\[[^\]]*\]')
+_NON_WORD_REGEX = re.compile(r'[\W_]+')
+
+# Resolved names kept per resolver, result sets repeat the same few journals
+_CACHE_SIZE = 10000
+
+
+class Resolution(NamedTuple):
+    """A journal string matched to the catalogue
+
+    Attributes:
+        * journal_id (str) : Canonical ID of the journal, see `journal_id`
+        * name (str) : Catalogue name of the journal
+        * score (float) : 1 for an exact match, otherwise the IDF-weighted Dice similarity of the trigrams
+    """
+    journal_id: str
+    name: str
+    score: float
+
+
+def match_key(name: Optional[str]) -> str:
+    """`name` reduced to lowercase ASCII words, without accents, parentheses, punctuation or a leading "the"
+
+    "The Canadian Journal of Statistics / La Revue Canadienne de Statistique" is keyed by its first title only.
+    """
+    name = (name or '').split(' / ')[0]
+    if not name.isascii():
+        name = ''.join(c for c in unicodedata.normalize('NFKD', name) if not unicodedata.combining(c))
+    name = name.casefold().replace('&', ' and ')
+    words = _NON_WORD_REGEX.sub(' ', _PARENTHESES_REGEX.sub(' ', name)).split()
+    if words[:1] == ['the']:
+        words = words[1:]
+    return ' '.join(words)
+
+
+def journal_id(name: str) -> str:
+    """Canonical ID of a catalogue journal, e.g. `econometrica-econometric-society`"""
+    return match_key(name).replace(' ', '-')
+
+
+def _aliases(name: str) -> 'list[str]':
+    keys = [match_key(name)]
+    title, comma, publisher = name.partition(', ')
+    if comma and _PUBLISHER_WORDS.intersection(match_key(publisher).split()):
+        keys.append(match_key(title))
+    return [k for k in keys if k]
+
+
+def _trigrams(key: str) -> 'set[str]':
+    padded = f' {key} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class JournalResolver:
+    """Maps journal names from metadata or user input to catalogue journals
+
+    Every catalogue name, and its title alone where the name ends in a publisher, is indexed
+    by its `match_key` for exact lookups and by the key's trigrams for fuzzy ones. A fuzzy
+    lookup sums the IDF weights of the trigrams shared with every indexed name in one pass
+    over the query's posting lists and picks the best weighted Dice similarity. Full names
+    take precedence over titles, and earlier catalogue entries over later ones.
+
+    Args:
+        * catalogue (JournalCatalogue, optional) : Journals to resolve to. Defaults to the merged catalogue files.
+        * min_score (float, optional) : Lowest trigram similarity accepted as a match. Defaults to 0.7.
+    """
+
+    _journals : 'list[Journal]' = None
+
+    _exact : 'dict[str, int]' = None
+
+    _postings : 'dict[str, tuple[np.ndarray, np.ndarray]]' = None
+
+    def __init__(self, catalogue: JournalCatalogue = None, min_score: float = 0.7) -> None:
+        self._journals = list(catalogue if catalogue is not None else JournalCatalogue())
+        self._min_score = min_score
+
+        # Full names first, so a title alias never shadows a journal listed under that exact name
+        keys, owners = [], []
+        for full_names in (True, False):
+            for i, journal in enumerate(self._journals):
+                aliases = _aliases(journal.name)
+                for key in aliases[:1] if full_names else aliases[1:]:
+                    keys.append(key)
+                    owners.append(i)
+
+        self._exact = {}
+        for key, owner in zip(keys, owners):
+            self._exact.setdefault(key, owner)
+
+        postings = {}
+        for n, key in enumerate(keys):
+            for trigram in _trigrams(key):
+                postings.setdefault(trigram, []).append(n)
+        # Trigrams of "journal of" and the like say little, rare ones a lot
+        self._weights = {t: log(1 + len(keys) / len(ids)) for t, ids in postings.items()}
+        self._unseen_weight = log(1 + len(keys))
+        # Each posting carries its trigram's weight, so a lookup is one weighted bincount
+        self._postings = {t: (np.array(ids, dtype=np.int32), np.full(len(ids), self._weights[t])) for t, ids in postings.items()}
+        self._owners = np.array(owners, dtype=np.int32)
+        self._sizes = np.array([sum(self._weights[t] for t in _trigrams(k)) for k in keys], dtype=np.float64)
+        self._cache = {}
+
+    def __len__(self) -> int:
+        return len(self._journals)
+
+    def resolve(self, name: Optional[str]) -> Optional[Resolution]:
+        """The catalogue journal `name` refers to
+
+        Returns:
+            Resolution: The match, or None if `name` is empty or no journal is at least `min_score` similar
+        """
+        if not name:
+            return None
+        resolution = self._cache.get(name, self)
+        if resolution is self:
+            if len(self._cache) >= _CACHE_SIZE:
+                self._cache.clear()
+            resolution = self._cache[name] = self._resolve(name)
+        return resolution
+
+    def resolve_many(self, names: Iterable[str]) -> 'list[Optional[Resolution]]':
+        """Resolves a whole result set, looking each distinct name up once, see `resolve`"""
+        names = list(names)
+        resolved = {name: self.resolve(name) for name in set(names)}
+        return [resolved[name] for name in names]
+
+    def same_journal(self, a: str, b: str) -> bool:
+        """True if both names resolve to the same catalogue journal"""
+        ra, rb = self.resolve(a), self.resolve(b)
+        return ra is not None and rb is not None and ra.journal_id == rb.journal_id
+
+    def _resolve(self, name: str) -> Optional[Resolution]:
+        key = match_key(name)
+        if not key:
+            return None
+
+        exact = self._exact.get(key)
+        if exact is not None:
+            return self._resolution(exact, 1.0)
+
+        trigrams = _trigrams(key)
+        known = [t for t in trigrams if t in self._postings]
+        if not known:
+            return None
+        ids = np.concatenate([self._postings[t][0] for t in known])
+        weights = np.concatenate([self._postings[t][1] for t in known])
+        shared = np.bincount(ids, weights=weights, minlength=len(self._sizes))
+        query_size = sum(self._weights[t] for t in known) + self._unseen_weight * (len(trigrams) - len(known))
+        scores = 2 * shared / (query_size + self._sizes)
+        # argmax takes the first of equal scores, which is the preferred alias
+        best = int(np.argmax(scores))
+        if scores[best] < self._min_score:
+            return None
+        return self._resolution(int(self._owners[best]), float(scores[best]))
+
+    def _resolution(self, i: int, score: float) -> Resolution:
+        journal = self._journals[i]
+        return Resolution(journal_id(journal.name), journal.name, score)
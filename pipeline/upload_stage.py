@@ -0,0 +1,274 @@
+import json
+import threading
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional
+
+import numpy as np
+import requests
+
+from api.doi_index import DoiIndex
+from api.metadata_batcher import MetadataBatcher
+from api.uploader import Uploader, UploadJob
+from indexing.near_duplicates import NearDuplicateError, NearDuplicateIndex, pdf_text_signature, pdf_text_signatures, title_signature
+from pipeline.job_store import Job, JobStore, JobState
+from pipeline.validation import InvalidPdfError, ValidationResult, quarantine_stored, validate_paths
+from storage.content_store import ContentStore
+
+if TYPE_CHECKING:
+    # Needs pyarrow, which only the catalogue requires
+    from storage.metadata_catalogue import MetadataCatalogue
+
+UPLOAD_STAGE_STATES = {
+    'metadata': JobState.METADATA_UPLOADED,
+    'pdf': JobState.PDF_UPLOADED,
+    'cloud': JobState.CONFIRMED,
+}
+
+
+def reject_download(job_store: JobStore, pdf_store: ContentStore, quarantine_dir: Path, job: Job, result: ValidationResult) -> None:
+    """Quarantines a downloaded pdf that failed validation and sends its job back to be downloaded again"""
+    print("Rejected pdf for %s: %s" % (job.doi, result.error))
+    if result.sha256 is not None:
+        quarantine_stored(pdf_store, result.sha256, quarantine_dir, result.error)
+    job_store.record_failure(job.doi, InvalidPdfError(result.error))
+    job_store.reset(job.doi, JobState.CHECKED)
+
+
+class UploadStage:
+    """Takes downloaded jobs from the job store to confirmed uploads
+
+    Metadata goes up in JSONL batches through a MetadataBatcher, and each article's pdf is
+    handed to the Uploader once its batch is accepted. Every completed step advances the
+    job in the job store, so an interrupted stage resumes where it stopped.
+
+    Args:
+        * job_store (JobStore) : Jobs to upload and where their progress is recorded
+        * doi_index (DoiIndex) : Local index of stored DOIs, confirmed uploads are added to it
+        * pdf_store (ContentStore) : Where the downloaded pdfs are kept
+        * quarantine_dir (Path) : Where pdfs that fail validation are moved
+        * paper_endpoint (str) : URL the pdf is posted to
+        * meta_endpoint (str) : URL the metadata batches are posted to
+        * cloud_endpoint (str) : URL prefix for the cloud upload confirmation
+        * metadata_log (Path, optional) : Append-only log of every metadata record the API accepted. Defaults to no log.
+        * workers (int, optional) : Articles uploaded concurrently. Defaults to 4.
+        * session (requests.Session, optional) : Session every upload goes through, e.g. from
+            `transport.make_session`. Defaults to new sessions.
+        * near_duplicates (NearDuplicateIndex, optional) : Signatures of stored articles. Articles
+            that are near-duplicates of one, or of one queued before them, are flagged there and not
+            uploaded. An article's signatures are added once its upload is confirmed. Defaults to no screening.
+        * catalogue (MetadataCatalogue, optional) : Local catalogue the metadata of every confirmed
+            upload is added to. Defaults to none.
+    """
+
+    def __init__(self,
+                 job_store: JobStore,
+                 doi_index: DoiIndex,
+                 pdf_store: ContentStore,
+                 quarantine_dir: Path,
+                 paper_endpoint: str,
+                 meta_endpoint: str,
+                 cloud_endpoint: str,
+                 metadata_log: Path = None,
+                 workers: int = 4,
+                 session: requests.Session = None,
+                 near_duplicates: NearDuplicateIndex = None,
+                 catalogue: 'MetadataCatalogue' = None) -> None:
+
+        self._job_store = job_store
+        self._doi_index = doi_index
+        self._pdf_store = pdf_store
+        self._quarantine_dir = quarantine_dir
+        self._endpoints = (paper_endpoint, meta_endpoint, cloud_endpoint)
+        self._near_duplicates = near_duplicates
+        self._catalogue = catalogue
+
+        # Signatures of screened articles whose upload is not confirmed yet, by DOI
+        self._pending_signatures = {}
+        self._pending_lock = threading.Lock()
+
+        self._uploader = Uploader(paper_endpoint,
+                                  meta_endpoint,
+                                  cloud_endpoint,
+                                  workers=workers,
+                                  on_complete=self._upload_completed,
+                                  on_error=self._upload_failed,
+                                  on_progress=self._upload_progress,
+                                  session=session)
+
+        self._batcher = MetadataBatcher(meta_endpoint,
+                                        log_path=metadata_log,
+                                        session=session,
+                                        on_flush=self._metadata_flushed,
+                                        on_error=self._metadata_failed)
+
+    def queue(self, job: Job) -> None:
+        """Uploads whatever stages of `job` are not done yet, unless it is a near-duplicate"""
+        if self._screen([job]):
+            self._queue(job)
+
+    def _queue(self, job: Job) -> None:
+        if job.state < JobState.METADATA_UPLOADED:
+            self._batcher.add(job.doi, job.metadata)
+        else:
+            self._submit(job)
+
+    def reject(self, job: Job, result: ValidationResult) -> None:
+        """Quarantines an invalid pdf and sends its job back to be downloaded again"""
+        reject_download(self._job_store, self._pdf_store, self._quarantine_dir, job, result)
+
+    def resume(self) -> int:
+        """Queues every downloaded job that is not confirmed yet, after validating its pdf in a process pool
+
+        Jobs whose pdf has gone missing go back to be downloaded again, and near-duplicates
+        are left out.
+
+        Returns:
+            int: Number of jobs queued
+        """
+        backlog = self._validated_backlog()
+        for job in backlog:
+            self._queue(job)
+        return len(backlog)
+
+    def resume_async(self, max_in_flight: int = 32, transport=None) -> int:
+        """Uploads the whole backlog `resume` would queue with an AsyncUploader, and waits for it
+
+        Each article's metadata is posted on its own, just before its pdf, rather than batched.
+
+        Args:
+            * max_in_flight (int, optional) : Articles uploaded concurrently. Defaults to 32.
+            * transport (httpx.AsyncBaseTransport, optional) : Transport for the uploader's clients
+
+        Returns:
+            int: Number of jobs uploaded, whether or not they succeeded
+
+        Raises:
+            ImportError: If httpx is not installed
+        """
+        from api.async_uploader import AsyncUploader
+
+        uploader = AsyncUploader(*self._endpoints,
+                                 max_in_flight=max_in_flight,
+                                 on_complete=self._upload_completed,
+                                 on_error=self._upload_failed,
+                                 on_progress=self._upload_progress,
+                                 transport=transport)
+
+        backlog = self._validated_backlog()
+        uploader.run(self._upload_job(job) for job in backlog)
+        return len(backlog)
+
+    def _validated_backlog(self) -> 'list[Job]':
+        resumable = []
+        for job in self._job_store.jobs(JobState.DOWNLOADED, JobState.METADATA_UPLOADED, JobState.PDF_UPLOADED):
+            if job.pdf_path is not None and job.pdf_path.exists():
+                resumable.append(job)
+            else:
+                self._job_store.reset(job.doi, JobState.CHECKED)
+
+        backlog = []
+        for job, result in zip(resumable, validate_paths(job.pdf_path for job in resumable)):
+            if result.ok:
+                backlog.append(job)
+            else:
+                self.reject(job, result)
+        return self._screen(backlog)
+
+    def _screen(self, jobs: 'list[Job]') -> 'list[Job]':
+        """The jobs that are not near-duplicates of a stored article, recording the signatures of each"""
+        if self._near_duplicates is None:
+            return jobs
+
+        # Once any part of an article is uploaded it goes through regardless
+        unchecked = [job for job in jobs if job.state == JobState.DOWNLOADED]
+        flagged = self._near_duplicates.flagged()
+        allowed = self._near_duplicates.allowed()
+        to_sign = [job for job in unchecked if job.doi not in flagged]
+        signatures = pdf_text_signatures(job.pdf_path for job in to_sign)
+
+        rejected = {job.doi for job in unchecked if job.doi in flagged}
+        for job, text in zip(to_sign, signatures):
+            title = _title_signature(job.metadata)
+            with self._pending_lock:
+                pending = dict(self._pending_signatures)
+            matches = [] if job.doi in allowed else self._near_duplicates.check(job.doi, text, title, pending)
+            if matches:
+                self._near_duplicates.flag(job.doi, matches[0])
+                error = NearDuplicateError(f'{matches[0].kind} is {matches[0].similarity:.0%} similar to {matches[0].doi}')
+                print("Not uploading %s: %s" % (job.doi, error))
+                self._job_store.record_failure(job.doi, error)
+                rejected.add(job.doi)
+            else:
+                # Later articles, also in this batch, are compared with this one until it is stored or fails
+                with self._pending_lock:
+                    self._pending_signatures[job.doi] = (text, title)
+        return [job for job in jobs if job.doi not in rejected]
+
+    def close(self) -> None:
+        """Waits for every queued upload to finish"""
+        # The last batch has to be accepted before the uploader can finish its pdfs
+        self._batcher.close()
+        self._uploader.close()
+        if self._catalogue is not None:
+            self._catalogue.flush()
+
+    def __enter__(self) -> 'UploadStage':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _upload_job(self, job: Job) -> UploadJob:
+        completed = {stage for stage, state in UPLOAD_STAGE_STATES.items() if job.state >= state}
+        return UploadJob(job.name, job.doi, job.pdf_path, job.metadata, completed)
+
+    def _submit(self, job: Job) -> None:
+        self._uploader.submit(self._upload_job(job))
+
+    def _metadata_flushed(self, dois: 'list[str]') -> None:
+        self._job_store.advance_many(dois, JobState.METADATA_UPLOADED)
+        for doi in dois:
+            self._submit(self._job_store.get(doi))
+
+    def _metadata_failed(self, dois: 'list[str]', error: Exception) -> None:
+        print("Metadata batch of %d articles failed: %s" % (len(dois), error))
+        for doi in dois:
+            self._job_store.record_failure(doi, error)
+            self._drop_pending(doi)
+
+    def _upload_progress(self, job: UploadJob, stage: str) -> None:
+        self._job_store.advance(job.doi, UPLOAD_STAGE_STATES[stage])
+
+    def _upload_completed(self, job: UploadJob) -> None:
+        print("Upload of %s completed successfully!" % job.doi)
+        self._doi_index.add(job.doi)
+        if self._catalogue is not None:
+            self._catalogue.add(json.loads(job.metadata))
+        if self._near_duplicates is not None:
+            signatures = self._forget_signatures(job.doi)
+            if signatures is None:
+                # Partly uploaded before this run, so it was not screened here
+                try:
+                    text = pdf_text_signature(job.pdf_path)
+                except Exception:
+                    text = None
+                signatures = (text, _title_signature(job.metadata))
+            self._near_duplicates.add(job.doi, *signatures)
+
+    def _upload_failed(self, job: UploadJob, error: Exception) -> None:
+        print("Upload of %s failed: %s" % (job.doi, error))
+        self._job_store.record_failure(job.doi, error)
+        self._drop_pending(job.doi)
+
+    def _drop_pending(self, doi: str) -> None:
+        # Articles held back as copies of this one are screened again on the next resume
+        if self._forget_signatures(doi) is not None:
+            self._near_duplicates.unflag_duplicates_of(doi)
+
+    def _forget_signatures(self, doi: str) -> 'Optional[tuple[np.ndarray, np.ndarray]]':
+        with self._pending_lock:
+            return self._pending_signatures.pop(doi, None)
+
+
+def _title_signature(metadata: str) -> 'Optional[np.ndarray]':
+    return title_signature(json.loads(metadata).get('Title', '')) if metadata else None
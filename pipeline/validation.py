@@ -0,0 +1,235 @@
+import hashlib
+import json
+import mmap
+import os
+import re
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from time import perf_counter, time
+from typing import Iterable, Iterator, NamedTuple, Optional
+
+# pypdf can count pages stored in compressed object streams, the byte-level check cannot
+try:
+    from pypdf import PdfReader
+except ImportError:
+    PdfReader = None
+
+# The header may be preceded by junk, readers look for it in the first kilobyte
+HEADER_WINDOW = 1024
+# startxref and %%EOF have to be in the last few hundred bytes of a complete file
+TAIL_WINDOW = 2048
+
+_HEADER_REGEX = re.compile(rb'%PDF-(\d\.\d)')
+_HTML_REGEX = re.compile(rb'^\s*(?:<!doctype html|<html|<\?xml|<head)', re.I)
+_STARTXREF_REGEX = re.compile(rb'startxref\s+(\d+)\s+%%EOF')
+_XREF_AT_REGEX = re.compile(rb'\s*(?:xref\b|\d+\s+\d+\s+obj\b)')
+_TRAILER_REGEX = re.compile(rb'trailer\s*<<.*?/Root\s+\d+\s+\d+\s+R', re.S)
+_XREF_STREAM_REGEX = re.compile(rb'/Type\s*/XRef\b')
+_PAGES_COUNT_REGEX = re.compile(rb'/Type\s*/Pages\b[^>]*?/Count\s+(\d+)|/Count\s+(\d+)[^>]*?/Type\s*/Pages\b')
+
+
+class InvalidPdfError(Exception):
+    """A downloaded file is not a complete pdf"""
+    pass
+
+
+class ValidationResult(NamedTuple):
+    """Outcome of validating one pdf
+
+    Attributes:
+        * path (str) : File that was checked
+        * sha256 (str) : Checksum of the file, None if it could not be read
+        * size (int) : Size in bytes
+        * pages (int) : Page count, None if it could not be determined without a full parse
+        * version (str) : Version from the `%PDF-x.y` header
+        * error (str) : Why the file was rejected, None for a valid pdf
+    """
+    path: str
+    sha256: Optional[str]
+    size: int
+    pages: Optional[int]
+    version: Optional[str]
+    error: Optional[str]
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+@dataclass
+class ValidationReport:
+    """Totals and throughput of a validation run"""
+    files: int = 0
+    invalid: int = 0
+    bytes: int = 0
+    seconds: float = 0.0
+
+    @property
+    def files_per_s(self) -> float:
+        return self.files / self.seconds if self.seconds else 0.0
+
+    @property
+    def mb_per_s(self) -> float:
+        return self.bytes / 1e6 / self.seconds if self.seconds else 0.0
+
+    def __str__(self) -> str:
+        return (f'{self.files} pdfs ({self.bytes / 1e6:.1f} MB) checked in {self.seconds:.2f}s, '
+                f'{self.invalid} invalid, {self.files_per_s:.1f} files/s, {self.mb_per_s:.1f} MB/s')
+
+
+def validate_pdf(path: Path) -> ValidationResult:
+    """Checks that a file is a structurally complete pdf and computes its SHA-256
+
+    The file is memory mapped and checked for a `%PDF-` header, a `startxref` offset that
+    points at a cross-reference table or stream, a trailer naming the document catalogue,
+    and a page tree with at least one page. HTML error pages served as pdfs and truncated
+    downloads fail these checks.
+
+    Args:
+        * path (Path) : File to check
+
+    Returns:
+        ValidationResult: The checksum and page count, with `error` set if the file is invalid
+    """
+    path = str(path)
+    try:
+        size = os.path.getsize(path)
+        if size == 0:
+            return ValidationResult(path, hashlib.sha256().hexdigest(), 0, None, None, 'empty file')
+
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            sha256 = hashlib.sha256(m).hexdigest()
+            version, pages, error = _check_structure(m, size)
+    except OSError as e:
+        return ValidationResult(path, None, 0, None, None, f'unreadable: {e}')
+
+    if error is None and pages is None and PdfReader is not None:
+        try:
+            pages = len(PdfReader(path, strict=False).pages)
+        except Exception as e:
+            error = f'unparseable: {e}'
+
+    if error is None and pages == 0:
+        error = 'document has no pages'
+
+    return ValidationResult(path, sha256, size, pages, version, error)
+
+
+def _check_structure(m: mmap.mmap, size: int) -> 'tuple[Optional[str], Optional[int], Optional[str]]':
+    head = m[:HEADER_WINDOW]
+    header = _HEADER_REGEX.search(head)
+    if header is None:
+        if _HTML_REGEX.match(head):
+            return None, None, 'html page instead of a pdf'
+        return None, None, 'no %PDF header'
+    version = header.group(1).decode('ascii')
+
+    tail = m[max(0, size - TAIL_WINDOW):]
+    startxref = _STARTXREF_REGEX.findall(tail)
+    if not startxref:
+        return version, None, 'truncated, no startxref/%%EOF at the end of the file'
+
+    offset = int(startxref[-1]) + header.start()
+    if offset >= size or _XREF_AT_REGEX.match(m, offset) is None:
+        return version, None, 'startxref does not point at a cross-reference section'
+
+    if _TRAILER_REGEX.search(m) is None and _XREF_STREAM_REGEX.search(m) is None:
+        return version, None, 'no trailer naming the document catalogue'
+
+    counts = [int(a or b) for a, b in _PAGES_COUNT_REGEX.findall(m)]
+    # The root of the page tree counts every page, so it has the largest count.
+    # Page trees inside compressed object streams are not visible here.
+    pages = max(counts) if counts else None
+    return version, pages, None
+
+
+def validate_paths(paths: 'Iterable[Path]', workers: int = None, chunksize: int = 4) -> 'Iterator[ValidationResult]':
+    """Validates pdfs in a process pool, yielding results in the order of `paths`
+
+    Workers map the files themselves, only paths and results cross process boundaries.
+
+    Args:
+        * paths (iterable of Path) : Files to check
+        * workers (int, optional) : Worker processes. Defaults to the CPU count.
+        * chunksize (int, optional) : Files handed to a worker at a time. Defaults to 4.
+    """
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        yield from pool.map(validate_pdf, [str(p) for p in paths], chunksize=chunksize)
+
+
+def quarantine(path: Path, quarantine_dir: Path, reason: str) -> Path:
+    """Moves a rejected pdf into `quarantine_dir` with the reason in a `.json` sidecar
+
+    Returns:
+        Path: New location of the file
+    """
+    path = Path(path)
+    quarantine_dir = Path(quarantine_dir)
+    quarantine_dir.mkdir(parents=True, exist_ok=True)
+
+    target = quarantine_dir.joinpath(path.name)
+    shutil.move(str(path), target)
+    target.with_suffix('.json').write_text(json.dumps({
+        'source': str(path),
+        'error': reason,
+        'quarantined_at': time(),
+    }))
+    return target
+
+
+def quarantine_stored(store, sha256: str, quarantine_dir: Path, reason: str) -> 'list[str]':
+    """Quarantines a ContentStore object and drops every DOI that refers to it
+
+    Returns:
+        list[str]: The DOIs that were dropped from the store
+    """
+    path = store.object_path(sha256)
+    if path.exists():
+        quarantine(path, quarantine_dir, reason)
+
+    dois = store.dois_for(sha256)
+    for doi in dois:
+        store.remove(doi)
+    return dois
+
+
+def validate_store(store, quarantine_dir: Path = None, workers: int = None) -> 'tuple[ValidationReport, list[ValidationResult]]':
+    """Validates every pdf in a ContentStore in a process pool
+
+    Objects whose checksum no longer matches their name are reported as corrupted. With a
+    `quarantine_dir`, invalid objects are moved there and every DOI that refers to them is
+    dropped from the store, so they can be downloaded again.
+
+    Args:
+        * store (ContentStore) : Store to check
+        * quarantine_dir (Path, optional) : Where invalid pdfs are moved. Defaults to leaving them in place.
+        * workers (int, optional) : Worker processes. Defaults to the CPU count.
+
+    Returns:
+        tuple: The ValidationReport and the results of the invalid pdfs
+    """
+    # Objects pruned into a PackArchive are checked by its `verify`
+    hashes = sorted({sha256 for _, sha256, _ in store.items() if store.object_path(sha256).exists()})
+
+    report = ValidationReport()
+    rejected = []
+
+    start = perf_counter()
+    for sha256, result in zip(hashes, validate_paths((store.object_path(h) for h in hashes), workers=workers)):
+        if result.ok and result.sha256 != sha256:
+            result = result._replace(error=f'checksum mismatch, content hashes to {result.sha256}')
+
+        report.files += 1
+        report.bytes += result.size
+        if result.ok:
+            continue
+
+        report.invalid += 1
+        rejected.append(result)
+        if quarantine_dir is not None:
+            quarantine_stored(store, sha256, quarantine_dir, result.error)
+    report.seconds = perf_counter() - start
+
+    return report, rejected
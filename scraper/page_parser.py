@@ -1,55 +1,63 @@
-import requests
-from bs4 import BeautifulSoup
 import pandas as pd
 
+from scraper.search_page_parser import SearchRecord, extract_search_records, records_from_soup
 
-#can refactor the below function in future
-
-def parse_search_page(response):
-    article_titles_list = []
-    article_titles = response.select('.link-no-underline')
-    for title in article_titles:
-        article_titles_list.append(title.text)
-        
-    article_author_list = []
-    article_author = response.select('.contrib')
-    for author in article_author:
-        article_author_list.append(author.text)
-    
-    journal = response.select('.metadata') 
-    article_journal_name_list = []
-    article_volume_list = []
-    article_journal_date_list = []
-    article_pages_in_journal_list = []
-    for article in journal:
-        s = article.text
-        #get journal date published
-        target_date = s.split("(")[1].split(")")[0]
-        article_journal_date_list.append(target_date)
-        
-        #get article journal full name
-        target_name = s.split(",")[0]
-        article_journal_name_list.append(target_name)
-        
-        #get article journal volume
-        target_volume = s.split(",")[1].split("(")[0]
-        article_volume_list.append(target_volume)
-        
-        #get article pages in journal
-        target_pages = str(s.split("),")[1:])
-        article_pages_in_journal_list.append(target_pages[2:-2])
-        
-        
-    article_urls = response.select('.pdfLink')
-    article_url_list = []
-    for url in article_urls:
-        s = url['href']
-        target_url = s.split("?")[0]
-        full_url = 'https://www.jstor.org/' + target_url
-        article_url_list.append(full_url)  
-        
-    articles = pd.DataFrame(list(zip(article_titles_list, article_author_list, article_journal_name_list, article_volume_list ,article_journal_date_list , article_pages_in_journal_list ,  article_url_list)), columns=['Title',"Author",'Journal', 'Journal Volume','Journal Date Published','Article Pages', 'URL'])
-    return articles
-
-    
-    
+JSTOR_BASE_URL = 'https://www.jstor.org'
+
+# Search result metadata looks like
+#   Journal of the Royal Statistical Society. Series A (Statistics in Society), Vol. 176, No. 1 (JANUARY 2013), pp. 53-83
+# The journal name can contain commas and brackets itself, so it ends where the Vol./No. part starts.
+_JOURNAL_REGEX = r'^\s*(?P<journal>.+?),\s*(?:Vol\.|No\.)'
+_VOLUME_REGEX = r'Vol\.\s*(?P<volume>[^,(]+?)\s*(?:,|\(|$)'
+_DATE_REGEX = r'\((?P<date>[^()]*)\)\s*(?:,\s*pp?\.[^()]*)?$'
+_PAGES_REGEX = r',\s*pp?\.\s*(?P<pages>[^()]+?)\s*$'
+
+COLUMNS = ['Title', 'Author', 'Journal', 'Journal Volume', 'Journal Date Published', 'Article Pages', 'URL']
+
+
+def parse_search_page(response, backend=None) -> pd.DataFrame:
+    """Parses a JSTOR search results page into one row per result
+
+    Each result is extracted as a single record, so a result missing a field gets a missing
+    value in that column rather than shifting the rows after it. The metadata string is split
+    into journal, volume, date and pages with vectorised regexes over the whole page at once.
+
+    Args:
+        * response (str or BeautifulSoup) : Page source, parsed by the fastest installed backend,
+            or an already parsed BeautifulSoup tree
+        * backend (str, optional) : Search page parsing backend, see `search_page_parser.BACKENDS`
+
+    Returns:
+        DataFrame: Columns as in `COLUMNS`, all of pandas' nullable string type
+    """
+    if isinstance(response, str):
+        records = extract_search_records(response, backend)
+    else:
+        records = records_from_soup(response)
+
+    return records_to_frame(records)
+
+
+def records_to_frame(records: 'list[SearchRecord]') -> pd.DataFrame:
+    """Builds the typed search results DataFrame from extracted records"""
+
+    raw = pd.DataFrame.from_records(records, columns=SearchRecord._fields).astype('string')
+
+    metadata = raw['metadata'].str.strip()
+
+    # Names without a Vol./No. part fall back to everything before the first comma
+    journal = metadata.str.extract(_JOURNAL_REGEX, expand=False)
+    journal = journal.fillna(metadata.str.split(',', n=1).str[0].str.strip())
+
+    # Drop the query string and make the pdf path absolute
+    urls = JSTOR_BASE_URL + '/' + raw['pdf_href'].str.replace(r'\?.*$', '', regex=True).str.lstrip('/')
+
+    return pd.DataFrame({
+        'Title': raw['title'].str.strip(),
+        'Author': raw['authors'].str.strip(),
+        'Journal': journal,
+        'Journal Volume': metadata.str.extract(_VOLUME_REGEX, expand=False),
+        'Journal Date Published': metadata.str.extract(_DATE_REGEX, expand=False),
+        'Article Pages': metadata.str.extract(_PAGES_REGEX, expand=False),
+        'URL': urls,
+    }, columns=COLUMNS)
@@ -1,10 +1,14 @@
-from selenium.common.exceptions import TimeoutException
-import re
+from selenium.common.exceptions import JavascriptException, TimeoutException
+import mmap
+import os
+import shutil
 
+from contextlib import contextmanager
 from math import log
 from random import random
 from time import sleep
 from pathlib import Path
+from typing import BinaryIO, Iterable, Iterator, Union
 
 import requests 
 from bs4 import BeautifulSoup
@@ -14,32 +18,37 @@ from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions
 
 from connection_controllers.connection_controller import ConnectionController
+from indexing.pdf_metadata import extract_pdf_metadata
+from instrumentation.timing import span, timed
+from scraper.search_page_parser import extract_from_soup, extract_search_page
+from scraper.search_results import SearchResponse, SearchResultSet
+from storage.content_store import ContentStore
 
 USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/92.0.4515.159 Safari/537.36'     
 
+# Pdfs are streamed to the spool directory in chunks of this many bytes
+SPOOL_CHUNK_SIZE = 64 * 1024
+
 class DownloadException(Exception):
     pass
 
 
-class SearchResponse:
-    doi: str
-    url: str
-    docid: str
+class PayloadFailure:
+    """Stands in for an article that could not be obtained when streaming payloads
 
-    def __init__(self, doi, url):
-        self.doi = doi
-        self.url = url
-        self.docid = re.sub(
-            r'/stable/(?:pdf/)?(?P<id>[a-z0-9]+)\.[a-z0-9]{1,4}(?:\?.+)?', 
-            r'\g<id>',
-            url
-        )
+    Attributes:
+        document_id (str) : The JSTOR document ID that failed
+        error (Exception) : What went wrong
+    """
+    __slots__ = ('document_id', 'error')
 
-    def __str__(self):
-        return f'SearchResponse Object: {{ Article ID: {self.docid}; DOI: {self.doi}; URL: {self.url} }}'
+    def __init__(self, document_id: str, error: Exception) -> None:
+        self.document_id = document_id
+        self.error = error
 
     def __repr__(self):
-        return f"SearchResponse('{self.doi}', '{self.url}')"
+        return f"PayloadFailure('{self.document_id}', {self.error!r})"
+
 
 class JstorArticle:
     """This class encapsulates the metadata and actual article downloaded from JSTOR
@@ -74,6 +83,100 @@ class JstorArticle:
             p.write(self._pdf_blob)
             p.close()
 
+    def save_to_store(self, store: ContentStore) -> Path:
+        """Saves the JstorArticle's pdf data into a content-addressed store under its DOI
+
+        Args:
+            * store (ContentStore): Store to save the pdf to
+
+        Returns:
+            Path: Location of the stored pdf
+        """
+        store.put_bytes(self._pdf_id, self._pdf_blob)
+        return store.path_for(self._pdf_id)
+
+
+class SpooledJstorArticle:
+    """Storage-backed counterpart of JstorArticle whose pdf lives in a spool file instead of memory
+
+    The pdf is streamed to the spool file while it downloads, so only the metadata is held in
+    Python objects. The payload can be read back through a file handle or a memoryview over a
+    memory map, and is moved rather than copied when saved.
+
+    Args:
+        * meta_dict (str) : String representation of JSON object with arbitrary metadata key-value pairs
+        * pdf_path (Path) : Location of the spooled pdf
+        * _pdf_id (int): DOI of paper 
+
+    Attributes: 
+        metadata_json (str) : Direct access to metadata JSON object
+        pdf_path (Path) : Current location of the pdf on disk
+    """
+    __slots__ = ('metadata_json', '_pdf_path', '_pdf_id')
+
+    def __init__(self, meta_json: str, pdf_path: Path, pdf_id: int) -> None:
+        self.metadata_json = meta_json
+        self._pdf_path = Path(pdf_path)
+        self._pdf_id = pdf_id
+
+    @property
+    def pdf_path(self) -> Path:
+        return self._pdf_path
+
+    @property
+    def pdf_size(self) -> int:
+        return self._pdf_path.stat().st_size
+
+    def open_pdf(self) -> BinaryIO:
+        """Opens the spooled pdf for binary reading, the caller closes the handle"""
+        return self._pdf_path.open(mode='rb')
+
+    @contextmanager
+    def pdf_view(self) -> Iterator[memoryview]:
+        """Maps the spooled pdf into memory and yields a read-only memoryview over it
+
+        The view must not be used after the `with` block ends.
+        """
+        with self._pdf_path.open(mode='rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            view = memoryview(m)
+            try:
+                yield view
+            finally:
+                view.release()
+
+    def save_pdf(self, path: Path) -> None:
+        """Moves the spooled pdf to the given Path, the article then refers to the new location
+
+        Args:
+            * path (Path): Path object providing location for data to be saved to
+
+        Raises:
+            FileExistsError: If there is already a file at `path`
+        """
+        if path.exists():
+            raise FileExistsError(f'{path} already exists')
+
+        # Same filesystem moves are a rename, anything else falls back to a copy
+        shutil.move(str(self._pdf_path), str(path))
+        self._pdf_path = path
+
+    def save_to_store(self, store: ContentStore) -> Path:
+        """Moves the spooled pdf into a content-addressed store under its DOI, without copying it
+
+        Args:
+            * store (ContentStore): Store to save the pdf to
+
+        Returns:
+            Path: Location of the stored pdf, the article then refers to it
+        """
+        store.put_file(self._pdf_id, self._pdf_path, move=True)
+        self._pdf_path = store.path_for(self._pdf_id)
+        return self._pdf_path
+
+    def discard(self) -> None:
+        """Deletes the spooled pdf"""
+        self._pdf_path.unlink(missing_ok=True)
+
 
 class JstorScraper:
     """Provides an interface to download an article and its metadata from JSTOR given a valid session
@@ -91,6 +194,10 @@ class JstorScraper:
             - 1: Status updates
             - 2: Full request logging (not yet implemented)
             - 3: Verbose logging (not yet implemented)
+        * spool_dir (Path, optional) : Directory pdfs are streamed to as they download. If given, 
+            SpooledJstorArticle objects are returned instead of in-memory JstorArticle objects. Defaults to None.
+        * parser_backend (str, optional) : Search page parsing backend, see `search_page_parser.BACKENDS`. 
+            Defaults to the fastest one installed.
     """
 
     _base_url : str = None
@@ -109,6 +216,10 @@ class JstorScraper:
 
     _driver: webdriver
 
+    _spool_dir : Path = None
+
+    _parser_backend : str = None
+
     def __init__(self, 
                  controller: ConnectionController, 
                  base_url: str = 'https://www.jstor.org',
@@ -116,7 +227,9 @@ class JstorScraper:
                  pdf_path: str = '/stable/pdf/',
                  metadata_path: str = '/stable/content-metadata/',
                  mean_request_delay_s: int = 10,
-                 log_level = 1) -> None:
+                 log_level = 1,
+                 spool_dir: Path = None,
+                 parser_backend: str = None) -> None:
 
         # Populate private attributes:                
 
@@ -134,8 +247,15 @@ class JstorScraper:
 
         self._controller = controller
 
+        self._parser_backend = parser_backend
+
         self._driver = controller.get_driver()
 
+        if spool_dir is not None:
+            self._spool_dir = Path(spool_dir)
+            self._spool_dir.mkdir(parents=True, exist_ok=True)
+
+    @timed('scraper.wait_before_request')
     def _wait_before_request(self):
 
         if random() < 0.34:
@@ -148,21 +268,107 @@ class JstorScraper:
 
         sleep(n_seconds)
 
-    def _parse_search_page_lite(self, response: BeautifulSoup) -> 'list[SearchResponse]':
+    def _parse_search_page_lite(self, response: Union[str, BeautifulSoup]) -> 'list[SearchResponse]':
 
-        results_list: 'list[SearchResponse]' = []
+        # Page source goes through the fastest installed backend, an already built tree is reused
+        if isinstance(response, str):
+            fields = extract_search_page(response, self._parser_backend)
+        else:
+            fields = extract_from_soup(response)
 
-        results_list = [
-            SearchResponse(
-                dl_button['data-doi'],
-                dl_button['href']
-            ) 
-                for dl_button in response.select('.pdfLink') 
-                if 'href' in dl_button.attrs and 'data-doi' in dl_button.attrs
+        results_list: 'list[SearchResponse]' = [
+            SearchResponse(doi, href)
+                for href, doi in fields.pdf_links
+                if href is not None and doi is not None
             ]
         
         return results_list    
+
+    def _download_article(self, metadata: str, pdf_path: str, document_id: str) -> Union[JstorArticle, SpooledJstorArticle]:
+        """Downloads the pdf with the browser session's cookies and wraps it with its metadata
+
+        Without a spool directory the pdf is read into memory and a JstorArticle is returned. 
+        With one, the response is streamed to `<spool_dir>/<document_id>.pdf` and a 
+        SpooledJstorArticle pointing at that file is returned instead.
+
+        Raises:
+            DownloadException: If the response is not a successfully downloaded pdf
+        """
+
+        # Get cookies to use for requests
+        selenium_cookies = self._driver.get_cookies()
+
+        new_cookies = {c['name']:c['value'] for c in selenium_cookies}
+
+        session = requests.Session()
+
+        with session as s:
+
+            s.headers['User-Agent'] = USER_AGENT
+
+            s.cookies.update(new_cookies)
+
+            with span('scraper.pdf_download'), s.get(pdf_path, stream=self._spool_dir is not None) as pdf_request:
+
+                if pdf_request.status_code != 200:
+                    raise DownloadException(f'''Could not successfully download PDF
+                                                    Status code was {pdf_request.status_code}
+                                                    ''')
+                if pdf_request.headers['content-type'] != 'application/pdf':
+                    raise DownloadException(f'''Could not successfully download PDF
+                                                    Response content-type was {pdf_request.headers['content-type']}
+                                                    ''')
+
+                if self._spool_dir is None:
+                    article = JstorArticle(metadata, pdf_request.content, document_id)
+                    if not metadata:
+                        article.metadata_json = self._metadata_from_pdf(pdf_request.content, document_id)
+                    return article
+
+                # Write to a partial file first so an interrupted download never looks complete
+                spool_path = self._spool_dir.joinpath(f'{document_id.replace("/", "_", 1)}.pdf')
+                part_path = spool_path.with_suffix('.pdf.part')
+
+                try:
+                    with part_path.open(mode='wb') as p:
+                        for chunk in pdf_request.iter_content(chunk_size=SPOOL_CHUNK_SIZE):
+                            p.write(chunk)
+                except BaseException:
+                    # A timeout or reset partway through leaves nothing behind in the spool
+                    part_path.unlink(missing_ok=True)
+                    raise
+
+                os.replace(part_path, spool_path)
+
+        article = SpooledJstorArticle(metadata, spool_path, document_id)
+        if not metadata:
+            with article.pdf_view() as view:
+                article.metadata_json = self._metadata_from_pdf(view, document_id)
+        return article
+
+    def _read_vue_store(self, script: str) -> Union[dict, None]:
+        """Runs a script reading JSTOR's Vue store, None if the store is missing or the script fails"""
+        try:
+            return self._driver.execute_script(script)
+        except JavascriptException as e:
+            if self._log_level > 0:
+                print(f'Could not read article metadata from the page: {e.msg}')
+            return None
+
+    def _metadata_from_pdf(self, pdf: bytes, document_id: str) -> dict:
+        """Builds the article metadata from the downloaded pdf when the page did not provide it
+
+        The result has the same keys as the Vue store's `contentData` that callers read.
+        """
+        if self._log_level > 0:
+            print(f'Extracting metadata for {document_id} from the pdf')
+
+        metadata = extract_pdf_metadata(pdf).as_content_data()
+        if metadata['doi'] is None:
+            metadata['doi'] = document_id
+        return metadata
         
+    @timed('scraper.get_search_results')
     def get_search_results(self, journal_name: str, request_timeout: int=10):
         """Obtain metadata and download links for articles a given journal name and number of articles
         
@@ -176,7 +382,7 @@ class JstorScraper:
             ValueError: If JSTOR returns an unexpected response to requests
             
         Returns:
-            dataframe: Articles metadata 
+            SearchResultSet: DOI and download link of each article found
         
         """
         view_uri = self._controller.rewrite_url(f'{self._base_url}')
@@ -202,11 +408,12 @@ class JstorScraper:
             self._driver.get(view_uri)
 
             try:
-                WebDriverWait(self._driver, 5).until(
-                    expected_conditions.visibility_of_element_located(
-                        (By.XPATH, ".//input[@id='query-builder-input'")
+                with span('scraper.webdriver_wait'):
+                    WebDriverWait(self._driver, 5).until(
+                        expected_conditions.visibility_of_element_located(
+                            (By.XPATH, ".//input[@id='query-builder-input'")
+                        )
                     )
-                )
             except TimeoutException as e:
                 raise TimeoutException("Seem to be unable to load JSTOR landing page") from e
 
@@ -225,23 +432,24 @@ class JstorScraper:
         search_button.click()
 
         try:
-            WebDriverWait(self._driver, 10).until(
-                expected_conditions.element_to_be_clickable(
-                    (
-                        By.XPATH,
-                        '//a[@class = "link-no-underline" and @data-itemtype]'
+            with span('scraper.webdriver_wait'):
+                WebDriverWait(self._driver, 10).until(
+                    expected_conditions.element_to_be_clickable(
+                        (
+                            By.XPATH,
+                            '//a[@class = "link-no-underline" and @data-itemtype]'
+                        )
                     )
                 )
-            )
         except TimeoutException as e:
             raise TimeoutException("Search results didn't load within expected timeframe") from e
             
-        soup = BeautifulSoup(self._driver.page_source, 'html.parser')
-        articles = self._parse_search_page_lite(soup)
+        articles = self._parse_search_page_lite(self._driver.page_source)
         
-        return articles
+        return SearchResultSet(articles)
         
     # Loads JSTOR page and finds link to download PDF
+    @timed('scraper.get_payload_data')
     def get_payload_data(self, document_id: str, request_timeout: int = 10) -> JstorArticle:
         """Obtain download link and metadata for a given article on JSTOR
 
@@ -270,9 +478,10 @@ class JstorScraper:
 
         # Load article landing page
         try:
-            WebDriverWait(self._driver, request_timeout).until(
-                expected_conditions.visibility_of_element_located((By.ID, 'page-scan-info'))
-            )
+            with span('scraper.webdriver_wait'):
+                WebDriverWait(self._driver, request_timeout).until(
+                    expected_conditions.visibility_of_element_located((By.ID, 'page-scan-info'))
+                )
         except:
             print('Unable to load article landing page')
             raise
@@ -281,7 +490,8 @@ class JstorScraper:
         # JSTOR (currently) use vuejs framework
         # We can use that to pull what the page already downloaded.
         # This should make activity more human-like
-        metadata = self._driver.execute_script(
+        # Falls back to the pdf itself in _download_article if the store is not there
+        metadata = self._read_vue_store(
             '''return document.
                         getElementById('page-scan-info').
                         __vue__.$store.state.
@@ -320,9 +530,10 @@ class JstorScraper:
 
         # Now it will try to open new tab with pdf.
         try:
-            WebDriverWait(self._driver, 100).until(
-                expected_conditions.new_window_is_opened(tab_list)
-            )
+            with span('scraper.webdriver_wait'):
+                WebDriverWait(self._driver, 100).until(
+                    expected_conditions.new_window_is_opened(tab_list)
+                )
         except TimeoutException as e:
             raise TimeoutException("Didn't detect a pdf window opening") from e
 
@@ -345,35 +556,13 @@ class JstorScraper:
         # Make sure we are back on the original tab
         #self._driver.switch_to.window(cur_tab)
 
-        # Get cookies to use for requests
-        selenium_cookies = self._driver.get_cookies()
-
-        new_cookies = {c['name']:c['value'] for c in selenium_cookies}
-
-        session = requests.Session()
-
-        with session as s:
-
-            s.headers['User-Agent'] = USER_AGENT
-
-            s.cookies.update(new_cookies)
-
-            pdf_request = s.get(pdf_path)
-
-        if pdf_request.status_code != 200:
-            raise DownloadException(f'''Could not successfully download PDF
-                                               Status code was {pdf_request.status_code}
-                                            ''')
-        if pdf_request.headers['content-type'] != 'application/pdf':
-            raise DownloadException(f'''Could not successfully download PDF
-                                               Response content-type was {pdf_request.headers['content-type']}
-                                            ''')
+        article = self._download_article(metadata, pdf_path, document_id)
         print(document_id)
-        return JstorArticle(metadata, pdf_request.content,document_id)
+        return article
 
     
     # Loads JSTOR pages and finds link to download PDF
-    def get_multi_payload_data(self, document_ids: 'list[str]', request_timeout: int = 25)-> JstorArticle: 
+    def get_multi_payload_data(self, document_ids: 'list[str]', request_timeout: int = 25)-> 'list[JstorArticle]': 
         """Obtain download link and metadata for a given article on JSTOR
 
         Args:
@@ -389,118 +578,34 @@ class JstorScraper:
 
         """
         lst = []
-        for id in document_ids:
-            view_uri = self._controller.rewrite_url(f'{self._base_url}{self._prev_path}{id}')
-
-            # Send the request
-            self._wait_before_request()
-    
-            if self._log_level > 0:
-                print(f'Performing GET request for article landing page at {view_uri}', end = '\r')
-            #page_request = self._session.get(view_uri)
-            self._driver.get(view_uri)
-    
-            # Load article landing page
-            try:
-                WebDriverWait(self._driver, request_timeout).until(
-                    expected_conditions.visibility_of_element_located((By.ID, 'item_view_content'))
-                )
-            except:
-                print('Unable to load article landing page')
-                raise
-    
-            # Pull article metadata from DOM
-            # JSTOR (currently) use vuejs framework
-            # We can use that to pull what the page already downloaded.
-            # This should make activity more human-like
-            metadata = self._driver.execute_script(
-                '''return document.
-                            getElementsByClassName('abstract-container')[0].
-                            __vue__.$store.state.
-                            content.contentData;'''
-                )
-    
-            # Now try download the pdf
-            # First find download button and download link
-            pdf_button = self._driver.find_element_by_xpath('//a[@data-qa="download-pdf"]')
-            pdf_path = pdf_button.get_attribute('href')
-    
-            # Get T&C state
-            tc_state = self._driver.execute_script(
-                '''return document.
-                            getElementsByClassName('abstract-container')[0].
-                            __vue__.$store.state.
-                            user.termsAndConditionsAccepted;'''
-                )
-    
-            self._wait_before_request()
-    
-            pdf_button.click()
-    
-            # Get handle to current set of tabs
-            tab_list = self._driver.window_handles
-            num_tabs = len(tab_list)
-            cur_tab = self._driver.current_window_handle
-    
-            # If T&C haven't already been accepted, modal will show up:
-            if not tc_state:
-                accept_button = self._driver.find_element_by_xpath('//pharos-button[@data-qa="accept-terms-and-conditions-button"]')
-    
-                self._wait_before_request()
-    
-                accept_button.click()
-    
-            try:
-                WebDriverWait(self._driver, 5).until(
-                    expected_conditions.new_window_is_opened(tab_list)
-                )
-            except TimeoutException as e:
-                raise TimeoutException("Didn't detect a pdf window opening") from e
+        for result in self.iter_multi_payload_data(document_ids, request_timeout):
+            if isinstance(result, PayloadFailure):
+                raise result.error
+            lst.append(result)
 
-            new_tabs = self._driver.window_handles    
-
-            for nt in new_tabs:
-                if not (nt in tab_list):
-                    self._driver.switch_to.window(nt)
-
-                    self._driver.close()
-
-                    self._driver.switch_to.window(cur_tab)
-
-                    break
-
-            # Close the new tab 
-            # We will try rather use requests to download the pdf otherwise no way to save
-            #self._driver.close()
-
-            # Make sure we are back on the original tab
-            #self._driver.switch_to.window(cur_tab)
-
-            # Get cookies to use for requests
-            selenium_cookies = self._driver.get_cookies()
-
-            new_cookies = {c['name']:c['value'] for c in selenium_cookies}
-
-            session = requests.Session()
-
-            with session as s:
+        return lst
 
-                s.headers['User-Agent'] = USER_AGENT
+    def iter_multi_payload_data(self, document_ids: 'Iterable[str]', request_timeout: int = 25) -> 'Iterator[Union[JstorArticle, SpooledJstorArticle, PayloadFailure]]':
+        """Streaming variant of get_multi_payload_data that yields each article as soon as it is complete
 
-                s.cookies.update(new_cookies)
+        Each article is fetched with get_payload_data, so requests are paced exactly as for single
+        articles. A failing article does not end the stream, a PayloadFailure is yielded in its
+        place and the next ID is processed.
 
-                pdf_request = s.get(pdf_path)
+        Args:
+            * document_ids (iterable of str): The JSTOR document IDs to process
+            * request_timeout (int, optional): Length of time to wait 
+              for requests to successfully complete
 
-            if pdf_request.status_code != 200:
-                raise DownloadException(f'''Could not successfully download PDF
-                                                Status code was {pdf_request.status_code}
-                                                ''')
-            if pdf_request.headers['content-type'] != 'application/pdf':
-                raise DownloadException(f'''Could not successfully download PDF
-                                                Response content-type was {pdf_request.headers['content-type']}
-                                                ''')
-            print(id)
-            lst.append(JstorArticle(metadata, pdf_request.content,id))
-                                            
-       
-        return lst
+        Yields:
+            JstorArticle or SpooledJstorArticle for each downloaded article, PayloadFailure for each failed one
+        """
+        for id in document_ids:
+            try:
+                article = self.get_payload_data(id, request_timeout)
+            except Exception as e:
+                if self._log_level > 0:
+                    print(f'Failed to obtain article {id}: {e}')
+                yield PayloadFailure(id, e)
+            else:
+                yield article
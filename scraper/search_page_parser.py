@@ -0,0 +1,356 @@
+from functools import lru_cache
+from html.parser import HTMLParser
+from typing import Callable, NamedTuple, Optional
+
+# The elements of a JSTOR search results page we extract, by css class
+RESULT_CLASS = 'result-list__item'
+TITLE_CLASS = 'link-no-underline'
+AUTHOR_CLASS = 'contrib'
+METADATA_CLASS = 'metadata'
+PDF_LINK_CLASS = 'pdfLink'
+
+
+class SearchPageFields(NamedTuple):
+    """Raw fields of a JSTOR search results page, in document order
+
+    Attributes:
+        * titles (list[str]) : Text of each `.link-no-underline` element
+        * authors (list[str]) : Text of each `.contrib` element
+        * metadata (list[str]) : Text of each `.metadata` element
+        * pdf_links (list[tuple]) : `(href, data-doi)` of each `.pdfLink` element, either may be None
+    """
+    titles: 'list[str]'
+    authors: 'list[str]'
+    metadata: 'list[str]'
+    pdf_links: 'list[tuple[Optional[str], Optional[str]]]'
+
+
+class SearchRecord(NamedTuple):
+    """The fields of a single search result, None where the result lacks one
+
+    Attributes:
+        * title (str) : Text of the result's `.link-no-underline` element
+        * authors (str) : Text of the result's `.contrib` element
+        * metadata (str) : Text of the result's `.metadata` element
+        * pdf_href (str) : `href` of the result's `.pdfLink` element
+        * doi (str) : `data-doi` of the result's `.pdfLink` element
+    """
+    title: Optional[str]
+    authors: Optional[str]
+    metadata: Optional[str]
+    pdf_href: Optional[str]
+    doi: Optional[str]
+
+
+class Backend(NamedTuple):
+    """Extraction functions of one parsing backend, both take the page source"""
+    fields: Callable[[str], SearchPageFields]
+    records: Callable[[str], 'list[SearchRecord]']
+
+
+def extract_from_soup(soup) -> SearchPageFields:
+    """Extracts the fields from an already parsed BeautifulSoup tree"""
+    return SearchPageFields(
+        [t.text for t in soup.select(f'.{TITLE_CLASS}')],
+        [a.text for a in soup.select(f'.{AUTHOR_CLASS}')],
+        [m.text for m in soup.select(f'.{METADATA_CLASS}')],
+        [(l.get('href'), l.get('data-doi')) for l in soup.select(f'.{PDF_LINK_CLASS}')]
+    )
+
+
+def records_from_soup(soup) -> 'list[SearchRecord]':
+    """Extracts one record per result from an already parsed BeautifulSoup tree"""
+
+    def text(item, cls: str) -> Optional[str]:
+        el = item.select_one(f'.{cls}')
+        return el.text if el is not None else None
+
+    records = []
+    for item in soup.select(f'.{RESULT_CLASS}'):
+        link = item.select_one(f'.{PDF_LINK_CLASS}')
+        records.append(SearchRecord(
+            text(item, TITLE_CLASS),
+            text(item, AUTHOR_CLASS),
+            text(item, METADATA_CLASS),
+            link.get('href') if link is not None else None,
+            link.get('data-doi') if link is not None else None
+        ))
+    return records
+
+
+def _bs4_tree(html: str):
+    # Reference implementation, this is what the scraper has always done
+    from bs4 import BeautifulSoup
+
+    return BeautifulSoup(html, 'html.parser')
+
+
+def _selectolax_tree(html: str):
+    try:
+        from selectolax.lexbor import LexborHTMLParser as SelectolaxParser
+    except ImportError:
+        # selectolax before 0.3.13 only ships the modest engine
+        from selectolax.parser import HTMLParser as SelectolaxParser
+
+    return SelectolaxParser(html)
+
+
+def _selectolax_fields(html: str) -> SearchPageFields:
+    tree = _selectolax_tree(html)
+    return SearchPageFields(
+        [n.text(deep=True) for n in tree.css(f'.{TITLE_CLASS}')],
+        [n.text(deep=True) for n in tree.css(f'.{AUTHOR_CLASS}')],
+        [n.text(deep=True) for n in tree.css(f'.{METADATA_CLASS}')],
+        [(n.attributes.get('href'), n.attributes.get('data-doi')) for n in tree.css(f'.{PDF_LINK_CLASS}')]
+    )
+
+
+def _selectolax_records(html: str) -> 'list[SearchRecord]':
+
+    def text(item, cls: str) -> Optional[str]:
+        node = item.css_first(f'.{cls}')
+        return node.text(deep=True) if node is not None else None
+
+    records = []
+    for item in _selectolax_tree(html).css(f'.{RESULT_CLASS}'):
+        link = item.css_first(f'.{PDF_LINK_CLASS}')
+        records.append(SearchRecord(
+            text(item, TITLE_CLASS),
+            text(item, AUTHOR_CLASS),
+            text(item, METADATA_CLASS),
+            link.attributes.get('href') if link is not None else None,
+            link.attributes.get('data-doi') if link is not None else None
+        ))
+    return records
+
+
+def _lxml_by_class(node, cls: str, descendants: bool = False) -> list:
+    prefix = './/' if descendants else '//'
+    return node.xpath(f'{prefix}*[contains(concat(" ", normalize-space(@class), " "), " {cls} ")]')
+
+
+def _lxml_text(el) -> str:
+    from lxml import etree
+
+    # Restricting to elements skips comment text, as BeautifulSoup's .text does
+    return ''.join(el.itertext(etree.Element))
+
+
+def _lxml_fields(html: str) -> SearchPageFields:
+    from lxml import html as lxml_html
+
+    tree = lxml_html.fromstring(html)
+    return SearchPageFields(
+        [_lxml_text(e) for e in _lxml_by_class(tree, TITLE_CLASS)],
+        [_lxml_text(e) for e in _lxml_by_class(tree, AUTHOR_CLASS)],
+        [_lxml_text(e) for e in _lxml_by_class(tree, METADATA_CLASS)],
+        [(e.get('href'), e.get('data-doi')) for e in _lxml_by_class(tree, PDF_LINK_CLASS)]
+    )
+
+
+def _lxml_records(html: str) -> 'list[SearchRecord]':
+    from lxml import html as lxml_html
+
+    def first(item, cls: str):
+        found = _lxml_by_class(item, cls, descendants=True)
+        return found[0] if found else None
+
+    def text(item, cls: str) -> Optional[str]:
+        el = first(item, cls)
+        return _lxml_text(el) if el is not None else None
+
+    records = []
+    for item in _lxml_by_class(lxml_html.fromstring(html), RESULT_CLASS):
+        link = first(item, PDF_LINK_CLASS)
+        records.append(SearchRecord(
+            text(item, TITLE_CLASS),
+            text(item, AUTHOR_CLASS),
+            text(item, METADATA_CLASS),
+            link.get('href') if link is not None else None,
+            link.get('data-doi') if link is not None else None
+        ))
+    return records
+
+
+# Elements that never have a closing tag, so never hold captured text
+_VOID_TAGS = frozenset((
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input',
+    'link', 'meta', 'param', 'source', 'track', 'wbr'
+))
+
+# Text captures, by css class and the SearchPageFields/SearchRecord names they fill
+_CAPTURED = (
+    (TITLE_CLASS, 'titles', 'title'),
+    (AUTHOR_CLASS, 'authors', 'authors'),
+    (METADATA_CLASS, 'metadata', 'metadata'),
+)
+
+
+class _StreamingExtractor(HTMLParser):
+    """Single pass, tree-less extractor built on the standard library's tokenizer
+
+    Only the text inside elements carrying one of the wanted classes is kept. Each of those
+    elements opens a capture that closes again when the element does. Captures and pdf links
+    inside a `.result-list__item` element also fill that result's record.
+    """
+
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self._depth = 0
+        # Open tags, so unclosed elements can be unwound on a mismatched end tag
+        self._stack = []
+        # (field list, index, record key, depth, chunks) of every open capture
+        self._captures = []
+        # (values, depth) of the result element currently open
+        self._record = None
+        self.fields = SearchPageFields([], [], [], [])
+        self.records = []
+
+    def handle_starttag(self, tag, attrs) -> None:
+        if tag in _VOID_TAGS:
+            return
+
+        self._stack.append(tag)
+        self._depth += 1
+
+        classes = None
+        for k, v in attrs:
+            if k == 'class' and v:
+                classes = v.split()
+                break
+        if classes is None:
+            return
+
+        if RESULT_CLASS in classes and self._record is None:
+            self._record = (dict.fromkeys(SearchRecord._fields), self._depth)
+
+        # Placeholders are appended now so results stay in document order
+        for cls, field_name, record_key in _CAPTURED:
+            if cls in classes:
+                field = getattr(self.fields, field_name)
+                field.append(None)
+                self._captures.append((field, len(field) - 1, record_key, self._depth, []))
+
+        if PDF_LINK_CLASS in classes:
+            a = dict(attrs)
+            self.fields.pdf_links.append((a.get('href'), a.get('data-doi')))
+            if self._record is not None and self._record[0]['pdf_href'] is None:
+                self._record[0]['pdf_href'] = a.get('href')
+                self._record[0]['doi'] = a.get('data-doi')
+
+    def handle_startendtag(self, tag, attrs) -> None:
+        if tag not in _VOID_TAGS:
+            self.handle_starttag(tag, attrs)
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag) -> None:
+        if tag not in self._stack:
+            return
+        while self._stack:
+            open_tag = self._stack.pop()
+            self._close_depth()
+            if open_tag == tag:
+                break
+
+    def _close_depth(self) -> None:
+        while self._captures and self._captures[-1][3] == self._depth:
+            field, index, record_key, _, chunks = self._captures.pop()
+            field[index] = ''.join(chunks)
+            if self._record is not None and self._record[0][record_key] is None:
+                self._record[0][record_key] = field[index]
+
+        if self._record is not None and self._record[1] == self._depth:
+            self.records.append(SearchRecord(**self._record[0]))
+            self._record = None
+
+        self._depth -= 1
+
+    def handle_data(self, data) -> None:
+        for capture in self._captures:
+            capture[4].append(data)
+
+    def close(self) -> None:
+        super().close()
+        while self._stack:
+            self._stack.pop()
+            self._close_depth()
+
+
+def _streaming_parse(html: str) -> _StreamingExtractor:
+    parser = _StreamingExtractor()
+    parser.feed(html)
+    parser.close()
+    return parser
+
+
+BACKENDS : 'dict[str, Backend]' = {
+    'selectolax': Backend(_selectolax_fields, _selectolax_records),
+    'lxml': Backend(_lxml_fields, _lxml_records),
+    'streaming': Backend(lambda html: _streaming_parse(html).fields, lambda html: _streaming_parse(html).records),
+    'bs4': Backend(lambda html: extract_from_soup(_bs4_tree(html)), lambda html: records_from_soup(_bs4_tree(html))),
+}
+
+# Fastest first, the streaming extractor only needs the standard library
+_PREFERENCE = ('selectolax', 'lxml', 'streaming')
+
+_REQUIRES = {
+    'selectolax': 'selectolax',
+    'lxml': 'lxml.html',
+    'bs4': 'bs4',
+}
+
+
+@lru_cache(maxsize=None)
+def available_backends() -> 'tuple[str, ...]':
+    """Names of the backends whose dependencies are installed"""
+    from importlib.util import find_spec
+
+    available = []
+    for name in BACKENDS:
+        module = _REQUIRES.get(name)
+        try:
+            if module is None or find_spec(module) is not None:
+                available.append(name)
+        except ModuleNotFoundError:
+            pass
+    return tuple(available)
+
+
+def get_backend(name: str = None) -> Backend:
+    """Returns the backend called `name`, or the fastest available backend if not given
+
+    Raises:
+        ValueError: If `name` is not a known or installed backend
+    """
+    available = available_backends()
+
+    if name is None:
+        name = next(b for b in _PREFERENCE if b in available)
+    elif name not in BACKENDS:
+        raise ValueError(f'Unknown search page backend {name}, expected one of {list(BACKENDS)}')
+    elif name not in available:
+        raise ValueError(f'Search page backend {name} is not installed')
+
+    return BACKENDS[name]
+
+
+def extract_search_page(html: str, backend: str = None) -> SearchPageFields:
+    """Extracts the raw fields of a JSTOR search results page
+
+    Args:
+        * html (str) : Page source of the search results page
+        * backend (str, optional) : One of `BACKENDS`. Defaults to the fastest one installed.
+    """
+    return get_backend(backend).fields(html)
+
+
+def extract_search_records(html: str, backend: str = None) -> 'list[SearchRecord]':
+    """Extracts one record per result of a JSTOR search results page
+
+    Unlike extract_search_page, fields stay aligned when a result lacks one of them.
+
+    Args:
+        * html (str) : Page source of the search results page
+        * backend (str, optional) : One of `BACKENDS`. Defaults to the fastest one installed.
+    """
+    return get_backend(backend).records(html)
@@ -0,0 +1,189 @@
+import json
+from pathlib import Path
+from typing import Iterable, Iterator, Union
+
+from scraper.text_normalisation import docid_from_url
+
+_COLUMNS = ('doi', 'url', 'docid')
+
+
+class SearchResponse:
+    __slots__ = ('doi', 'url', 'docid')
+
+    doi: str
+    url: str
+    docid: str
+
+    def __init__(self, doi, url, docid=None):
+        self.doi = doi
+        self.url = url
+        # Callers that already know the docid (e.g. a stored result set) skip deriving it again
+        self.docid = docid if docid is not None else docid_from_url(url)
+
+    def __eq__(self, other):
+        if not isinstance(other, SearchResponse):
+            return NotImplemented
+        return (self.doi, self.url, self.docid) == (other.doi, other.url, other.docid)
+
+    def __hash__(self):
+        return hash(self.doi)
+
+    def __str__(self):
+        return f'SearchResponse Object: {{ Article ID: {self.docid}; DOI: {self.doi}; URL: {self.url} }}'
+
+    def __repr__(self):
+        return f"SearchResponse('{self.doi}', '{self.url}')"
+
+
+class SearchResultSet:
+    """Columnar, DOI-keyed collection of search results
+
+    Results are stored as one list per field rather than one object per result, and a DOI
+    to row index map gives O(1) lookups. A DOI is only ever held once, the first result wins.
+    SearchResponse objects are created on access.
+
+    Args:
+        * results (iterable of SearchResponse, optional) : Initial results
+    """
+
+    __slots__ = ('_doi', '_url', '_docid', '_index')
+
+    def __init__(self, results: Iterable[SearchResponse] = ()) -> None:
+        self._doi : 'list[str]' = []
+        self._url : 'list[str]' = []
+        self._docid : 'list[str]' = []
+        self._index : 'dict[str, int]' = {}
+        self.extend(results)
+
+    @classmethod
+    def from_columns(cls, dois: Iterable[str], urls: Iterable[str], docids: Iterable[str]) -> 'SearchResultSet':
+        result_set = cls()
+        for doi, url, docid in zip(dois, urls, docids):
+            result_set._add(doi, url, docid)
+        return result_set
+
+    def _add(self, doi: str, url: str, docid: str) -> bool:
+        if doi in self._index:
+            return False
+        self._index[doi] = len(self._doi)
+        self._doi.append(doi)
+        self._url.append(url)
+        self._docid.append(docid)
+        return True
+
+    def add(self, result: SearchResponse) -> bool:
+        """Adds a result, returns False if its DOI was already present"""
+        return self._add(result.doi, result.url, result.docid)
+
+    def extend(self, results: Iterable[SearchResponse]) -> None:
+        for r in results:
+            self._add(r.doi, r.url, r.docid)
+
+    def __len__(self) -> int:
+        return len(self._doi)
+
+    def __contains__(self, item: Union[str, SearchResponse]) -> bool:
+        doi = item.doi if isinstance(item, SearchResponse) else item
+        return doi in self._index
+
+    def __getitem__(self, i: int) -> SearchResponse:
+        return SearchResponse(self._doi[i], self._url[i], self._docid[i])
+
+    def __iter__(self) -> Iterator[SearchResponse]:
+        for doi, url, docid in zip(self._doi, self._url, self._docid):
+            yield SearchResponse(doi, url, docid)
+
+    def __repr__(self) -> str:
+        return f'SearchResultSet({len(self)} results)'
+
+    def index_of(self, doi: str) -> int:
+        """Row of `doi`
+
+        Raises:
+            KeyError: If the DOI is not in the set
+        """
+        return self._index[doi]
+
+    def get(self, doi: str) -> SearchResponse:
+        """The result for `doi`, or None"""
+        i = self._index.get(doi)
+        return self[i] if i is not None else None
+
+    @property
+    def dois(self) -> 'list[str]':
+        return list(self._doi)
+
+    @property
+    def urls(self) -> 'list[str]':
+        return list(self._url)
+
+    @property
+    def docids(self) -> 'list[str]':
+        return list(self._docid)
+
+    # Set operations take another result set or any collection of DOIs, e.g. the DoiIndex's known set
+
+    def _select(self, keep) -> 'SearchResultSet':
+        rows = [i for i, doi in enumerate(self._doi) if keep(doi)]
+        return SearchResultSet.from_columns(
+            (self._doi[i] for i in rows), (self._url[i] for i in rows), (self._docid[i] for i in rows)
+        )
+
+    def difference(self, other: 'Union[SearchResultSet, Iterable[str]]') -> 'SearchResultSet':
+        """Results whose DOI is not in `other`, in their original order"""
+        exclude = _doi_lookup(other)
+        return self._select(lambda doi: doi not in exclude)
+
+    def intersection(self, other: 'Union[SearchResultSet, Iterable[str]]') -> 'SearchResultSet':
+        """Results whose DOI is also in `other`, in their original order"""
+        include = _doi_lookup(other)
+        return self._select(lambda doi: doi in include)
+
+    def union(self, other: 'SearchResultSet') -> 'SearchResultSet':
+        """This set followed by the results of `other` with new DOIs"""
+        merged = SearchResultSet.from_columns(self._doi, self._url, self._docid)
+        merged.extend(other)
+        return merged
+
+    __sub__ = difference
+    __and__ = intersection
+    __or__ = union
+
+    def to_jsonl(self, path: Path) -> None:
+        """Writes one JSON object per result"""
+        with Path(path).open('w', encoding='utf-8') as f:
+            for row in zip(self._doi, self._url, self._docid):
+                f.write(json.dumps(dict(zip(_COLUMNS, row)), ensure_ascii=False))
+                f.write('\n')
+
+    @classmethod
+    def from_jsonl(cls, path: Path) -> 'SearchResultSet':
+        result_set = cls()
+        with Path(path).open(encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    r = json.loads(line)
+                    result_set._add(r['doi'], r['url'], r.get('docid') or docid_from_url(r['url']))
+        return result_set
+
+    def to_parquet(self, path: Path) -> None:
+        """Writes the columns to a Parquet file, needs pyarrow"""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.table({'doi': self._doi, 'url': self._url, 'docid': self._docid})
+        pq.write_table(table, str(path))
+
+    @classmethod
+    def from_parquet(cls, path: Path) -> 'SearchResultSet':
+        import pyarrow.parquet as pq
+
+        table = pq.read_table(str(path), columns=list(_COLUMNS))
+        return cls.from_columns(*(table.column(c).to_pylist() for c in _COLUMNS))
+
+
+def _doi_lookup(other) -> 'Union[SearchResultSet, set, frozenset, dict]':
+    # Anything with fast membership is used as is, other iterables are materialised once
+    if isinstance(other, (SearchResultSet, set, frozenset, dict)):
+        return other
+    return set(other)
@@ -1,56 +1,67 @@
 import os
-import shutil
-import earthpy as et
+from pathlib import Path
+
+from storage.content_store import ContentStore
+
+# All paths are resolved against the directory the program was started from,
+# the working directory itself is never changed so this is safe to use from threads
+BASE_DIR = Path.cwd()
+
+# Used to come from earthpy, which pulled in a geospatial stack just for this lookup
+HOME = Path.home()
 
 def setHomeDirectory():
-    if os.path.exists(et.io.HOME):
-     et.io.HOME
-    else:
+    if not HOME.exists():
         print("Home directory not found")
+
+def tempStoragePath() -> Path:
+    return BASE_DIR.joinpath('TempStorage')
+
+def storagePath() -> Path:
+    return BASE_DIR.joinpath('Storage')
         
 # Create the directory Staging for storage of pdfs
 def createTempStorage():
     setHomeDirectory()
-    path=os.path.join(os.getcwd(),'TempStorage')
+    path=tempStoragePath()
     try: 
         os.mkdir(path)
     except OSError as error:    
         print(error) #Should include something else here to do if there is an error ? Maybe prompt user to rename the directory they have with the same name 
 
-def setTempStorage():
+def setTempStorage() -> Path:
+    # Used to chdir into TempStorage, now just returns its path
     setHomeDirectory()
-    path=os.path.join(os.getcwd(),'TempStorage')
-    if os.path.exists(path):
-     os.chdir(path)
-    else:
+    path=tempStoragePath()
+    if not os.path.exists(path):
         print("Temp Storage directory not found")
+    return path
 
 def createStorageDirectory():
     setHomeDirectory()
-    storagepath=os.path.join(os.getcwd(),'Storage')
+    storagepath=storagePath()
     try: 
         os.mkdir(storagepath)
     except OSError as error:    
         print(error) #Should include something else here to do if there is an error ? Maybe prompt user to rename the directory they have with the same name 
 
-def moveFilesToStorage():
-    setHomeDirectory()
-    storagepath=os.path.join(os.getcwd(),'Storage')
-    setTempStorage()
-    files=os. listdir()
-    for f in files:
-        shutil.move(f, storagepath)
+def openStorage() -> ContentStore:
+    """The content-addressed store kept in the Storage directory"""
+    return ContentStore(storagePath())
+
+def moveFilesToStorage(store: ContentStore = None):
+    # Staged pdfs are named after their DOI with the first "/" replaced by "_"
+    store = store or openStorage()
+    for f in setTempStorage().iterdir():
+        if f.suffix == '.pdf':
+            store.put_file(f.stem.replace('_', '/', 1), f, move=True)
     
 def deleteStaggingFiles():
-    setTempStorage()
-    files=os.listdir()
-    for f in files:
-        os.remove(f)
+    for f in setTempStorage().iterdir():
+        f.unlink()
     #Add a check here to see if all files were deleted using os.listdir()
     
 def deleteTempStorage():
     setHomeDirectory()
-    path=os.path.join(os.getcwd(),'TempStorage')
-    path2=os.path.join(os.getcwd(),'Storage')
-    os.rmdir(path)
-    os.rmdir(path2)
\ No newline at end of file
+    os.rmdir(tempStoragePath())
+    os.rmdir(storagePath())
@@ -0,0 +1,82 @@
+import re
+from functools import lru_cache
+from typing import NamedTuple
+
+# All patterns are compiled once at import, never inside per-article code
+
+# JSTOR article links, e.g. /stable/pdf/23355177.pdf?refreqid=...
+DOCID_REGEX = re.compile(r'/stable/(?:pdf/)?(?P<id>[a-z0-9]+)\.[a-z0-9]{1,4}(?:\?.+)?')
+
+# Hopefully this regex will handle most real-world cases that we need
+URL_REGEX = re.compile(r'(?P<proto>https?)://(?P<host>[-A-Za-z.]+)(?P<port>:[0-9]+)?(?P<pathqry>/.+)?')
+
+# Author names as JSTOR lists them, either "First [Middle ...] Surname" or "Surname, First [Middle ...]".
+# Name parts may contain apostrophes and hyphens (O'Brien, Jean-Paul) and end in a period when abbreviated.
+_NAME_PART = r"[^\W\d_][\w'’-]*"
+FIRST_SURNAME_REGEX = re.compile(
+    rf'^\W*(?P<firstname>{_NAME_PART})\.? '
+    rf'(?:(?P<middle>{_NAME_PART})\.? )*'
+    rf'(?P<surname>{_NAME_PART})\W*$'
+)
+SURNAME_FIRST_REGEX = re.compile(rf'^\W*(?P<surname>{_NAME_PART}), ?(?P<firstname>{_NAME_PART})')
+
+# Just a surname, or a single name
+SINGLE_NAME_REGEX = re.compile(rf'^\W*(?P<surname>{_NAME_PART})\W*$')
+
+UNKNOWN = 'Unknown'
+
+UCT_PROXY_HOST = 'ezproxy.uct.ac.za'
+
+
+class AuthorName(NamedTuple):
+    """Initial of the first name and the surname of an author"""
+    initial: str
+    surname: str
+
+
+def docid_from_url(url: str) -> str:
+    """Strips a JSTOR article link down to its document ID, other strings are returned unchanged"""
+    return DOCID_REGEX.sub(r'\g<id>', url)
+
+
+@lru_cache(maxsize=4096)
+def parse_author_name(author: str) -> AuthorName:
+    """Splits an author name into the initial of the first name and the surname
+
+    Handles both "First Middle Surname" and "Surname, First Middle". Names that do not look
+    like either give `Unknown` for both fields, a lone name is taken as the surname.
+
+    Args:
+        * author (str) : Author name as listed in the article metadata
+
+    Returns:
+        AuthorName: The initial and surname
+    """
+    names = SURNAME_FIRST_REGEX.match(author) or FIRST_SURNAME_REGEX.match(author)
+
+    if names is not None:
+        return AuthorName(names['firstname'][0], names['surname'])
+
+    single = SINGLE_NAME_REGEX.match(author)
+    if single is not None:
+        return AuthorName(UNKNOWN, single['surname'])
+
+    return AuthorName(UNKNOWN, UNKNOWN)
+
+
+@lru_cache(maxsize=4096)
+def rewrite_proxy_url(instring: str, proxy_host: str = UCT_PROXY_HOST) -> str:
+    """Rewrites a URL to go through an EZproxy host, e.g. www.jstor.org becomes www-jstor-org.<proxy_host>
+
+    Results are memoised on the input URL, the same landing pages are rewritten over and over.
+
+    Raises:
+        ValueError: If `instring` does not look like a URL
+    """
+    url_match = URL_REGEX.fullmatch(instring)
+
+    if url_match == None or url_match['host'] == None:
+        raise ValueError('instring does not appear to be a useable URL')
+
+    # Generating rewritten string using string interpolation
+    return f'https://{url_match["host"].replace(".", "-")}.{proxy_host}{str(url_match["port"] or "")}{str(url_match["pathqry"] or "")}'
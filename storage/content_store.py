@@ -0,0 +1,262 @@
+import hashlib
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+from pathlib import Path
+from time import time
+from typing import TYPE_CHECKING, BinaryIO, Iterable, Iterator, Union
+
+if TYPE_CHECKING:
+    from storage.pack_archive import PackArchive, PackedPdf
+
+# Files are hashed and copied in chunks of this many bytes
+CHUNK_SIZE = 1024 * 1024
+
+
+class ContentStore:
+    """Content-addressed pdf store keyed by SHA-256
+
+    Every pdf is stored once under `objects/<h[0:2]>/<h[2:4]>/<h>.pdf`, so its location follows
+    from its hash without listing directories. Writes go to a temporary file in the store and
+    are renamed into place, so a crash never leaves a partial object behind. Identical content
+    stored under several DOIs is kept once. A SQLite index maps each DOI to the hash of its pdf.
+
+    Nothing here changes the process working directory, so a store can be shared between threads.
+
+    Args:
+        * root (Path) : Directory holding the store, created if missing
+        * archive (PackArchive, optional) : Archive that pdfs whose object was pruned are read
+            from, see `archive_store`. Defaults to none.
+    """
+
+    _root : Path = None
+
+    _objects : Path = None
+
+    _tmp : Path = None
+
+    _conn : sqlite3.Connection = None
+
+    _lock : threading.Lock = None
+
+    def __init__(self, root: Path, archive: 'PackArchive' = None) -> None:
+        self._root = Path(root).resolve()
+        self._archive = archive
+        self._objects = self._root.joinpath('objects')
+        self._tmp = self._root.joinpath('tmp')
+        self._objects.mkdir(parents=True, exist_ok=True)
+        self._tmp.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self._root.joinpath('index.sqlite3')), check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        with self._conn:
+            self._conn.execute('''CREATE TABLE IF NOT EXISTS doi_hash (
+                                    doi TEXT PRIMARY KEY,
+                                    sha256 TEXT NOT NULL,
+                                    size INTEGER NOT NULL,
+                                    added_at REAL NOT NULL
+                                  )''')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS doi_hash_sha256 ON doi_hash (sha256)')
+
+    @property
+    def root(self) -> Path:
+        return self._root
+
+    def object_path(self, sha256: str) -> Path:
+        """Location of the object with the given hash, whether or not it exists"""
+        return self._objects.joinpath(sha256[0:2], sha256[2:4], f'{sha256}.pdf')
+
+    def put_bytes(self, doi: str, data: bytes) -> str:
+        """Stores an in-memory pdf under `doi`
+
+        Returns:
+            str: SHA-256 of the pdf
+        """
+        return self.put_stream(doi, [data])
+
+    def put_stream(self, doi: str, chunks: Iterable[bytes]) -> str:
+        """Stores a pdf arriving in chunks, e.g. a streamed download, hashing it on the way
+
+        Returns:
+            str: SHA-256 of the pdf
+        """
+        digest = hashlib.sha256()
+        size = 0
+
+        fd, tmp_name = tempfile.mkstemp(dir=self._tmp, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in chunks:
+                    digest.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+
+            sha256 = digest.hexdigest()
+            self._commit_object(Path(tmp_name), sha256)
+        finally:
+            if os.path.exists(tmp_name):
+                os.remove(tmp_name)
+
+        self._index(doi, sha256, size)
+        return sha256
+
+    def put_file(self, doi: str, path: Path, move: bool = False) -> str:
+        """Stores a pdf that is already on disk
+
+        On the same filesystem the file is hardlinked (or renamed with `move`) into place, so
+        its bytes are never copied. Elsewhere it is copied in chunks.
+
+        Args:
+            * doi (str) : DOI the pdf belongs to
+            * path (Path) : Location of the pdf
+            * move (bool, optional) : Remove `path` once stored. Defaults to False.
+
+        Returns:
+            str: SHA-256 of the pdf
+        """
+        path = Path(path)
+        sha256, size = hash_file(path)
+        target = self.object_path(sha256)
+
+        if not target.exists():
+            fd, tmp_name = tempfile.mkstemp(dir=self._tmp, suffix='.part')
+            os.close(fd)
+            os.remove(tmp_name)
+            try:
+                try:
+                    os.link(path, tmp_name)
+                except OSError:
+                    # Different filesystem or no hardlink support
+                    shutil.copyfile(path, tmp_name)
+                self._commit_object(Path(tmp_name), sha256)
+            finally:
+                if os.path.exists(tmp_name):
+                    os.remove(tmp_name)
+
+        if move:
+            path.unlink()
+
+        self._index(doi, sha256, size)
+        return sha256
+
+    def _commit_object(self, tmp_path: Path, sha256: str) -> None:
+        target = self.object_path(sha256)
+        if target.exists():
+            # Same content is already stored, the new copy is dropped
+            return
+        target.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(tmp_path, target)
+
+    def _index(self, doi: str, sha256: str, size: int) -> None:
+        """Points `doi` at `sha256`, deleting the object it pointed at before if nothing else uses it"""
+        with self._lock, self._conn:
+            row = self._conn.execute('SELECT sha256 FROM doi_hash WHERE doi = ?', (doi,)).fetchone()
+            self._conn.execute(
+                'INSERT OR REPLACE INTO doi_hash (doi, sha256, size, added_at) VALUES (?, ?, ?, ?)',
+                (doi, sha256, size, time())
+            )
+            if row is not None and row[0] != sha256:
+                still_used = self._conn.execute('SELECT 1 FROM doi_hash WHERE sha256 = ?', (row[0],)).fetchone()
+                if still_used is None:
+                    self.object_path(row[0]).unlink(missing_ok=True)
+
+    def __contains__(self, doi: str) -> bool:
+        return self.hash_for(doi) is not None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM doi_hash').fetchone()[0]
+
+    def hash_for(self, doi: str) -> str:
+        """SHA-256 of the pdf stored for `doi`, or None"""
+        with self._lock:
+            row = self._conn.execute('SELECT sha256 FROM doi_hash WHERE doi = ?', (doi,)).fetchone()
+        return row[0] if row is not None else None
+
+    def dois_for(self, sha256: str) -> 'list[str]':
+        """DOIs whose pdf has the given hash, more than one means duplicate content"""
+        with self._lock:
+            rows = self._conn.execute('SELECT doi FROM doi_hash WHERE sha256 = ? ORDER BY doi', (sha256,)).fetchall()
+        return [r[0] for r in rows]
+
+    def path_for(self, doi: str) -> Path:
+        """Location of the pdf stored for `doi`
+
+        Raises:
+            KeyError: If no pdf is stored for `doi`
+        """
+        sha256 = self.hash_for(doi)
+        if sha256 is None:
+            raise KeyError(doi)
+        return self.object_path(sha256)
+
+    def source_for(self, sha256: str) -> 'Union[Path, PackedPdf]':
+        """Something to `read_bytes` the pdf with the given hash from, in this or a worker process
+
+        That is the object's path, or where it is archived once it was pruned.
+        """
+        path = self.object_path(sha256)
+        if self._archive is not None and not path.exists():
+            try:
+                return self._archive.locate(sha256)
+            except KeyError:
+                pass
+        return path
+
+    def open(self, doi: str) -> BinaryIO:
+        """Opens the pdf stored for `doi` for binary reading, from the archive if it was pruned"""
+        path = self.path_for(doi)
+        if self._archive is not None and not path.exists():
+            return self._archive.open_object(path.stem)
+        return path.open(mode='rb')
+
+    def link_to(self, doi: str, dest: Path) -> None:
+        """Makes the pdf for `doi` available at `dest`, hardlinked where possible instead of copied"""
+        src = self.path_for(doi)
+        if self._archive is not None and not src.exists():
+            with self._archive.open_object(src.stem) as reader, Path(dest).open(mode='xb') as f:
+                shutil.copyfileobj(reader, f, CHUNK_SIZE)
+            return
+        try:
+            os.link(src, dest)
+        except OSError:
+            shutil.copyfile(src, dest)
+
+    def items(self) -> 'Iterator[tuple[str, str, int]]':
+        """All `(doi, sha256, size)` entries of the index"""
+        with self._lock:
+            rows = self._conn.execute('SELECT doi, sha256, size FROM doi_hash ORDER BY doi').fetchall()
+        return iter(rows)
+
+    def remove(self, doi: str) -> None:
+        """Forgets `doi`, its object is deleted once no other DOI refers to it"""
+        sha256 = self.hash_for(doi)
+        if sha256 is None:
+            return
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM doi_hash WHERE doi = ?', (doi,))
+            still_used = self._conn.execute('SELECT 1 FROM doi_hash WHERE sha256 = ?', (sha256,)).fetchone()
+        if still_used is None:
+            self.object_path(sha256).unlink(missing_ok=True)
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+def hash_file(path: Path) -> 'tuple[str, int]':
+    """SHA-256 and size of a file, read in chunks"""
+    digest = hashlib.sha256()
+    size = 0
+    with Path(path).open(mode='rb') as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size
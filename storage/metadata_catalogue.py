@@ -0,0 +1,217 @@
+import json
+import os
+import threading
+import uuid
+from pathlib import Path
+from time import time
+from typing import Iterable, Iterator
+
+# pyarrow is only needed for the local catalogue, uploads work without it
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+    from pyarrow import fs
+except ImportError:
+    pa = None
+
+from pipeline.journal_resolver import match_key
+
+# Year of records without a usable one
+UNKNOWN_YEAR = 0
+
+
+def _schema() -> 'pa.Schema':
+    return pa.schema([
+        ('doi', pa.string()),
+        ('title', pa.string()),
+        ('journal_name', pa.string()),
+        ('author_initial', pa.string()),
+        ('author_surname', pa.string()),
+        ('category_id', pa.string()),
+        ('year', pa.int16()),
+        ('added_at', pa.timestamp('s')),
+    ])
+
+
+def partition_key(journal_name: str) -> str:
+    """Directory-safe journal partition value, the words of the name joined by hyphens"""
+    return match_key(journal_name or '').replace(' ', '-') or 'unknown'
+
+
+def _year(value) -> int:
+    try:
+        return int(str(value).strip()[:4])
+    except ValueError:
+        return UNKNOWN_YEAR
+
+
+class MetadataCatalogue:
+    """Local columnar copy of the metadata uploaded for every article
+
+    Records are the API's metadata records (see `api_metadata`). They are buffered and written
+    as Parquet under a `journal=<key>/` directory per journal, one new file sorted by year per
+    journal and flush, so an interrupted run loses at most the current buffer. A journal has
+    a few dozen papers a year, too few for a directory per year, but the sorted year column
+    lets readers skip row groups of other years by their statistics. `compact` folds each
+    journal's files into one.
+
+    Reads go through a memory-mapped pyarrow dataset, so a report only touches the columns
+    and journals it needs.
+
+    Args:
+        * root (Path) : Catalogue directory, created if missing
+        * flush_rows (int, optional) : Records buffered before they are written. Defaults to 1000.
+        * resolver (JournalResolver, optional) : Files journals the catalogue knows under their
+            canonical ID, whatever the spelling. Defaults to `partition_key` of the name as given.
+
+    Raises:
+        ImportError: If pyarrow is not installed
+    """
+
+    _root : Path = None
+
+    _buffer : 'list[dict]' = None
+
+    _lock : threading.Lock = None
+
+    def __init__(self, root: Path, flush_rows: int = 1000, resolver=None) -> None:
+        if pa is None:
+            raise ImportError('The metadata catalogue needs pyarrow, install it with `pip install pyarrow`')
+
+        self._root = Path(root)
+        self._root.mkdir(parents=True, exist_ok=True)
+        self._flush_rows = flush_rows
+        self._resolver = resolver
+        self._schema = _schema()
+        # Upload workers add records from their own threads
+        self._lock = threading.Lock()
+        self._buffer = []
+
+    @property
+    def root(self) -> Path:
+        return self._root
+
+    def add(self, record: dict) -> None:
+        """Buffers one metadata record, flushing once `flush_rows` are buffered"""
+        self.add_many([record])
+
+    def add_many(self, records: Iterable[dict]) -> None:
+        now = int(time())
+        with self._lock:
+            for record in records:
+                self._buffer.append({
+                    'doi': record.get('DOI'),
+                    'title': record.get('Title'),
+                    'journal_name': record.get('JournalName'),
+                    'author_initial': record.get('AuthorInitial'),
+                    'author_surname': record.get('AuthorSurname'),
+                    'category_id': record.get('CategoryID'),
+                    'added_at': now,
+                    'year': _year(record.get('YearPublished')),
+                })
+                if len(self._buffer) >= self._flush_rows:
+                    self._flush()
+
+    def flush(self) -> None:
+        """Writes every buffered record"""
+        with self._lock:
+            self._flush()
+
+    def close(self) -> None:
+        self.flush()
+
+    def __enter__(self) -> 'MetadataCatalogue':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _flush(self) -> None:
+        partitions = {}
+        for row in self._buffer:
+            partitions.setdefault(self._partition(row['journal_name']), []).append(row)
+        self._buffer = []
+
+        for journal, rows in partitions.items():
+            table = pa.Table.from_pylist(rows, schema=self._schema)
+            directory = self._root.joinpath(f'journal={journal}')
+            directory.mkdir(exist_ok=True)
+            _write_atomic(table, directory.joinpath(f'part-{uuid.uuid4().hex}.parquet'))
+
+    def _partition(self, journal_name: str) -> str:
+        resolved = self._resolver.resolve(journal_name) if self._resolver is not None and journal_name else None
+        return resolved.journal_id if resolved is not None else partition_key(journal_name)
+
+    def compact(self) -> int:
+        """Rewrites every journal that has several files as one file
+
+        Returns:
+            int: Number of journals rewritten
+        """
+        rewritten = 0
+        with self._lock:
+            for directory in sorted(self._root.glob('journal=*')):
+                parts = sorted(directory.glob('*.parquet'))
+                if len(parts) < 2:
+                    continue
+                table = pa.concat_tables(pq.read_table(p, memory_map=True, schema=self._schema) for p in parts)
+                _write_atomic(table, directory.joinpath(f'part-{uuid.uuid4().hex}.parquet'))
+                for p in parts:
+                    p.unlink()
+                rewritten += 1
+        return rewritten
+
+    def dataset(self) -> 'ds.Dataset':
+        """Every written record, memory-mapped, with `journal` from the partition directories"""
+        journal = pa.schema([('journal', pa.string())])
+        partitioning = ds.partitioning(journal, flavor='hive')
+        # The schema is given, so an empty catalogue still has every column
+        return ds.dataset(self._root, schema=pa.unify_schemas([self._schema, journal]), format='parquet',
+                          partitioning=partitioning, filesystem=fs.LocalFileSystem(use_mmap=True),
+                          ignore_prefixes=['.', '_'])
+
+    def __len__(self) -> int:
+        return self.dataset().count_rows()
+
+    def papers_per_journal_year(self, journal: str = None) -> 'pa.Table':
+        """Distinct DOIs per journal and year, sorted by journal then year
+
+        Args:
+            * journal (str, optional) : Only this journal, by name or partition key
+        """
+        dataset = self.dataset()
+        filter = ds.field('journal') == self._partition(journal) if journal is not None else None
+        table = dataset.to_table(columns=['journal', 'journal_name', 'year', 'doi'], filter=filter)
+        counts = table.group_by(['journal', 'year']).aggregate([('doi', 'count_distinct'), ('journal_name', 'min')])
+        counts = counts.rename_columns({'doi_count_distinct': 'papers', 'journal_name_min': 'journal_name'})
+        return counts.select(['journal', 'journal_name', 'year', 'papers']).sort_by([('journal', 'ascending'), ('year', 'ascending')])
+
+    def missing_years(self, journal: str = None) -> 'dict[str, list[int]]':
+        """Years without any paper between each journal's first and last harvested year"""
+        counts = self.papers_per_journal_year(journal)
+        years = {}
+        for key, year in zip(counts['journal'].to_pylist(), counts['year'].to_pylist()):
+            if year != UNKNOWN_YEAR:
+                years.setdefault(key, set()).add(year)
+        return {key: [y for y in range(min(found), max(found) + 1) if y not in found] for key, found in years.items()}
+
+    def dois(self) -> 'set[str]':
+        """Every DOI in the catalogue"""
+        return set(pc.unique(self.dataset().to_table(columns=['doi'])['doi']).to_pylist())
+
+
+def _write_atomic(table: 'pa.Table', path: Path) -> None:
+    # Readers skip the dot-prefixed file until it is complete
+    tmp = path.with_name('.' + path.name)
+    pq.write_table(table.sort_by('year'), tmp, compression='zstd')
+    os.replace(tmp, path)
+
+
+def read_metadata_log(path: Path) -> Iterator[dict]:
+    """Reads the records of a MetadataBatcher log, see `metadata_log` in the config"""
+    with Path(path).open(encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
@@ -0,0 +1,496 @@
+import hashlib
+import mmap
+import os
+import sqlite3
+import struct
+import threading
+import zlib
+from pathlib import Path
+from time import time
+from typing import Iterator, NamedTuple
+
+# zstd compresses pdfs a little better and decompresses much faster, zlib is the fallback
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from storage.content_store import CHUNK_SIZE
+
+# Every record is a header followed by the payload: magic, codec, raw SHA-256, payload length
+# and pdf size. The headers make a pack readable, and its index rebuildable, on its own.
+RECORD_MAGIC = b'PDFR'
+_HEADER = struct.Struct('<4sB32sQQ')
+
+CODEC_STORED = 0
+CODEC_ZLIB = 1
+CODEC_ZSTD = 2
+
+# A pdf is kept compressed only if that saves at least this share of its size. Most pdfs
+# are mostly deflated streams already, stored ones are read straight from the mapping.
+MIN_SAVING = 0.05
+
+# Packs are closed for appending once they reach this size
+MAX_PACK_BYTES = 1024 ** 3
+
+
+class ArchiveCorruptError(Exception):
+    pass
+
+
+def _compress(data: bytes) -> 'tuple[int, bytes]':
+    if zstandard is not None:
+        codec, packed = CODEC_ZSTD, zstandard.ZstdCompressor(level=9).compress(data)
+    else:
+        codec, packed = CODEC_ZLIB, zlib.compress(data, 6)
+    if len(packed) > len(data) * (1 - MIN_SAVING):
+        return CODEC_STORED, data
+    return codec, packed
+
+
+def _decompressor(codec: int):
+    if codec == CODEC_ZLIB:
+        return zlib.decompressobj()
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise ImportError('This pdf was archived with zstd, install it with `pip install zstandard`')
+        return zstandard.ZstdDecompressor().decompressobj()
+    raise ArchiveCorruptError(f'Unknown codec {codec}')
+
+
+class PackReader:
+    """Read-only, streaming file object over one archived pdf
+
+    Stored pdfs are sliced from the pack mapping, compressed ones are decompressed chunk by
+    chunk, so a pdf is never held in memory as a whole. `len` is the size of the pdf, which
+    is what requests needs to stream it as a request body.
+    """
+
+    def __init__(self, view: memoryview, codec: int, size: int) -> None:
+        self.len = size
+        self._view = view
+        self._decompressor = None if codec == CODEC_STORED else _decompressor(codec)
+        self._pos = 0
+        self._pending = b''
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = self.len
+        if self._decompressor is None:
+            chunk = bytes(self._view[self._pos:self._pos + size])
+            self._pos += len(chunk)
+            return chunk
+
+        while len(self._pending) < size and self._pos < len(self._view):
+            compressed = self._view[self._pos:self._pos + CHUNK_SIZE]
+            self._pos += len(compressed)
+            self._pending += self._decompressor.decompress(compressed)
+        chunk, self._pending = self._pending[:size], self._pending[size:]
+        return chunk
+
+    def readable(self) -> bool:
+        return True
+
+    def close(self) -> None:
+        self._view.release()
+
+    def __enter__(self) -> 'PackReader':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class PackedPdf(NamedTuple):
+    """Where an archived pdf is, for worker processes that read it without the archive
+
+    It reads like a `Path` to the pdf, with `read_bytes`, so workers take either.
+    """
+    pack_path: str
+    offset: int
+    length: int
+    size: int
+    codec: int
+
+    def read_bytes(self) -> bytes:
+        with open(self.pack_path, 'rb') as f:
+            f.seek(self.offset)
+            payload = f.read(self.length)
+        if len(payload) != self.length:
+            raise ArchiveCorruptError(f'{self.pack_path}: record at offset {self.offset} is truncated')
+        if self.codec == CODEC_STORED:
+            return payload
+        return _decompressor(self.codec).decompress(payload)
+
+
+class PackArchive:
+    """Append-only archive of pdfs in a few large pack files, indexed by DOI and SHA-256
+
+    Hundreds of thousands of loose pdfs cost an inode each and make backups crawl, so finished
+    pdfs can be moved here instead. Each pdf is appended once per content hash to the newest
+    `packs/pack-<n>.pack` as a self-describing record, compressed with zstd (or zlib without
+    it) where that pays off. A SQLite index maps each DOI to its hash and each hash to the
+    pack, offset and length of its record, so a read is one lookup and a slice of the
+    memory-mapped pack.
+
+    Records are written and synced before they are indexed. A record left unindexed by a crash
+    is cut off the end of the pack when the archive is next opened. Removed pdfs stay in their
+    pack until `compact` rewrites it.
+
+    Args:
+        * root (Path) : Directory holding the archive, created if missing
+        * max_pack_bytes (int, optional) : Size at which a new pack is started. Defaults to 1 GiB.
+    """
+
+    _root : Path = None
+
+    _packs : Path = None
+
+    _conn : sqlite3.Connection = None
+
+    _lock : threading.Lock = None
+
+    _maps : 'dict[int, mmap.mmap]' = None
+
+    def __init__(self, root: Path, max_pack_bytes: int = MAX_PACK_BYTES) -> None:
+        self._root = Path(root).resolve()
+        self._packs = self._root.joinpath('packs')
+        self._packs.mkdir(parents=True, exist_ok=True)
+        self._max_pack_bytes = max_pack_bytes
+
+        self._lock = threading.Lock()
+        self._maps = {}
+        self._conn = sqlite3.connect(str(self._root.joinpath('index.sqlite3')), check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        with self._conn:
+            self._conn.execute('''CREATE TABLE IF NOT EXISTS objects (
+                                    sha256 TEXT PRIMARY KEY,
+                                    pack INTEGER NOT NULL,
+                                    offset INTEGER NOT NULL,
+                                    length INTEGER NOT NULL,
+                                    size INTEGER NOT NULL,
+                                    codec INTEGER NOT NULL
+                                  )''')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS objects_pack ON objects (pack, offset)')
+            self._conn.execute('''CREATE TABLE IF NOT EXISTS doi_hash (
+                                    doi TEXT PRIMARY KEY,
+                                    sha256 TEXT NOT NULL,
+                                    added_at REAL NOT NULL
+                                  )''')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS doi_hash_sha256 ON doi_hash (sha256)')
+
+        self._truncate_unindexed()
+
+    @property
+    def root(self) -> Path:
+        return self._root
+
+    def pack_path(self, pack: int) -> Path:
+        return self._packs.joinpath(f'pack-{pack:06d}.pack')
+
+    def _pack_numbers(self) -> 'list[int]':
+        return sorted(int(p.stem[len('pack-'):]) for p in self._packs.glob('pack-*.pack'))
+
+    def _truncate_unindexed(self) -> None:
+        numbers = self._pack_numbers()
+        if not numbers:
+            return
+        last = numbers[-1]
+        end = self._conn.execute('SELECT MAX(offset + length) FROM objects WHERE pack = ?', (last,)).fetchone()[0] or 0
+        path = self.pack_path(last)
+        if path.stat().st_size > end:
+            os.truncate(path, end)
+
+    def put_bytes(self, doi: str, data: bytes) -> str:
+        """Archives an in-memory pdf under `doi`
+
+        Returns:
+            str: SHA-256 of the pdf
+        """
+        sha256 = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            known = self._conn.execute('SELECT 1 FROM objects WHERE sha256 = ?', (sha256,)).fetchone()
+        if known is None:
+            codec, payload = _compress(data)
+            self._append(sha256, codec, payload, len(data))
+        self.link(doi, sha256)
+        return sha256
+
+    def link(self, doi: str, sha256: str) -> None:
+        """Archives `doi` as one more DOI of an archived pdf
+
+        Raises:
+            KeyError: If no pdf with that hash is archived
+        """
+        with self._lock, self._conn:
+            if self._conn.execute('SELECT 1 FROM objects WHERE sha256 = ?', (sha256,)).fetchone() is None:
+                raise KeyError(sha256)
+            self._conn.execute('INSERT OR REPLACE INTO doi_hash (doi, sha256, added_at) VALUES (?, ?, ?)',
+                               (doi, sha256, time()))
+
+    def put_file(self, doi: str, path: Path) -> str:
+        """Archives a pdf that is on disk, see `put_bytes`"""
+        return self.put_bytes(doi, Path(path).read_bytes())
+
+    def _append(self, sha256: str, codec: int, payload: bytes, size: int, pack: int = None) -> int:
+        # Appends to the newest pack, or to `pack`, or the one after it once that is full
+        header = _HEADER.pack(RECORD_MAGIC, codec, bytes.fromhex(sha256), len(payload), size)
+        with self._lock:
+            if pack is None:
+                numbers = self._pack_numbers()
+                pack = numbers[-1] if numbers else 1
+            path = self.pack_path(pack)
+            if path.exists() and path.stat().st_size + len(header) + len(payload) > self._max_pack_bytes:
+                pack += 1
+                path = self.pack_path(pack)
+
+            with path.open(mode='ab') as f:
+                start = f.tell()
+                f.write(header)
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+
+            with self._conn:
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO objects (sha256, pack, offset, length, size, codec) VALUES (?, ?, ?, ?, ?, ?)',
+                    (sha256, pack, start + _HEADER.size, len(payload), size, codec)
+                )
+        return pack
+
+    def __contains__(self, doi: str) -> bool:
+        return self.hash_for(doi) is not None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM doi_hash').fetchone()[0]
+
+    def hash_for(self, doi: str) -> str:
+        """SHA-256 of the pdf archived for `doi`, or None"""
+        with self._lock:
+            row = self._conn.execute('SELECT sha256 FROM doi_hash WHERE doi = ?', (doi,)).fetchone()
+        return row[0] if row is not None else None
+
+    def has_object(self, sha256: str) -> bool:
+        with self._lock:
+            return self._conn.execute('SELECT 1 FROM objects WHERE sha256 = ?', (sha256,)).fetchone() is not None
+
+    def _map(self, pack: int, end: int) -> mmap.mmap:
+        # Called with the lock held. The newest pack grows, so its mapping is renewed once
+        # it no longer covers a record. Older mappings stay alive for views handed out.
+        mapped = self._maps.get(pack)
+        if mapped is None or len(mapped) < end:
+            with self.pack_path(pack).open(mode='rb') as f:
+                mapped = self._maps[pack] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return mapped
+
+    def locate(self, sha256: str) -> PackedPdf:
+        """Location of the archived pdf with the given hash
+
+        Raises:
+            KeyError: If no pdf with that hash is archived
+        """
+        with self._lock:
+            row = self._conn.execute('SELECT pack, offset, length, size, codec FROM objects WHERE sha256 = ?',
+                                     (sha256,)).fetchone()
+        if row is None:
+            raise KeyError(sha256)
+        return PackedPdf(str(self.pack_path(row[0])), *row[1:])
+
+    def open_object(self, sha256: str) -> PackReader:
+        """Opens the archived pdf with the given hash for streaming reads
+
+        Raises:
+            KeyError: If no pdf with that hash is archived
+        """
+        with self._lock:
+            row = self._conn.execute('SELECT pack, offset, length, size, codec FROM objects WHERE sha256 = ?',
+                                     (sha256,)).fetchone()
+            if row is None:
+                raise KeyError(sha256)
+            pack, offset, length, size, codec = row
+            view = memoryview(self._map(pack, offset + length))[offset:offset + length]
+        return PackReader(view, codec, size)
+
+    def open(self, doi: str) -> PackReader:
+        """Opens the pdf archived for `doi` for streaming reads
+
+        Raises:
+            KeyError: If no pdf is archived for `doi`
+        """
+        sha256 = self.hash_for(doi)
+        if sha256 is None:
+            raise KeyError(doi)
+        return self.open_object(sha256)
+
+    def read(self, doi: str) -> bytes:
+        """The whole pdf archived for `doi`, see `open`"""
+        with self.open(doi) as reader:
+            return reader.read()
+
+    def items(self) -> 'Iterator[tuple[str, str, int]]':
+        """All `(doi, sha256, size)` entries of the index"""
+        with self._lock:
+            rows = self._conn.execute('''SELECT d.doi, d.sha256, o.size FROM doi_hash d
+                                         JOIN objects o ON o.sha256 = d.sha256 ORDER BY d.doi''').fetchall()
+        return iter(rows)
+
+    def remove(self, doi: str) -> None:
+        """Forgets `doi`, its record is dropped by `compact` once no other DOI refers to it"""
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM doi_hash WHERE doi = ?', (doi,))
+
+    def stats(self) -> 'dict[str, int]':
+        """Packs, bytes on disk, bytes of pdfs still referred to, and their uncompressed size"""
+        with self._lock:
+            live, size = self._conn.execute('''SELECT COALESCE(SUM(length + ?), 0), COALESCE(SUM(size), 0) FROM objects
+                                               WHERE sha256 IN (SELECT sha256 FROM doi_hash)''',
+                                            (_HEADER.size,)).fetchone()
+        packs = self._pack_numbers()
+        return {'packs': len(packs),
+                'disk_bytes': sum(self.pack_path(p).stat().st_size for p in packs),
+                'live_bytes': live,
+                'pdf_bytes': size}
+
+    def compact(self, min_dead: float = 0.25) -> int:
+        """Rewrites every pack in which removed pdfs take up at least `min_dead` of the bytes
+
+        Live records are copied as they are, without recompressing, to new packs, and each old
+        pack is deleted once they are indexed there. Until then the index
+        points at one copy or the other, so an interrupted compaction loses nothing.
+
+        Returns:
+            int: Number of packs rewritten
+        """
+        rewritten = 0
+        packs = self._pack_numbers()
+        target = packs[-1] + 1 if packs else None
+        for pack in packs:
+            with self._lock:
+                rows = self._conn.execute('''SELECT sha256, offset, length, size, codec FROM objects WHERE pack = ?
+                                             AND sha256 IN (SELECT sha256 FROM doi_hash) ORDER BY offset''',
+                                          (pack,)).fetchall()
+            path = self.pack_path(pack)
+            live = sum(length + _HEADER.size for _, _, length, _, _ in rows)
+            if live > path.stat().st_size * (1 - min_dead):
+                continue
+
+            with path.open(mode='rb') as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                for sha256, offset, length, size, codec in rows:
+                    target = self._append(sha256, codec, mapped[offset:offset + length], size, target)
+            finally:
+                mapped.close()
+
+            with self._lock, self._conn:
+                # Only the removed pdfs are left pointing at this pack
+                self._conn.execute('DELETE FROM objects WHERE pack = ?', (pack,))
+                old = self._maps.pop(pack, None)
+            if old is not None:
+                try:
+                    old.close()
+                except BufferError:
+                    # A reader still has a view, the mapping goes when it does
+                    pass
+            path.unlink()
+            rewritten += 1
+        return rewritten
+
+    def verify(self) -> 'list[str]':
+        """SHA-256 of every archived pdf whose record or content does not match its index entry"""
+        with self._lock:
+            rows = self._conn.execute('SELECT sha256, pack, offset FROM objects ORDER BY pack, offset').fetchall()
+        bad = []
+        for sha256, pack, offset in rows:
+            with self._lock:
+                magic, _, digest, _, _ = _HEADER.unpack(self._map(pack, offset)[offset - _HEADER.size:offset])
+            if magic != RECORD_MAGIC or digest.hex() != sha256 or _content_hash(self.open_object(sha256)) != sha256:
+                bad.append(sha256)
+        return bad
+
+    def close(self) -> None:
+        with self._lock:
+            for mapped in self._maps.values():
+                try:
+                    mapped.close()
+                except BufferError:
+                    pass
+            self._maps.clear()
+        self._conn.close()
+
+
+def _content_hash(reader: PackReader) -> str:
+    digest = hashlib.sha256()
+    with reader:
+        try:
+            for chunk in iter(lambda: reader.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+        except (zlib.error, ArchiveCorruptError):
+            return None
+    return digest.hexdigest()
+
+
+def scan_pack(path: Path) -> 'Iterator[tuple[str, int, int, int, int]]':
+    """Reads the records of a pack file without its index
+
+    Yields:
+        tuple: `(sha256, offset, length, size, codec)` of each complete record, offset of the payload
+    """
+    with Path(path).open(mode='rb') as f:
+        end = os.fstat(f.fileno()).st_size
+        if end == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            pos = 0
+            while pos + _HEADER.size <= end:
+                magic, codec, digest, length, size = _HEADER.unpack_from(mapped, pos)
+                if magic != RECORD_MAGIC:
+                    raise ArchiveCorruptError(f'{path}: no record at offset {pos}')
+                if pos + _HEADER.size + length > end:
+                    return
+                yield digest.hex(), pos + _HEADER.size, length, size, codec
+                pos += _HEADER.size + length
+
+
+def archive_store(store, archive: PackArchive, dois: 'set[str]' = None, prune: bool = False) -> 'dict[str, int]':
+    """Copies the pdfs of a ContentStore into a PackArchive
+
+    Args:
+        * store (ContentStore) : Store to archive
+        * archive (PackArchive) : Archive to append to
+        * dois (set[str], optional) : Only these DOIs. Defaults to every stored DOI.
+        * prune (bool, optional) : Delete each loose pdf once every DOI that refers to it is
+            archived. The store keeps the DOIs, and reads them from the archive after that.
+            Defaults to False.
+
+    Returns:
+        dict: Numbers of pdfs `archived`, already archived (`skipped`), `missing` from both, and
+            loose pdfs `pruned`
+    """
+    counts = {'archived': 0, 'skipped': 0, 'missing': 0, 'pruned': 0}
+    archived = set()
+    for doi, sha256, _ in store.items():
+        if dois is not None and doi not in dois:
+            continue
+        path = store.object_path(sha256)
+        if archive.hash_for(doi) == sha256:
+            counts['skipped'] += 1
+        elif archive.has_object(sha256):
+            archive.link(doi, sha256)
+            counts['archived'] += 1
+        elif path.exists():
+            archive.put_file(doi, path)
+            counts['archived'] += 1
+        else:
+            counts['missing'] += 1
+            continue
+        archived.add(sha256)
+
+    if prune:
+        for sha256 in sorted(archived):
+            path = store.object_path(sha256)
+            if path.exists() and all(archive.hash_for(doi) == sha256 for doi in store.dois_for(sha256)):
+                path.unlink()
+                counts['pruned'] += 1
+    return counts